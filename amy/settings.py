@@ -178,6 +178,7 @@ if not ENABLE_PYDATA:
 
 MIDDLEWARE = (
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'workshops.instrumentation.QueryInstrumentationMiddleware',
     'reversion.middleware.RevisionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -215,6 +216,34 @@ if '--keepdb' in sys.argv:
     # applying migrations on each test launch.
     DATABASES['default']['TEST']['NAME'] = 'test_db.sqlite3'
 
+##################### C A C H E S #####################
+
+# Workshop websites are cached (see `workshops.util.fetch_website`) on disk,
+# if AMY_WEBSITES_CACHE_DIR is set, so that the cache survives between runs of
+# management commands.  Otherwise every process keeps its own cache in memory.
+WEBSITES_CACHE_DIR = os.environ.get('AMY_WEBSITES_CACHE_DIR', None)
+WEBSITES_CACHE = {
+    'TIMEOUT': 7 * 24 * 60 * 60,  # a week
+    'OPTIONS': {
+        'MAX_ENTRIES': 2000,
+    },
+}
+if WEBSITES_CACHE_DIR:
+    WEBSITES_CACHE['BACKEND'] = \
+        'django.core.cache.backends.filebased.FileBasedCache'
+    WEBSITES_CACHE['LOCATION'] = WEBSITES_CACHE_DIR
+else:
+    WEBSITES_CACHE['BACKEND'] = \
+        'django.core.cache.backends.locmem.LocMemCache'
+    WEBSITES_CACHE['LOCATION'] = 'websites'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'websites': WEBSITES_CACHE,
+}
+
 ##################### A U T H,  S O C I A L #####################
 
 AUTH_USER_MODEL = 'workshops.Person'
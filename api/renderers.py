@@ -1,11 +1,63 @@
-from rest_framework_csv.renderers import CSVRenderer
+from rest_framework_csv.renderers import CSVStreamingRenderer
+from rest_framework_yaml.compat import yaml
+from rest_framework_yaml.renderers import YAMLRenderer
 
 from .serializers import (
     TrainingRequestWithPersonSerializer,
 )
 
 
-class TrainingRequestCSVRenderer(CSVRenderer):
+class StreamingCSVRenderer(CSVStreamingRenderer):
+    """Renders CSV row by row, as data is produced.  Views using
+    `StreamingResponseMixin` send the rows in a `StreamingHttpResponse`.
+
+    Unless `header` is provided, all rows have to be read first to find out
+    the columns."""
+    streaming = True
+
+    def render(self, data, media_type=None, renderer_context={}):
+        if data is None:
+            data = []
+        elif isinstance(data, dict):
+            data = [data]
+        # parent class streams only generators
+        data = (item for item in data)
+        return super().render(data, media_type, renderer_context)
+
+
+class StreamingYAMLRenderer(YAMLRenderer):
+    """Renders YAML item by item, as data is produced.  Views using
+    `StreamingResponseMixin` send the items in a `StreamingHttpResponse`."""
+    streaming = True
+
+    def _dump(self, data):
+        return yaml.dump(
+            data,
+            stream=None,
+            encoding=self.charset,
+            Dumper=self.encoder,
+            allow_unicode=not self.ensure_ascii,
+            default_flow_style=self.default_flow_style
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return
+
+        if isinstance(data, dict):
+            yield self._dump(data)
+            return
+
+        # a sequence of one-item lists forms a valid YAML list
+        empty = True
+        for item in data:
+            empty = False
+            yield self._dump([item])
+        if empty:
+            yield self._dump([])
+
+
+class TrainingRequestCSVRenderer(StreamingCSVRenderer):
     # sets the columns ordering
     header = TrainingRequestWithPersonSerializer.Meta.fields
     labels = {
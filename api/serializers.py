@@ -127,16 +127,6 @@ class TimelineTodoSerializer(serializers.ModelSerializer):
         )
 
 
-class WorkshopsOverTimeSerializer(serializers.Serializer):
-    date = serializers.DateField(format=None, source='start')
-    count = serializers.IntegerField()
-
-
-class InstructorsOverTimeSerializer(serializers.Serializer):
-    date = serializers.DateField(format=None)
-    count = serializers.IntegerField()
-
-
 class InstructorNumTaughtSerializer(serializers.Serializer):
     person = serializers.HyperlinkedRelatedField(
         read_only=True, view_name='api:person-detail', lookup_field='pk',
@@ -3,6 +3,8 @@ import json
 import unittest
 from unittest.mock import patch
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
@@ -506,6 +508,26 @@ class TestExportingMembers(BaseExportingTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(json.loads(content), self.expecting)
 
+    def test_view_csv_streamed(self):
+        url = reverse('api:export-members')
+        self.login()
+        response = self.client.get(url, {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        # the header is known upfront, so members are fetched only when
+        # the rows are read
+        chunks = iter(response.streaming_content)
+        with self.assertNumQueries(0):
+            header = next(chunks)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = b''.join(chunks)
+        self.assertTrue(ctx.captured_queries)
+        content = (header + rows).decode('utf-8')
+        self.assertEqual(content.splitlines(), [
+            'email,name,username',
+            'peter@webslinger.net,Peter Q. Parker,spiderman',
+        ])
+
 
 class TestExportingPersonData(BaseExportingTest):
     def setUp(self):
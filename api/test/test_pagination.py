@@ -0,0 +1,56 @@
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework import status
+
+from api.test.base import APITestBase
+from workshops.models import Person
+
+
+class TestKeysetPagination(APITestBase):
+    def setUp(self):
+        self.admin = Person.objects.create_superuser(
+            username='admin', personal='Super', family='User',
+            email='sudo@example.org', password='admin')
+        self.admin.data_privacy_agreement = True
+        self.admin.save()
+        for i in range(5):
+            Person.objects.create(
+                username='person{}'.format(i), personal='Person',
+                family='Number {}'.format(i),
+                email='person{}@example.org'.format(i))
+        self.client.login(username='admin', password='admin')
+        self.url = reverse('api:person-list')
+        caches['default'].clear()
+
+    def test_following_next_links(self):
+        """Ensure `next` links lead through all persons, in order."""
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6)
+        self.assertIsNone(response.data['previous'])
+
+        usernames = []
+        while True:
+            usernames.extend(p['username'] for p in response.data['results'])
+            if response.data['next'] is None:
+                break
+            self.assertIn('after=', response.data['next'])
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(
+            usernames,
+            list(Person.objects.order_by('family', 'personal', 'pk')
+                               .values_list('username', flat=True)),
+        )
+
+    def test_invalid_cursor(self):
+        """Ensure malformed cursor results in 404 Not Found."""
+        response = self.client.get(self.url, {'after': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number(self):
+        """Ensure numbered pages are still served."""
+        response = self.client.get(self.url, {'page_size': 2, 'page': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIn('page=3', response.data['next'])
@@ -1,25 +1,35 @@
+from contextlib import redirect_stdout
 import datetime
+from io import StringIO
 import json
-from unittest.mock import MagicMock
+from unittest.mock import patch
 
-from django.http import QueryDict
+from django.core.management import call_command
+from django.db import transaction
 from django.urls import reverse
 from rest_framework import status
+import yaml
 
 from api.test.base import APITestBase
 from api.views import (
     ReportsViewSet,
 )
 from workshops.models import (
+    ActivitySnapshot,
     Badge,
     Award,
     Person,
     Role,
     Organization,
+    Tag,
     Task,
     Event,
 )
-from workshops.test.base import TestBase
+from workshops.reports import (
+    _create_missing_snapshots,
+    refresh_activity_snapshots,
+)
+from workshops.test.base import TestBase, run_on_commit_callbacks
 
 
 class BaseReportingTest(APITestBase):
@@ -55,11 +65,12 @@ class TestReportingInstructorNumTaught(BaseReportingTest):
             email='user1@name.org',
         )
         instructor_role, _ = Role.objects.get_or_create(name='instructor')
-        Task.objects.create(
-            event=event,
-            person=instructor,
-            role=instructor_role
-        )
+        with run_on_commit_callbacks():
+            Task.objects.create(
+                event=event,
+                person=instructor,
+                role=instructor_role
+            )
         # Award a SWC Badge
         Award.objects.create(person=instructor, badge=swc_instructor)
         # Award a DC Badge
@@ -85,70 +96,62 @@ class TestReportingInstructorNumTaught(BaseReportingTest):
         self.assertEqual(json.loads(content), self.expecting)
 
 
-class TestCSVYAMLListSerialization(BaseReportingTest):
+class TestStreamingCSVYAML(BaseReportingTest):
     def setUp(self):
-        self.iterable = zip(['list', 'dict', 'tuple'],
-                            ['set', 'namedtuple', 'OrderedDict'])
-        self.formats = ReportsViewSet.formats_requiring_lists
-
-    def test_listify_query_param(self):
-        """Regression test: make sure it's possible to iterate through results
-        serialized with CSV or YAML serializer.
-
-        This test uses `?format' query param."""
-        rvs = ReportsViewSet()
-        for format_ in self.formats:
-            with self.subTest(format=format_):
-                mock_request = MagicMock()
-                mock_request.query_params = QueryDict('format={}'
-                                                      .format(format_))
-                result = rvs.listify(self.iterable, mock_request)
-                self.assertEqual(type(result), type(list()))
-
-    def test_listify_format_as_param(self):
-        """Regression test: make sure it's possible to iterate through results
-        serialized with CSV or YAML serializer.
-
-        This test uses 'format' function parameter."""
-        rvs = ReportsViewSet()
-        for format_ in self.formats:
-            with self.subTest(format=format_):
-                mock_request = MagicMock()
-                mock_request.query_params = QueryDict()
-                result = rvs.listify(self.iterable, mock_request,
-                                     format=format_)
-                self.assertEqual(type(result), type(list()))
-
-    def test_iterator_when_not_forbidden_format(self):
-        """Ensure other formats than self.formats return iterators/generators,
-        not lists."""
-        format_ = 'json'
-        self.assertNotIn(format_, self.formats)
-
-        rvs = ReportsViewSet()
-        mock_request = MagicMock()
-        mock_request.query_params = QueryDict()
-        result = rvs.listify(self.iterable, mock_request,
-                             format=format_)
-        self.assertNotEqual(type(result), type(list()))
-
-    def test_embedded_iterator_listified(self):
-        """Regression: test if advanced structure, generated e.g. by
+        super().setUp()
+        TestBase._setUpTags(self)
+        host = Organization.objects.create(domain='host.edu',
+                                           fullname='Organization EDU')
+        Event.objects.create(slug='2016-01-10-swc', host=host,
+                             start=datetime.date(2016, 1, 10))
+        Event.objects.create(slug='2016-02-01-swc', host=host,
+                             start=datetime.date(2016, 2, 1))
+
+    def get_streamed(self, name, format_, query=None):
+        url = reverse('api:reports-{}'.format(name))
+        response = self.client.get(url, dict(query or {}, format=format_))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        content = self.get_streamed('workshops-over-time', 'csv')
+        self.assertEqual(content.splitlines(), [
+            'date,count',
+            '2016-01-10,1',
+            '2016-02-01,2',
+        ])
+
+    def test_yaml(self):
+        content = self.get_streamed('workshops-over-time', 'yaml')
+        self.assertEqual(yaml.safe_load(content), [
+            {'date': datetime.date(2016, 1, 10), 'count': 1},
+            {'date': datetime.date(2016, 2, 1), 'count': 2},
+        ])
+
+    def test_empty_yaml(self):
+        content = self.get_streamed('workshops-over-time', 'yaml',
+                                    {'tags': [Tag.objects.get(name='DC').pk]})
+        self.assertEqual(yaml.safe_load(content), [])
+
+    def test_all_activity_over_time(self):
+        """Regression: test if advanced structure, generated by
         `all_activity_over_time` report, doesn't raise RepresenterError when
         used with YAML renderer."""
-        t = TestBase()
-        t.setUp()
-        t._setUpTags()
+        query = {'start': '2016-01-01', 'end': '2016-12-31'}
+        content = self.get_streamed('all-activity-over-time', 'yaml', query)
+        data = yaml.safe_load(content)
+        self.assertEqual(data['workshops']['SWC'], 0)
+        self.assertEqual(data['missing']['attendance'],
+                         ['2016-01-10-swc', '2016-02-01-swc'])
 
-        format_ = 'yaml'
-        self.assertIn(format_, self.formats)
+        content = self.get_streamed('all-activity-over-time', 'csv', query)
+        self.assertEqual(len(content.splitlines()), 2)
 
-        rvs = ReportsViewSet()
-        mock_request = MagicMock()
-        mock_request.query_params = QueryDict()
-        data = rvs.all_activity_over_time(mock_request, format=format_).data
-        self.assertEqual(type(data['missing']['attendance']), type([]))
-        self.assertEqual(type(data['missing']['instructors']), type([]))
+    def test_json_not_streamed(self):
+        url = reverse('api:reports-workshops-over-time')
+        response = self.client.get(url, {'format': 'json'})
+        self.assertFalse(response.streaming)
 
 
 class TestNotCountingInstructorsTwice(BaseReportingTest):
@@ -188,3 +191,260 @@ class TestNotCountingInstructorsTwice(BaseReportingTest):
             {'count': 1, 'date': '2016-10-02'},
             {'count': 2, 'date': '2016-10-04'},
         ])
+
+
+class TestCumulativeOverTime(BaseReportingTest):
+    def setUp(self):
+        super().setUp()
+
+        TestBase._setUpTags(self)
+        swc = Tag.objects.get(name='SWC')
+        dc = Tag.objects.get(name='DC')
+        host = Organization.objects.create(domain='host.edu',
+                                           fullname='Organization EDU')
+
+        events = [
+            ('2016-01-10-swc', datetime.date(2016, 1, 10), 10, [swc]),
+            ('2016-01-10-dc', datetime.date(2016, 1, 10), None, [dc]),
+            ('2016-02-01-swc-dc', datetime.date(2016, 2, 1), 20, [swc, dc]),
+            ('2016-03-01-swc', datetime.date(2016, 3, 1), 5, [swc]),
+        ]
+        for slug, start, attendance, tags in events:
+            event = Event.objects.create(slug=slug, host=host, start=start,
+                                         attendance=attendance)
+            event.tags.set(tags)
+
+    def get(self, name, query):
+        url = reverse('api:reports-{}'.format(name))
+        response = self.client.get(url, query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_workshops_over_time(self):
+        expected = [
+            {'date': '2016-01-10', 'count': 2},
+            {'date': '2016-02-01', 'count': 3},
+            {'date': '2016-03-01', 'count': 4},
+        ]
+        self.assertEqual(self.get('workshops-over-time', {'format': 'json'}),
+                         expected)
+
+        # events with both tags are counted once
+        swc, dc = Tag.objects.get(name='SWC'), Tag.objects.get(name='DC')
+        data = self.get('workshops-over-time',
+                        {'format': 'json', 'tags': [swc.pk, dc.pk]})
+        self.assertEqual(data, expected)
+
+    def test_learners_over_time(self):
+        self.assertEqual(self.get('learners-over-time', {'format': 'json'}), [
+            {'date': '2016-01-10', 'count': 10},
+            {'date': '2016-02-01', 'count': 30},
+            {'date': '2016-03-01', 'count': 35},
+        ])
+
+    def test_without_window_functions(self):
+        """Running total is calculated in Python on databases without window
+        functions."""
+        with patch('workshops.reports._supports_window_functions',
+                   return_value=False):
+            self.test_workshops_over_time()
+            self.test_learners_over_time()
+
+
+class TestAllActivityOverTime(BaseReportingTest):
+    def setUp(self):
+        super().setUp()
+
+        TestBase._setUpTags(self)
+        swc = Tag.objects.get(name='SWC')
+        dc = Tag.objects.get(name='DC')
+        self.ttt = Tag.objects.get(name='TTT')
+        self.instructor_role, _ = Role.objects.get_or_create(
+            name='instructor')
+
+        host = Organization.objects.create(domain='host.edu',
+                                           fullname='Organization EDU')
+        self_organized, _ = Organization.objects.get_or_create(
+            domain='self-organized', defaults=dict(fullname='Self Organized'))
+        self.harry = Person.objects.create(
+            username='harrypotter', personal='Harry', family='Potter',
+            email='harry@hogwarts.edu')
+        self.hermione = Person.objects.create(
+            username='hermione', personal='Hermione', family='Granger',
+            email='hermione@hogwarts.edu')
+
+        # snapshots are refreshed when changes are committed
+        with run_on_commit_callbacks():
+            # January: full month in the tested range
+            self.jan = Event.objects.create(
+                slug='2017-01-10-swc', host=host, attendance=10,
+                start=datetime.date(2017, 1, 10))
+            self.jan.tags.set([swc])
+            # February: partial month at the end of the tested range
+            self.feb_in = Event.objects.create(
+                slug='2017-02-05-dc', host=host, administrator=self_organized,
+                start=datetime.date(2017, 2, 5))
+            self.feb_in.tags.set([swc, dc])
+            self.feb_out = Event.objects.create(
+                slug='2017-02-25-dc', host=host, attendance=100,
+                start=datetime.date(2017, 2, 25))
+            self.feb_out.tags.set([dc])
+            # December: partial month at the beginning of the tested range
+            self.dec_out = Event.objects.create(
+                slug='2016-12-01-swc', host=host, attendance=100,
+                start=datetime.date(2016, 12, 1))
+            self.dec_out.tags.set([swc])
+            self.dec_in = Event.objects.create(
+                slug='2016-12-20-swc', host=host, attendance=5,
+                start=datetime.date(2016, 12, 20))
+            self.dec_in.tags.set([swc])
+
+            for event in [self.jan, self.feb_in, self.dec_in]:
+                Task.objects.create(event=event, person=self.harry,
+                                    role=self.instructor_role)
+            Task.objects.create(event=self.jan, person=self.hermione,
+                                role=self.instructor_role)
+
+        self.start = datetime.date(2016, 12, 15)
+        self.end = datetime.date(2017, 2, 10)
+
+    def get_data(self):
+        return ReportsViewSet().get_all_activity_over_time(self.start,
+                                                           self.end)
+
+    def test_numbers(self):
+        data = self.get_data()
+        self.assertEqual(data['workshops']['SWC'], 3)
+        self.assertEqual(data['workshops']['DC'], 1)
+        self.assertEqual(data['workshops']['SWC_or_DC'], 3)
+        self.assertEqual(data['workshops']['TTT'], 0)
+        self.assertEqual(data['workshops']['self_organized'], 1)
+        self.assertEqual(data['instructors']['SWC'],
+                         {'total': 4, 'unique': 2})
+        self.assertEqual(data['instructors']['DC'],
+                         {'total': 1, 'unique': 1})
+        self.assertEqual(data['learners']['SWC'], 15)
+        self.assertEqual(data['learners']['DC'], None)
+        self.assertEqual(data['missing']['attendance'], ['2017-02-05-dc'])
+        self.assertEqual(data['missing']['instructors'], [])
+
+    def test_snapshots_reused(self):
+        """Only full months are stored; once stored, the report reads them
+        instead of recalculating."""
+        self.get_data()
+        self.assertEqual(
+            list(ActivitySnapshot.objects.values_list('month', flat=True)),
+            [datetime.date(2016, 12, 1), datetime.date(2017, 1, 1),
+             datetime.date(2017, 2, 1)],
+        )
+        with self.assertNumQueries(4):
+            self.get_data()
+
+    def test_snapshots_refreshed(self):
+        """Changes to events, tags and tasks are reflected in the report."""
+        self.get_data()
+
+        with run_on_commit_callbacks():
+            Task.objects.filter(event=self.jan, person=self.hermione).delete()
+            self.jan.tags.add(self.ttt)
+            self.jan.attendance = 20
+            self.jan.save()
+            self.dec_out.start = datetime.date(2017, 1, 3)
+            self.dec_out.save()
+
+        data = self.get_data()
+        self.assertEqual(data['workshops']['SWC'], 4)
+        self.assertEqual(data['workshops']['TTT'], 1)
+        self.assertEqual(data['instructors']['SWC'],
+                         {'total': 3, 'unique': 1})
+        self.assertEqual(data['learners']['SWC'], 125)
+        self.assertEqual(data['missing']['instructors'], ['2016-12-01-swc'])
+
+    def test_snapshots_refreshed_once_per_transaction(self):
+        """Many changes in one transaction refresh snapshots once, also when
+        many tasks are deleted."""
+        self.get_data()
+
+        with patch('workshops.reports.refresh_activity_snapshots',
+                   wraps=refresh_activity_snapshots) as mock_refresh:
+            with run_on_commit_callbacks():
+                for attendance in range(5):
+                    self.jan.attendance = attendance
+                    self.jan.save()
+                self.jan.tags.add(self.ttt)
+                Task.objects.create(event=self.feb_in, person=self.hermione,
+                                    role=self.instructor_role)
+        mock_refresh.assert_called_once_with(datetime.date(2017, 1, 1),
+                                             datetime.date(2017, 2, 1))
+
+        with patch('workshops.reports.refresh_activity_snapshots',
+                   wraps=refresh_activity_snapshots) as mock_refresh:
+            with run_on_commit_callbacks():
+                Task.objects.filter(person=self.harry).delete()
+        mock_refresh.assert_called_once_with(datetime.date(2016, 12, 1),
+                                             datetime.date(2017, 2, 1))
+
+        data = self.get_data()
+        self.assertEqual(data['workshops']['TTT'], 1)
+        self.assertEqual(data['instructors']['SWC'],
+                         {'total': 2, 'unique': 1})
+
+    def test_snapshots_refreshed_after_rollback(self):
+        """Changes made after a rolled back transaction are reflected."""
+        self.get_data()
+
+        with run_on_commit_callbacks():
+            try:
+                with transaction.atomic():
+                    self.jan.tags.add(self.ttt)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.feb_in.tags.add(self.ttt)
+
+        self.assertEqual(self.get_data()['workshops']['TTT'], 1)
+
+    def test_snapshots_refreshed_when_tag_cleared(self):
+        """Removing a tag from all events (from tag's side) is reflected."""
+        self.get_data()
+
+        swc = Tag.objects.get(name='SWC')
+        with run_on_commit_callbacks():
+            swc.event_set.clear()
+
+        data = self.get_data()
+        self.assertEqual(data['workshops']['SWC'], 0)
+        self.assertEqual(data['workshops']['DC'], 1)
+
+    def test_command_refreshes_changes_without_signals(self):
+        """Changes which don't send signals (e.g. `QuerySet.update()` or
+        renaming a tag) are reflected after running the command."""
+        self.get_data()
+
+        Event.objects.filter(pk=self.jan.pk).update(attendance=20)
+        self.assertEqual(self.get_data()['learners']['SWC'], 15)
+        with redirect_stdout(StringIO()):
+            call_command('refresh_activity_snapshots')
+        self.assertEqual(self.get_data()['learners']['SWC'], 25)
+
+        # January is read from its snapshot, the other months are partial
+        Tag.objects.filter(name='SWC').update(name='XX')
+        self.assertEqual(self.get_data()['workshops']['SWC'], 1)
+        with redirect_stdout(StringIO()):
+            call_command('refresh_activity_snapshots')
+        self.assertEqual(self.get_data()['workshops']['SWC'], 0)
+
+    def test_snapshots_created_concurrently(self):
+        """Snapshots created by another request in the meantime don't cause
+        errors."""
+        ActivitySnapshot.objects.all().delete()
+        existing = refresh_activity_snapshots(datetime.date(2017, 1, 1),
+                                              datetime.date(2017, 1, 1))[0]
+
+        snapshots = _create_missing_snapshots([datetime.date(2016, 12, 1),
+                                               datetime.date(2017, 1, 1)])
+        self.assertEqual([s.month for s in snapshots],
+                         [datetime.date(2016, 12, 1),
+                          datetime.date(2017, 1, 1)])
+        self.assertEqual(snapshots[1].pk, existing.pk)
+        self.assertEqual(ActivitySnapshot.objects.count(), 2)
@@ -2,7 +2,9 @@ import datetime
 import json
 from unittest.mock import patch
 
+from django.db import connection
 from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
@@ -277,7 +279,7 @@ class TestListingTrainingRequests(APITestBase):
         # get CSV-formatted output
         self.client.login(username='admin', password='admin')
         response = self.client.get(url, {'format': 'csv'})
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         firstline = content.splitlines()[0]
@@ -327,3 +329,30 @@ class TestListingTrainingRequests(APITestBase):
         json = response.json()
         self.assertEqual(len(json), 1)
         self.assertEqual(json[0], self.expecting[1])
+
+    def test_CSV_streamed_in_chunks(self):
+        """Ensure requests and their prefetched relations are fetched in
+        bounded slices, not all at once."""
+        url = reverse(self.url)
+        self.client.login(username='admin', password='admin')
+
+        with patch.object(TrainingRequests, 'streaming_chunk_size', 1):
+            response = self.client.get(url, {'format': 'csv'})
+            with CaptureQueriesContext(connection) as ctx:
+                content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        rows = content.decode('utf-8').splitlines()[1:]
+        self.assertEqual(len(rows), 2)
+        self.assertIn('Zummi', rows[0])
+
+        # two full slices and an empty one
+        slices = [q['sql'] for q in ctx.captured_queries
+                  if 'FROM "workshops_trainingrequest" ' in q['sql']]
+        self.assertEqual(len(slices), 3)
+        for sql in slices:
+            self.assertIn('LIMIT 1', sql)
+        # prefetches run for every non-empty slice
+        domains = [q for q in ctx.captured_queries
+                   if 'FROM "workshops_knowledgedomain"' in q['sql']]
+        self.assertEqual(len(domains), 2)
@@ -1,23 +1,22 @@
 from collections import OrderedDict
 import datetime
-from itertools import accumulate
 
 from django.db.models import (
-    Case,
-    Count,
     F,
     IntegerField,
     Min,
     Prefetch,
-    Sum,
+    Q,
     Value,
-    When,
 )
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.metadata import SimpleMetadata
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.permissions import (
     IsAuthenticatedOrReadOnly, IsAuthenticated, BasePermission
 )
@@ -27,8 +26,6 @@ from rest_framework.reverse import reverse
 from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.viewsets import ViewSet
-from rest_framework_csv.renderers import CSVRenderer
-from rest_framework_yaml.renderers import YAMLRenderer
 
 from workshops.models import (
     Badge,
@@ -43,7 +40,14 @@ from workshops.models import (
     TrainingRequest,
     is_admin,
 )
-from workshops.util import get_members, default_membership_cutoff, str2bool
+from workshops.reports import activity_over_time, cumulative_over_time
+from workshops.util import (
+    InvalidCursor,
+    KeysetPaginator,
+    get_members,
+    default_membership_cutoff,
+    str2bool,
+)
 
 from .serializers import (
     PersonNameEmailUsernameSerializer,
@@ -52,8 +56,6 @@ from .serializers import (
     ExportInstructorLocationsSerializer,
     ExportEventSerializer,
     TimelineTodoSerializer,
-    WorkshopsOverTimeSerializer,
-    InstructorsOverTimeSerializer,
     InstructorNumTaughtSerializer,
     InstructorsByTimePeriodSerializer,
     OrganizationSerializer,
@@ -78,6 +80,8 @@ from .filters import (
 )
 
 from .renderers import (
+    StreamingCSVRenderer,
+    StreamingYAMLRenderer,
     TrainingRequestCSVRenderer,
 )
 
@@ -109,6 +113,76 @@ class QueryMetadata(SimpleMetadata):
         return data
 
 
+class StreamingResponseMixin:
+    """Send data rendered by a streaming renderer (see `api.renderers`) in
+    a `StreamingHttpResponse`, so that the output is written as it's produced
+    instead of being built in memory first."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if (not isinstance(response, Response) or response.exception or
+                not getattr(renderer, 'streaming', False)):
+            return response
+
+        content_type = response.accepted_media_type
+        if renderer.charset:
+            content_type += '; charset={}'.format(renderer.charset)
+
+        streaming_response = StreamingHttpResponse(
+            renderer.render(response.data, response.accepted_media_type,
+                            response.renderer_context),
+            status=response.status_code,
+            content_type=content_type,
+        )
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                streaming_response[header] = value
+        return streaming_response
+
+
+class StreamingListMixin(StreamingResponseMixin):
+    """For streaming renderers, serialize objects one at a time instead of
+    serializing the whole queryset upfront.
+
+    Objects are fetched in chunks of `streaming_chunk_size`, so only one
+    chunk is held in memory.  Querysets with prefetched relations are read
+    in slices ordered by ID (the prefetches run for each slice), others
+    with a database cursor in their own order."""
+    streaming_chunk_size = 500
+
+    def iterate_in_chunks(self, queryset):
+        size = self.streaming_chunk_size
+        if not queryset._prefetch_related_lookups:
+            yield from queryset.iterator(chunk_size=size)
+            return
+
+        queryset = queryset.order_by('pk')
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None \
+                else queryset.filter(pk__gt=last_pk)
+            objects = list(chunk[:size])
+            yield from objects
+            if len(objects) < size:
+                break
+            last_pk = objects[-1].pk
+
+    def list(self, request, *args, **kwargs):
+        if not getattr(request.accepted_renderer, 'streaming', False):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # a generator expression would fetch the queryset right away
+        def data():
+            for obj in self.iterate_in_chunks(queryset):
+                yield self.get_serializer(obj).data
+
+        return Response(data())
+
+
 class LargeResultsSetPagination(PageNumberPagination):
     page_size = 1000
     page_size_query_param = 'page_size'
@@ -121,6 +195,59 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 1000
 
 
+class KeysetResultsSetPagination(StandardResultsSetPagination):
+    """Keyset pagination (see `workshops.util.KeysetPaginator`) by view's
+    `keyset_ordering`: pages are selected with `after` or `before` cursors
+    and `count` is approximate.  Requests for a numbered page (with `page`
+    parameter) or in custom order (with `order_by` parameter) are paginated
+    by page numbers."""
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if params.get(self.page_query_param) or params.get('order_by'):
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.get_page_size(request),
+                                    view.keyset_ordering)
+        try:
+            self.page = paginator.page(after=params.get('after'),
+                                       before=params.get('before'))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+        return list(self.page)
+
+    def _link(self, direction, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        for param in ('after', 'before'):
+            url = remove_query_param(url, param)
+        return replace_query_param(url, direction, cursor)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        return self._link('after', self.page.next_cursor)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return self._link('before', self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
 class ApiRoot(APIView):
     def get(self, request, format=None):
         return Response(OrderedDict([
@@ -232,17 +359,26 @@ class ExportInstructorLocationsView(ListAPIView):
         }
 
 
-class ExportMembersView(ListAPIView):
+class ExportMembersView(StreamingListMixin, ListAPIView):
     """Show everyone who qualifies as an SCF member."""
     permission_classes = (IsAuthenticated, IsAdmin, HasRestrictedPermission, )
     paginator = None  # disable pagination
 
-    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [CSVRenderer, ]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
+        [StreamingCSVRenderer, ]
 
     serializer_class = PersonNameEmailUsernameSerializer
 
     metadata_class = QueryMetadata
 
+    # CSV columns known upfront let the renderer stream the rows
+    csv_header = ['email', 'name', 'username']
+
+    def get_renderer_context(self):
+        context = super().get_renderer_context()
+        context['header'] = self.csv_header
+        return context
+
     def get_queryset(self):
         earliest_default, latest_default = default_membership_cutoff()
 
@@ -347,7 +483,7 @@ class UserTodoItems(ListAPIView):
                                .select_related('event')
 
 
-class TrainingRequests(ListAPIView):
+class TrainingRequests(StreamingListMixin, ListAPIView):
     permission_classes = (IsAuthenticated, IsAdmin)
     paginator = None
     serializer_class = TrainingRequestWithPersonSerializer
@@ -375,7 +511,7 @@ class TrainingRequests(ListAPIView):
     filterset_class = TrainingRequestFilterIDs
 
 
-class ReportsViewSet(ViewSet):
+class ReportsViewSet(StreamingResponseMixin, ViewSet):
     """This viewset will return data for many of our reports.
 
     This is implemented as a ViewSet, but actions like create/list/retrieve/etc
@@ -385,44 +521,28 @@ class ReportsViewSet(ViewSet):
     event_queryset = Event.objects.past_events().order_by('start')
     award_queryset = Award.objects.order_by('awarded')
 
-    renderer_classes = (BrowsableAPIRenderer, JSONRenderer, CSVRenderer,
-                        YAMLRenderer)
-
-    # YAML and CSV renderers don't understand generators (>.<) so we had to
-    # turn the `accumulate` generator results into a list
-    formats_requiring_lists = ('csv', 'yaml')
-
-    def _add_counts(self, a, b):
-        c = b
-        c['count'] = (a.get('count') or 0) + (b.get('count') or 0)
-        return c
-
-    def _only_latest_date(self, iterable):
-        it = iter(iterable)
-        try:
-            prev_ = next(it)
-        except StopIteration:
-            return
-        next_ = None
-        for next_ in it:
-            if prev_['date'] != next_['date']:
-                yield prev_
-            prev_ = next_
-        if next_ is not None:
-            yield next_
-
-    def listify(self, iterable, request, format=None):
-        """Some renderers require lists instead of any iterables for rendering.
-        This function conditionally turns iterables into lists based on the
-        format requested by browser."""
-        # choose either '?format=...' or '/url.format' or None
-        format_ = (request.query_params.get('format') or format or '').lower()
-
-        if format_ in self.formats_requiring_lists:
-            # list-ify the generator for renderers requiring lists
-            return list(iterable)
-
-        return iterable
+    renderer_classes = (BrowsableAPIRenderer, JSONRenderer,
+                        StreamingCSVRenderer, StreamingYAMLRenderer)
+
+    # CSV columns known upfront let the renderer stream the rows
+    csv_headers = {
+        'workshops_over_time': ['date', 'count'],
+        'learners_over_time': ['date', 'count'],
+        'instructors_over_time': ['date', 'count'],
+    }
+
+    def get_renderer_context(self):
+        context = super().get_renderer_context()
+        header = self.csv_headers.get(getattr(self, 'action', None))
+        if header:
+            context['header'] = header
+        return context
+
+    def _over_time(self, queryset):
+        """Turn `(date, count)` tuples from the cumulative report into
+        dictionaries."""
+        for date, count in cumulative_over_time(queryset):
+            yield {'date': date, 'count': count}
 
     @action(detail=False, methods=['GET'])
     def workshops_over_time(self, request, format=None):
@@ -430,14 +550,13 @@ class ReportsViewSet(ViewSet):
         carpentries over time."""
         qs = self.event_queryset
         qs = WorkshopsOverTimeFilter(request.GET, queryset=qs).qs
-        qs = qs.annotate(count=Count('id'))
-
-        serializer = WorkshopsOverTimeSerializer(qs, many=True)
-
-        # run a cumulative generator over the data
-        data = accumulate(serializer.data, self._add_counts)
+        # filtering by tags may duplicate events
+        qs = Event.objects.filter(pk__in=qs.values('pk')).annotate(
+            date=F('start'),
+            count=Value(1, output_field=IntegerField()),
+        )
 
-        data = self.listify(data, request, format)
+        data = self._over_time(qs)
 
         return Response(data)
 
@@ -447,15 +566,12 @@ class ReportsViewSet(ViewSet):
         carpentries' workshops over time."""
         qs = self.event_queryset
         qs = LearnersOverTimeFilter(request.GET, queryset=qs).qs
-        qs = qs.annotate(count=Sum('attendance'))
-
-        # we reuse the serializer because it works here too
-        serializer = WorkshopsOverTimeSerializer(qs, many=True)
-
-        # run a cumulative generator over the data
-        data = accumulate(serializer.data, self._add_counts)
+        qs = Event.objects.filter(pk__in=qs.values('pk')).annotate(
+            date=F('start'),
+            count=F('attendance'),
+        )
 
-        data = self.listify(data, request, format)
+        data = self._over_time(qs)
 
         return Response(data)
 
@@ -468,38 +584,20 @@ class ReportsViewSet(ViewSet):
 
         qs = Person.objects.filter(badges__in=badges)
         filter = InstructorsOverTimeFilter(request.GET, queryset=qs)
-        qs = filter.qs.annotate(
-            date=Min('award__awarded'),
-            count=Value(1, output_field=IntegerField())
-        ).order_by('date')
-
-        serializer = InstructorsOverTimeSerializer(qs, many=True)
-
-        # run a cumulative generator over the data
-        data = accumulate(serializer.data, self._add_counts)
-
-        # drop data for the same days by showing the last record for
-        # particular date
-        data = self._only_latest_date(data)
+        qs = Person.objects.filter(pk__in=filter.qs.values('pk')).annotate(
+            date=Min('award__awarded', filter=Q(award__badge__in=badges)),
+            count=Value(1, output_field=IntegerField()),
+        )
 
-        data = self.listify(data, request, format)
+        data = self._over_time(qs)
 
         return Response(data)
 
     @action(detail=False, methods=['GET'])
     def instructor_num_taught(self, request, format=None):
         badges = Badge.objects.instructor_badges()
-        persons = Person.objects.filter(badges__in=badges).annotate(
-            num_taught=Count(
-                Case(
-                    When(
-                        task__role__name='instructor',
-                        then=F('task'),
-                    ),
-                ),
-                distinct=True
-            )
-        ).order_by('-num_taught')
+        persons = Person.objects.filter(badges__in=badges).distinct() \
+                                .order_by('-num_taught')
         serializer = InstructorNumTaughtSerializer(
             persons, many=True, context=dict(request=request))
         return Response(serializer.data)
@@ -537,67 +635,22 @@ class ReportsViewSet(ViewSet):
             end=request.query_params.get('end', None))
 
         data = self.get_all_activity_over_time(start, end)
-        data['missing']['attendance'] = self.listify(
-            data['missing']['attendance'], request, format=format)
-        data['missing']['instructors'] = self.listify(
-            data['missing']['instructors'], request, format=format)
         return Response(data)
 
     def get_all_activity_over_time(self, start, end):
-        events_qs = Event.objects.filter(start__gte=start, start__lte=end)
-        swc_tag = Tag.objects.get(name='SWC')
-        dc_tag = Tag.objects.get(name='DC')
-        wise_tag = Tag.objects.get(name='WiSE')
-        TTT_tag = Tag.objects.get(name='TTT')
-        self_organized_host = Organization.objects.get(domain='self-organized')
-
-        # count workshops: SWC, DC, total (SWC and/or DC), self-organized,
-        # WiSE, TTT
-        swc_workshops = events_qs.filter(tags=swc_tag)
-        dc_workshops = events_qs.filter(tags=dc_tag)
-        swc_dc_workshops = events_qs.filter(tags__in=[swc_tag, dc_tag]).count()
-        wise_workshops = events_qs.filter(tags=wise_tag).count()
-        ttt_workshops = events_qs.filter(tags=TTT_tag).count()
-        self_organized_workshops = events_qs \
-            .filter(administrator=self_organized_host).count()
-
-        # total and unique instructors for both SWC and DC workshops
-        swc_total_instr = Person.objects \
-            .filter(task__event__in=swc_workshops,
-                    task__role__name='instructor')
-        swc_unique_instr = swc_total_instr.distinct().count()
-        swc_total_instr = swc_total_instr.count()
-        dc_total_instr = Person.objects \
-            .filter(task__event__in=dc_workshops,
-                    task__role__name='instructor')
-        dc_unique_instr = dc_total_instr.distinct().count()
-        dc_total_instr = dc_total_instr.count()
-
-        # total learners for both SWC and DC workshops
-        swc_total_learners = swc_workshops.aggregate(count=Sum('attendance'))
-        swc_total_learners = swc_total_learners['count']
-        dc_total_learners = dc_workshops.aggregate(count=Sum('attendance'))
-        dc_total_learners = dc_total_learners['count']
-
-        # Workshops missing any of this data.
-        missing_attendance = events_qs.filter(attendance=None) \
-                                      .values_list('slug', flat=True)
-        missing_instructors = events_qs.annotate(
-            instructors=Sum(
-                Case(
-                    When(task__role__name='instructor', then=Value(1)),
-                    default=Value(0),
-                    output_field=IntegerField()
-                )
-            )
-        ).filter(instructors=0).values_list('slug', flat=True)
+        """Read workshops, instructors, learners and missing data numbers
+        from precomputed monthly snapshots (see `workshops.reports`)."""
+        activity = activity_over_time(start, end)
+
+        swc_dc_workshops = activity['workshops_swc_or_dc']
+        self_organized_workshops = activity['workshops_self_organized']
 
         return {
             'start': start,
             'end': end,
             'workshops': {
-                'SWC': swc_workshops.count(),
-                'DC': dc_workshops.count(),
+                'SWC': activity['workshops_swc'],
+                'DC': activity['workshops_dc'],
                 # This dictionary is traversed in a template where we cannot
                 # write "{{ data.workshops.SWC,DC }}", because commas are
                 # disallowed in templates. Therefore, we include
@@ -606,8 +659,8 @@ class ReportsViewSet(ViewSet):
                 # - 'SWC_or_DC' - so that you can access it in a template.
                 'SWC,DC': swc_dc_workshops,
                 'SWC_or_DC': swc_dc_workshops,
-                'WiSE': wise_workshops,
-                'TTT': ttt_workshops,
+                'WiSE': activity['workshops_wise'],
+                'TTT': activity['workshops_ttt'],
                 # We include self_organized_workshops twice, under two
                 # different keys, for the same reason as swc_dc_workshops.
                 'self-organized': self_organized_workshops,
@@ -615,21 +668,21 @@ class ReportsViewSet(ViewSet):
             },
             'instructors': {
                 'SWC': {
-                    'total': swc_total_instr,
-                    'unique': swc_unique_instr,
+                    'total': len(activity['instructors_swc']),
+                    'unique': len(set(activity['instructors_swc'])),
                 },
                 'DC': {
-                    'total': dc_total_instr,
-                    'unique': dc_unique_instr,
+                    'total': len(activity['instructors_dc']),
+                    'unique': len(set(activity['instructors_dc'])),
                 },
             },
             'learners': {
-                'SWC': swc_total_learners,
-                'DC': dc_total_learners,
+                'SWC': activity['learners_swc'],
+                'DC': activity['learners_dc'],
             },
             'missing': {
-                'attendance': missing_attendance,
-                'instructors': missing_instructors,
+                'attendance': activity['missing_attendance'],
+                'instructors': activity['missing_instructors'],
             }
         }
 
@@ -671,16 +724,7 @@ class ReportsViewSet(ViewSet):
             .order_by('event', 'person', 'role')
             .select_related('event', 'person', 'role')
             .prefetch_related('event__tags')
-            .annotate(
-                num_taught=Sum(
-                    Case(
-                        When(person__task__role__name='instructor',
-                             then=Value(1)),
-                        default=Value(0),
-                        output_field=IntegerField(),
-                    ),
-                )
-            )
+            .annotate(num_taught=F('person__num_taught'))
         )
         return tasks
 
@@ -749,7 +793,8 @@ class EventViewSet(viewsets.ReadOnlyModelViewSet):
                                   .prefetch_related('tags')
     serializer_class = EventSerializer
     lookup_field = 'slug'
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetResultsSetPagination
+    keyset_ordering = ('-start', '-pk')
     filterset_class = EventFilter
 
 
@@ -757,12 +802,13 @@ class TaskViewSet(viewsets.ReadOnlyModelViewSet):
     """List tasks belonging to specific event."""
     permission_classes = (IsAuthenticated, IsAdmin)
     serializer_class = TaskSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetResultsSetPagination
+    keyset_ordering = ('role__name', '-event__start', 'event_id', 'pk')
     filterset_class = TaskFilter
     _event_slug = None
 
     def get_queryset(self):
-        qs = Task.objects.all().select_related('person', 'role',
+        qs = Task.objects.all().select_related('event', 'person', 'role',
                                                'person__airport')
         if self._event_slug:
             qs = qs.filter(event__slug=self._event_slug)
@@ -804,7 +850,8 @@ class PersonViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Person.objects.all().select_related('airport') \
                      .prefetch_related('badges', 'domains', 'lessons')
     serializer_class = PersonSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetResultsSetPagination
+    keyset_ordering = ('family', 'personal', 'pk')
     filterset_class = PersonFilter
 
 
@@ -1,10 +1,15 @@
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, reduce
 from json import JSONDecodeError
+import math
+import operator
 from urllib.parse import urljoin, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 from django.db.models import Q
+import reversion
 
 from workshops.models import (
     Person,
@@ -13,7 +18,98 @@ from workshops.models import (
     Sponsorship,
     Task,
 )
-from workshops.util import create_username
+from workshops.duplicates import DUPLICATE_KEY_KINDS, update_keys
+from workshops.search import index_objects, lookup_cache
+from workshops.util import create_username, username_stem
+
+
+def _add_to_search_and_revision(model, objects):
+    """Do what saving `objects` one by one would do (`bulk_create()` doesn't
+    send signals)."""
+    pks = [obj.pk for obj in objects]
+    index_objects(model, pks)
+    lookup_cache.clear()
+    if model._meta.model_name in DUPLICATE_KEY_KINDS:
+        update_keys(model, pks)
+    if reversion.is_active():
+        for obj in objects:
+            reversion.add_to_revision(obj)
+
+
+def get_or_create_persons(people):
+    """Return a dictionary of persons by email.
+
+    `people` maps emails to dictionaries with `personal`, `family` and
+    `username` (used as a base for a generated username) and optionally other
+    fields.  Persons missing in the database are created with these fields,
+    all of them in a single query."""
+    persons = {p.email: p for p in Person.objects.filter(email__in=people)}
+    missing = [email for email in people if email not in persons]
+    if not missing:
+        return persons
+
+    stems = {username_stem('', people[email]['username'])
+             for email in missing}
+    taken = set(
+        Person.objects.filter(reduce(operator.or_, (
+            Q(username__startswith=stem) for stem in stems
+        ))).values_list('username', flat=True)
+    )
+
+    new_persons = []
+    for email in missing:
+        fields = dict(people[email])
+        fields['username'] = create_username('', fields['username'],
+                                             taken=taken)
+        taken.add(fields['username'])
+        person = Person(email=email, **fields)
+        person.normalize_fields()
+        new_persons.append(person)
+    Person.objects.bulk_create(new_persons)
+
+    # primary keys aren't set by `bulk_create()` on every database
+    created = Person.objects.in_bulk([p.username for p in new_persons],
+                                     field_name='username')
+    for email, person in zip(missing, new_persons):
+        persons[email] = created[person.username]
+    _add_to_search_and_revision(Person, created.values())
+    return persons
+
+
+def get_or_create_organizations(sponsors):
+    """Return a list of organizations matching (by name or domain) `sponsors`
+    (dictionaries with `name`, `domain` and `notes`).  Missing organizations
+    are created in a single query."""
+    candidates = list(Organization.objects.filter(
+        Q(fullname__in={s['name'] for s in sponsors}) |
+        Q(domain__in={s['domain'] for s in sponsors})
+    ))
+
+    organizations = []
+    new_organizations = []
+    for sponsor in sponsors:
+        organization = next(
+            (o for o in candidates
+             if o.fullname == sponsor['name'] or o.domain == sponsor['domain']),
+            None,
+        )
+        if organization is None:
+            organization = Organization(fullname=sponsor['name'],
+                                        domain=sponsor['domain'],
+                                        notes=sponsor['notes'])
+            candidates.append(organization)
+            new_organizations.append(organization)
+        organizations.append(organization)
+
+    if new_organizations:
+        Organization.objects.bulk_create(new_organizations)
+        created = Organization.objects.in_bulk(
+            [o.domain for o in new_organizations], field_name='domain',
+        )
+        organizations = [created[o.domain] if o.pk is None else o
+                         for o in organizations]
+        _add_to_search_and_revision(Organization, created.values())
+    return organizations
 
 
 class BaseAPIClient(requests.Session):
@@ -26,6 +122,9 @@ class BaseAPIClient(requests.Session):
     """
     ROOT_ENDPOINT = 'api/'
 
+    # number of pages of paginated endpoints fetched at the same time
+    PAGE_WORKERS = 4
+
     @lru_cache(maxsize=None)
     def __new__(cls, event):
         """
@@ -42,21 +141,62 @@ class BaseAPIClient(requests.Session):
 
     def __init__(self, event):
         '''Populate API endpoint and set up basic authentication'''
+        # `__new__` returns cached clients, which are already set up; the
+        # session and its connection pools are kept
+        if getattr(self, 'event', None) is not None:
+            return
+
         super().__init__()
         self.event = event
         self.endpoint = urljoin(event.url, self.ENDPOINT)
         self.auth = (
             settings.PYDATA_USERNAME_SECRET, settings.PYDATA_PASSWORD_SECRET)
 
-    def __iter__(self):
+        # keep a connection open for every worker
+        adapter = HTTPAdapter(pool_maxsize=self.PAGE_WORKERS)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def fetch(self, url, **kwargs):
+        '''Return JSON data from `url`'''
         try:
-            r = self.get(self.endpoint)
+            r = self.get(url, **kwargs)
             r.raise_for_status()
-            pydata_objs = r.json()
+            return r.json()
         except (requests.exceptions.HTTPError, JSONDecodeError) as e:
             raise IOError('Cannot fetch instances from API: {}'.format(str(e)))
-        for obj in pydata_objs:
-            yield self.parse(obj)
+
+    def fetch_all(self):
+        """
+        Returns a list of all objects from the endpoint.
+        Paginated responses (`{"count": ..., "next": ..., "results": [...]}`)
+        are supported; when the number of pages is known, the remaining pages
+        are fetched concurrently.
+        """
+        data = self.fetch(self.endpoint)
+        if isinstance(data, list):
+            return data
+
+        results = list(data['results'])
+        if not data.get('next'):
+            return results
+
+        if data.get('count') and results:
+            pages = math.ceil(data['count'] / len(results))
+            with ThreadPoolExecutor(max_workers=self.PAGE_WORKERS) as executor:
+                for page in executor.map(
+                        lambda number: self.fetch(self.endpoint,
+                                                  params={'page': number}),
+                        range(2, pages + 1)):
+                    results += page['results']
+        else:
+            while data.get('next'):
+                data = self.fetch(data['next'])
+                results += data['results']
+        return results
+
+    def __iter__(self):
+        return iter(self.parse_many(self.fetch_all()))
 
     def __contains__(self, pk):
         try:
@@ -67,12 +207,18 @@ class BaseAPIClient(requests.Session):
             return True
 
     def __getitem__(self, pk):
-        if pk not in self:
+        r = self.get(self.endpoint + str(pk))
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError:
             raise KeyError(
                 '{} does not exist'.format(self.model._meta.verbose_name)
             )
-        obj = self.get(self.endpoint + str(pk)).json()
-        return self.parse(obj)
+        return self.parse(r.json())
+
+    def parse_many(self, objs):
+        '''Returns a list of model instances for a list of API objects'''
+        return [self.parse(obj) for obj in objs]
 
 
 class PersonAPIClient(BaseAPIClient):
@@ -97,21 +243,30 @@ class TaskAPIClient(BaseAPIClient):
     model = Task
 
     def parse(self, presentation):
-        return Task(
-            event=self.event,
-            person=Person.objects.get_or_create(
-                email=presentation['speaker']['email'],
-                defaults={
-                    'username': create_username('', presentation['speaker']['username']),
-                    'personal': presentation['speaker']['name'].rsplit(' ', 1)[0],
-                    'family': presentation['speaker']['name'].rsplit(' ', 1)[-1],
-                    'url': presentation['speaker']['absolute_url'],
-                }
-            )[0],
-            role=Role.objects.get(name='presenter'),
-            title=presentation['title'],
-            url=presentation['absolute_url'],
-        )
+        return self.parse_many([presentation])[0]
+
+    def parse_many(self, presentations):
+        role = Role.objects.get(name='presenter')
+        # speakers with many presentations are created from the first one
+        persons = get_or_create_persons({
+            presentation['speaker']['email']: {
+                'username': presentation['speaker']['username'],
+                'personal': presentation['speaker']['name'].rsplit(' ', 1)[0],
+                'family': presentation['speaker']['name'].rsplit(' ', 1)[-1],
+                'url': presentation['speaker']['absolute_url'],
+            }
+            for presentation in reversed(presentations)
+        })
+        return [
+            Task(
+                event=self.event,
+                person=persons[presentation['speaker']['email']],
+                role=role,
+                title=presentation['title'],
+                url=presentation['absolute_url'],
+            )
+            for presentation in presentations
+        ]
 
 
 class SponsorshipAPIClient(BaseAPIClient):
@@ -119,26 +274,32 @@ class SponsorshipAPIClient(BaseAPIClient):
     model = Sponsorship
 
     def parse(self, sponsor):
-        domain = urlparse(sponsor['external_url']).netloc
-        organization = Organization.objects.filter(
-            Q(fullname=sponsor['name']) | Q(domain=domain)
-        ).first()
-        if not organization:
-            organization = Organization.objects.create(
-                fullname=sponsor['name'],
-                domain=domain,
-                notes=sponsor['annotation'],
+        return self.parse_many([sponsor])[0]
+
+    def parse_many(self, sponsors):
+        organizations = get_or_create_organizations([
+            {
+                'name': sponsor['name'],
+                'domain': urlparse(sponsor['external_url']).netloc,
+                'notes': sponsor['annotation'],
+            }
+            for sponsor in sponsors
+        ])
+        # contacts of many sponsors are created from the first one
+        contacts = get_or_create_persons({
+            sponsor['contact_email']: {
+                'username': sponsor['contact_name'],
+                'personal': sponsor['contact_name'].rsplit(' ', 1)[0],
+                'family': sponsor['contact_name'].rsplit(' ', 1)[-1],
+            }
+            for sponsor in reversed(sponsors)
+        })
+        return [
+            Sponsorship(
+                organization=organization,
+                event=self.event,
+                amount=sponsor['level']['cost'],
+                contact=contacts[sponsor['contact_email']],
             )
-        return Sponsorship(
-            organization=organization,
-            event=self.event,
-            amount=sponsor['level']['cost'],
-            contact=Person.objects.get_or_create(
-                email=sponsor['contact_email'],
-                defaults={
-                    'username': create_username('', sponsor['contact_name']),
-                    'personal': sponsor['contact_name'].rsplit(' ', 1)[0],
-                    'family': sponsor['contact_name'].rsplit(' ', 1)[-1],
-                },
-            )[0],
-        )
+            for sponsor, organization in zip(sponsors, organizations)
+        ]
@@ -0,0 +1,217 @@
+from django.test import TestCase, override_settings
+import requests_mock
+
+from workshops.models import Event, Organization, Person, Role, Task
+from ..api import (
+    BaseAPIClient,
+    PersonAPIClient,
+    SponsorshipAPIClient,
+    TaskAPIClient,
+)
+
+URL = 'https://pydata.example.org/2018/'
+
+
+def speaker(pk, name, email=None, username=None):
+    return {
+        'name': name,
+        'email': email or '{}@example.org'.format(pk),
+        'username': username or name.split()[-1],
+        'absolute_url': URL + 'speaker/profile/{}/'.format(pk),
+    }
+
+
+def presentation(pk, title, speaker):
+    return {
+        'title': title,
+        'speaker': speaker,
+        'absolute_url': URL + 'schedule/presentation/{}/'.format(pk),
+    }
+
+
+def sponsor(name, url, contact_name, contact_email, cost=5000):
+    return {
+        'name': name,
+        'external_url': url,
+        'annotation': '',
+        'contact_name': contact_name,
+        'contact_email': contact_email,
+        'level': {'cost': cost},
+    }
+
+
+@override_settings(PYDATA_USERNAME_SECRET='username',
+                   PYDATA_PASSWORD_SECRET='password')
+class TestAPIClient(TestCase):
+    def setUp(self):
+        # clients are cached by event
+        BaseAPIClient.__dict__['__new__'].cache_clear()
+
+        self.host = Organization.objects.create(domain='pydata.org',
+                                                fullname='PyData')
+        self.event = Event.objects.create(slug='2018-01-01-pydata',
+                                          host=self.host, url=URL)
+        self.presenter = Role.objects.create(name='presenter')
+
+        self.mock = requests_mock.Mocker()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        self.mock.get(URL + 'api/', json={})
+
+    def test_unpaginated_response(self):
+        self.mock.get(URL + 'api/speaker/', json=[
+            speaker(1, 'Harry Potter'), speaker(2, 'Hermione Granger'),
+        ])
+        persons = list(PersonAPIClient(self.event))
+        self.assertEqual([(p.personal, p.family, p.email) for p in persons], [
+            ('Harry', 'Potter', '1@example.org'),
+            ('Hermione', 'Granger', '2@example.org'),
+        ])
+
+    def test_paginated_response(self):
+        """Ensure all pages are fetched, each of them once."""
+        speakers = [speaker(i, 'Speaker {}'.format(i)) for i in range(5)]
+        endpoint = URL + 'api/speaker/'
+
+        def page(number):
+            return {
+                'count': len(speakers),
+                'next': (endpoint + '?page={}'.format(number + 1)
+                         if number < 3 else None),
+                'results': speakers[(number - 1) * 2:number * 2],
+            }
+
+        first = self.mock.get(endpoint, complete_qs=True, json=page(1))
+        others = [
+            self.mock.get(endpoint + '?page={}'.format(number),
+                          complete_qs=True, json=page(number))
+            for number in [2, 3]
+        ]
+
+        persons = list(PersonAPIClient(self.event))
+        self.assertEqual([p.email for p in persons],
+                         [s['email'] for s in speakers])
+        self.assertEqual([m.call_count for m in [first] + others], [1, 1, 1])
+
+    def test_paginated_response_without_count(self):
+        """Ensure `next` links are followed if the number of pages isn't
+        known."""
+        endpoint = URL + 'api/speaker/'
+        self.mock.get(endpoint, complete_qs=True, json={
+            'next': endpoint + '?cursor=abc',
+            'results': [speaker(1, 'Harry Potter')],
+        })
+        self.mock.get(endpoint + '?cursor=abc', complete_qs=True, json={
+            'next': None,
+            'results': [speaker(2, 'Hermione Granger')],
+        })
+        persons = list(PersonAPIClient(self.event))
+        self.assertEqual([p.email for p in persons],
+                         ['1@example.org', '2@example.org'])
+
+    def test_speakers_with_many_presentations(self):
+        """Ensure a speaker with many presentations is created once, and
+        existing speakers are reused."""
+        harry = speaker(1, 'Harry Potter')
+        ron = speaker(3, 'Ron Weasley')
+        existing = Person.objects.create(
+            personal='Ron', family='Weasley', username='weasley_ron',
+            email=ron['email'],
+        )
+        self.mock.get(URL + 'api/presentation/', json=[
+            presentation(1, 'Defence', harry),
+            presentation(2, 'Quidditch', harry),
+            presentation(3, 'Chess', ron),
+        ])
+
+        tasks = list(TaskAPIClient(self.event))
+
+        self.assertEqual([t.title for t in tasks],
+                         ['Defence', 'Quidditch', 'Chess'])
+        self.assertEqual(tasks[0].person, tasks[1].person)
+        self.assertEqual(tasks[2].person, existing)
+        self.assertEqual(
+            Person.objects.filter(email=harry['email']).count(), 1)
+        self.assertTrue(all(t.event == self.event and
+                             t.role == self.presenter for t in tasks))
+        self.assertFalse(Task.objects.exists())
+
+    def test_username_collisions(self):
+        """Ensure new persons get unique usernames, different from existing
+        persons' and from each other."""
+        Person.objects.create(personal='Harry', family='Potter',
+                              username='potter_', email='harry@example.org')
+        self.mock.get(URL + 'api/presentation/', json=[
+            presentation(1, 'Defence',
+                         speaker(1, 'James Potter', username='Potter')),
+            presentation(2, 'Quidditch',
+                         speaker(2, 'Lily Potter', username='Potter')),
+        ])
+
+        tasks = list(TaskAPIClient(self.event))
+
+        usernames = {t.person.username for t in tasks}
+        self.assertEqual(usernames, {'potter__2', 'potter__3'})
+        self.assertEqual([t.person.personal for t in tasks],
+                         ['James', 'Lily'])
+        self.assertTrue(all(t.person.pk for t in tasks))
+
+    def test_sponsors(self):
+        """Ensure organizations are matched by name or by domain, and
+        contacts repeated across sponsors are created once."""
+        by_name = Organization.objects.create(domain='other.example.com',
+                                              fullname='Named Sponsor')
+        by_domain = Organization.objects.create(domain='domain.example.com',
+                                                fullname='Other Name')
+        self.mock.get(URL + 'api/sponsor/', json=[
+            sponsor('Named Sponsor', 'https://named.example.com/',
+                    'Harry Potter', 'harry@example.org'),
+            sponsor('Domain Sponsor', 'https://domain.example.com/',
+                    'Harry Potter', 'harry@example.org'),
+            sponsor('New Sponsor', 'https://new.example.com/',
+                    'Ron Weasley', 'ron@example.org', cost=1500),
+        ])
+
+        sponsorships = list(SponsorshipAPIClient(self.event))
+
+        organizations = [s.organization for s in sponsorships]
+        self.assertEqual(organizations[:2], [by_name, by_domain])
+        self.assertEqual(organizations[2].fullname, 'New Sponsor')
+        self.assertEqual(organizations[2].domain, 'new.example.com')
+        self.assertIsNotNone(organizations[2].pk)
+        self.assertEqual([s.amount for s in sponsorships], [5000, 5000, 1500])
+
+        contacts = [s.contact for s in sponsorships]
+        self.assertEqual(contacts[0], contacts[1])
+        self.assertEqual(
+            Person.objects.filter(email='harry@example.org').count(), 1)
+        self.assertEqual(contacts[2].email, 'ron@example.org')
+
+    def test_getitem(self):
+        """Ensure a single object is fetched with one request."""
+        one = self.mock.get(URL + 'api/speaker/1',
+                            json=speaker(1, 'Harry Potter'))
+        missing = self.mock.get(URL + 'api/speaker/2', status_code=404)
+        client = PersonAPIClient(self.event)
+
+        self.assertEqual(client[1].email, '1@example.org')
+        self.assertEqual(one.call_count, 1)
+        with self.assertRaises(KeyError):
+            client[2]
+        self.assertEqual(missing.call_count, 1)
+
+    def test_client_set_up_once(self):
+        """Ensure cached clients aren't set up again, e.g. with new
+        connection pools."""
+        client = PersonAPIClient(self.event)
+        adapter = client.adapters['https://']
+
+        self.assertIs(PersonAPIClient(self.event), client)
+        self.assertIs(client.adapters['https://'], adapter)
+        # the API root is checked only for new clients
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_no_api(self):
+        self.mock.get(URL + 'api/', status_code=404)
+        with self.assertRaises(NotImplementedError):
+            PersonAPIClient(self.event)
@@ -12,12 +12,26 @@ from .models import (
     TrainingRequirement,
     TrainingRequest,
 )
+from .scoring import update_scores
 
 
 class RoleAdmin(admin.ModelAdmin):
     list_display = ('name', 'verbose_name')
 
 
+class TrainingRequestAdmin(admin.ModelAdmin):
+    actions = ['recalculate_score_auto']
+
+    def recalculate_score_auto(self, request, queryset):
+        updated = update_scores(queryset)
+        self.message_user(
+            request,
+            'Automatic score changed for {} of {} selected training '
+            'requests.'.format(updated, queryset.count()),
+        )
+    recalculate_score_auto.short_description = 'Recalculate automatic score'
+
+
 admin.site.register(Tag)
 admin.site.register(AcademicLevel)
 admin.site.register(ComputingExperienceLevel)
@@ -27,4 +41,4 @@ admin.site.register(Lesson)
 admin.site.register(KnowledgeDomain)
 admin.site.register(Badge)
 admin.site.register(TrainingRequirement)
-admin.site.register(TrainingRequest)
+admin.site.register(TrainingRequest, TrainingRequestAdmin)
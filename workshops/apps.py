@@ -1,7 +1,35 @@
 from django.apps import AppConfig
-from django.db.models.signals import m2m_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+)
+from reversion.signals import post_revision_commit
 
-from .signals import trainingrequest_m2m_changed
+from .duplicates import DUPLICATE_KEY_KINDS
+from .eligibility import PERSON_FIELDS
+from .search import SEARCHABLE_FIELDS
+from .signals import (
+    trainingrequest_m2m_changed,
+    event_activity_post_init,
+    event_activity_changed,
+    event_tags_changed,
+    task_activity_changed,
+    airport_changed,
+    register_math_functions,
+    search_index_update,
+    search_index_delete,
+    lookup_results_changed,
+    duplicate_keys_update,
+    duplicate_keys_delete,
+    task_role_counts_post_init,
+    task_role_counts_changed,
+    instructor_eligibility_post_init,
+    instructor_eligibility_changed,
+    object_history_update,
+)
 
 
 class WorkshopsConfig(AppConfig):
@@ -23,3 +51,57 @@ class WorkshopsConfig(AppConfig):
             trainingrequest_m2m_changed,
             sender=TrainingRequest.previous_involvement.through,
         )
+
+        # keep activity snapshots (used in "All activity over time" report)
+        # up-to-date
+        Event = self.get_model('Event')
+        Task = self.get_model('Task')
+
+        post_init.connect(event_activity_post_init, sender=Event)
+        post_save.connect(event_activity_changed, sender=Event)
+        post_delete.connect(event_activity_changed, sender=Event)
+        m2m_changed.connect(event_tags_changed, sender=Event.tags.through)
+        post_delete.connect(task_activity_changed, sender=Task)
+
+        # rebuild airport index used when searching for workshop staff
+        Airport = self.get_model('Airport')
+
+        post_save.connect(airport_changed, sender=Airport)
+        post_delete.connect(airport_changed, sender=Airport)
+
+        # calculate distances to airports in the database
+        connection_created.connect(register_math_functions)
+
+        # keep search index up-to-date
+        for model_name in SEARCHABLE_FIELDS:
+            model = self.get_model(model_name)
+            post_save.connect(search_index_update, sender=model)
+            post_delete.connect(search_index_delete, sender=model)
+
+        # drop cached autocomplete lookups' results
+        Membership = self.get_model('Membership')
+
+        post_save.connect(lookup_results_changed, sender=Membership)
+        post_delete.connect(lookup_results_changed, sender=Membership)
+        m2m_changed.connect(lookup_results_changed, sender=Event.tags.through)
+
+        # keep keys for finding possible duplicates up-to-date
+        for model_name in DUPLICATE_KEY_KINDS:
+            model = self.get_model(model_name)
+            post_save.connect(duplicate_keys_update, sender=model)
+            post_delete.connect(duplicate_keys_delete, sender=model)
+
+        # keep persons' role counts up-to-date
+        post_init.connect(task_role_counts_post_init, sender=Task)
+        post_save.connect(task_role_counts_changed, sender=Task)
+        post_delete.connect(task_role_counts_changed, sender=Task)
+
+        # keep trainees' instructor eligibility up-to-date
+        for model_name in PERSON_FIELDS:
+            model = self.get_model(model_name)
+            post_init.connect(instructor_eligibility_post_init, sender=model)
+            post_save.connect(instructor_eligibility_changed, sender=model)
+            post_delete.connect(instructor_eligibility_changed, sender=model)
+
+        # keep summaries of objects' history up-to-date
+        post_revision_commit.connect(object_history_update)
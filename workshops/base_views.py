@@ -19,7 +19,12 @@ from django.views.generic import (
 from django.template.loader import get_template
 
 from workshops.forms import BootstrapHelper
-from workshops.util import failed_to_delete, Paginator, get_pagination_items
+from workshops.util import (
+    failed_to_delete,
+    Paginator,
+    get_pagination_items,
+    get_keyset_pagination_items,
+)
 
 
 class AMYDetailView(DetailView):
@@ -140,6 +145,9 @@ class AMYListView(ListView):
     filter_class = None
     queryset = None
     title = None
+    # ordering keys (the last one unique) enabling keyset pagination, which
+    # keeps deep pages fast (see `workshops.util.KeysetPaginator`)
+    keyset_ordering = None
 
     def get_filter_data(self):
         """Datasource for the filter."""
@@ -155,6 +163,9 @@ class AMYListView(ListView):
             self.filter = self.filter_class(self.get_filter_data(),
                                             super().get_queryset())
             self.qs = self.filter.qs
+        if self.keyset_ordering is not None:
+            return get_keyset_pagination_items(self.request, self.qs,
+                                               self.keyset_ordering)
         paginated = get_pagination_items(self.request, self.qs)
         return paginated
 
@@ -0,0 +1,180 @@
+"""Finding possible duplicates.
+
+Every person and training request has a few keys (stored in `DuplicateKey`
+table) built from its name or email: normalized name, normalized name with
+switched parts, phonetic code of the name, or normalized email.  Objects
+sharing a key are possible duplicates, so finding them takes a single query
+grouping the table by key.  Signals (see `workshops.signals`) keep the table
+up-to-date when objects change."""
+
+import re
+import unicodedata
+
+from django.apps import apps as django_apps
+from django.db.models import Count, OuterRef, Subquery
+
+# kinds of keys stored for every model
+DUPLICATE_KEY_KINDS = {
+    'person': ('name', 'switched', 'phonetic'),
+    'trainingrequest': ('name', 'email'),
+}
+
+# fields keys are built from
+DUPLICATE_KEY_FIELDS = ('personal', 'family', 'email')
+
+KEY_LENGTH = 255
+
+SOUNDEX_CODES = dict(
+    [(letter, '1') for letter in 'bfpv'] +
+    [(letter, '2') for letter in 'cgjkqsxz'] +
+    [(letter, '3') for letter in 'dt'] +
+    [('l', '4')] +
+    [(letter, '5') for letter in 'mn'] +
+    [('r', '6')]
+)
+
+
+def normalize(text):
+    """Lower-case `text` without accents and with single spaces."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def soundex(text):
+    """Soundex code of `text` (e.g. "R163" for both "Robert" and "Rupert"),
+    or an empty string if it doesn't contain any letters."""
+    letters = re.sub(r'[^a-z]', '', normalize(text))
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+        # "h" and "w" don't separate letters with the same code
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def object_keys(model_name, personal, family, email):
+    """Set of (kind, key) tuples for an object of `model_name`."""
+    personal, family = normalize(personal), normalize(family)
+    keys = {
+        'email': normalize(email),
+        'phonetic': '{} {}'.format(soundex(personal), soundex(family)),
+    }
+    if personal or family:
+        keys['name'] = '{}|{}'.format(personal, family)
+        keys['switched'] = '{}|{}'.format(family, personal)
+
+    return {
+        (kind, keys[kind][:KEY_LENGTH])
+        for kind in DUPLICATE_KEY_KINDS[model_name]
+        if keys.get(kind, '').strip()
+    }
+
+
+def _model_name(model):
+    return model._meta.model_name
+
+
+def _objects_keys(model, pks=None):
+    """Yield (pk, keys) for objects of `model`, optionally only objects with
+    `pks`."""
+    name = _model_name(model)
+    objects = model.objects.order_by()
+    if pks is not None:
+        objects = objects.filter(pk__in=pks)
+    for pk, *values in objects.values_list('pk', *DUPLICATE_KEY_FIELDS) \
+                              .iterator():
+        yield pk, object_keys(name, *values)
+
+
+def update_keys(model, pks):
+    """Bring keys of `model` objects with `pks` up-to-date.  Only changed keys
+    are written."""
+    DuplicateKey = django_apps.get_model('workshops', 'DuplicateKey')
+    name = _model_name(model)
+
+    current = {pk: set() for pk in pks}
+    entries = DuplicateKey.objects.filter(model=name, object_id__in=pks)
+    for object_id, kind, key in entries.values_list('object_id', 'kind',
+                                                    'key'):
+        current[object_id].add((kind, key))
+
+    new_entries = []
+    for pk, keys in _objects_keys(model, pks):
+        existing = current.pop(pk)
+        for kind, key in existing - keys:
+            entries.filter(object_id=pk, kind=kind, key=key).delete()
+        new_entries += [
+            DuplicateKey(model=name, object_id=pk, kind=kind, key=key)
+            for kind, key in keys - existing
+        ]
+    DuplicateKey.objects.bulk_create(new_entries)
+
+    # remaining objects don't exist anymore
+    if current:
+        entries.filter(object_id__in=current).delete()
+
+
+def remove_keys(model, pks):
+    """Remove keys of `model` objects with `pks`."""
+    DuplicateKey = django_apps.get_model('workshops', 'DuplicateKey')
+    DuplicateKey.objects.filter(model=_model_name(model),
+                                object_id__in=pks).delete()
+
+
+def rebuild_keys(get_model=django_apps.get_model):
+    """Recreate keys of all objects.  `get_model` can be used to provide
+    historical models in migrations."""
+    DuplicateKey = get_model('workshops', 'DuplicateKey')
+    DuplicateKey.objects.all().delete()
+
+    for name in DUPLICATE_KEY_KINDS:
+        model = get_model('workshops', name)
+        DuplicateKey.objects.bulk_create(
+            DuplicateKey(model=name, object_id=pk, kind=kind, key=key)
+            for pk, keys in _objects_keys(model)
+            for kind, key in keys
+        )
+
+
+def find_duplicates(queryset, kind):
+    """Objects from `queryset` sharing a key of `kind` with another object.
+    The shared key is available as `duplicate_key`, so that ordering by it
+    puts possible duplicates next to each other."""
+    DuplicateKey = django_apps.get_model('workshops', 'DuplicateKey')
+    name = _model_name(queryset.model)
+
+    keys = DuplicateKey.objects.filter(model=name, kind=kind)
+    shared = (
+        keys.values('key')
+            .annotate(count=Count('id'))
+            .filter(count__gt=1)
+            .values('key')
+    )
+    duplicates = keys.filter(key__in=shared)
+    return queryset.filter(pk__in=duplicates.values('object_id')).annotate(
+        duplicate_key=Subquery(
+            keys.filter(object_id=OuterRef('pk')).values('key')[:1]
+        ),
+    )
+
+
+def find_switched(queryset):
+    """Objects from `queryset` whose name is someone's name with switched
+    personal and family parts."""
+    DuplicateKey = django_apps.get_model('workshops', 'DuplicateKey')
+    name = _model_name(queryset.model)
+
+    keys = DuplicateKey.objects.filter(model=name)
+    switched = keys.filter(
+        kind='name',
+        key__in=keys.filter(kind='switched').values('key'),
+    )
+    return queryset.filter(pk__in=switched.values('object_id'))
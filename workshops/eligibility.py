@@ -0,0 +1,114 @@
+"""Instructor eligibility of trainees.
+
+Requirements passed by every person and instructor badges awarded to them are
+stored in `InstructorEligibility` records, so that listing trainees doesn't
+require aggregating their training progresses and awards.  Signals (see
+`workshops.signals`) keep the records up-to-date when progresses or awards
+change (once per transaction, when it's committed); code changing them without sending signals (e.g. `QuerySet.update()`)
+has to call `update_eligibility()` itself.  Persons without passed
+requirements or instructor badges don't have a record."""
+
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import transaction
+
+# fields telling if any of requirements (names of `TrainingRequirement`) was
+# passed
+PASSED_FIELDS = {
+    'passed_training': ('Training', ),
+    'passed_swc_homework': ('SWC Homework', ),
+    'passed_dc_homework': ('DC Homework', ),
+    'passed_discussion': ('Discussion', ),
+    'passed_swc_demo': ('SWC Demo', ),
+    'passed_dc_demo': ('DC Demo', ),
+    'passed_homework': ('SWC Homework', 'DC Homework'),
+    'passed_demo': ('SWC Demo', 'DC Demo'),
+}
+
+# requirements necessary to become an instructor
+ELIGIBILITY_REQUIREMENTS = (
+    ('passed_training', 'Training'),
+    ('passed_homework', 'SWC or DC Homework'),
+    ('passed_discussion', 'Discussion'),
+    ('passed_demo', 'SWC or DC Demo'),
+)
+
+# fields telling if a badge was awarded
+BADGE_FIELDS = {
+    'is_swc_instructor': 'swc-instructor',
+    'is_dc_instructor': 'dc-instructor',
+}
+
+ELIGIBILITY_FIELDS = (tuple(PASSED_FIELDS) + ('instructor_eligible', ) +
+                      tuple(BADGE_FIELDS))
+
+# field pointing to the person, for models whose changes affect eligibility
+PERSON_FIELDS = {
+    'trainingprogress': 'trainee',
+    'award': 'person',
+}
+
+
+def calculate_eligibility(get_model=django_apps.get_model, pks=None):
+    """Dictionary of `InstructorEligibility` fields' values by person's ID.
+    Persons without passed requirements or instructor badges are skipped.
+    `get_model` can be used to provide historical models in migrations."""
+    TrainingProgress = get_model('workshops', 'TrainingProgress')
+    Award = get_model('workshops', 'Award')
+
+    result = defaultdict(lambda: dict.fromkeys(ELIGIBILITY_FIELDS, False))
+
+    progresses = TrainingProgress.objects.filter(state='p', discarded=False)
+    awards = Award.objects.filter(badge__name__in=BADGE_FIELDS.values())
+    if pks is not None:
+        progresses = progresses.filter(trainee__in=pks)
+        awards = awards.filter(person__in=pks)
+
+    passed = progresses.order_by().values_list('trainee', 'requirement__name')
+    for pk, requirement in passed.distinct():
+        for field, requirements in PASSED_FIELDS.items():
+            if requirement in requirements:
+                result[pk][field] = True
+
+    awarded = awards.order_by().values_list('person', 'badge__name')
+    for pk, badge in awarded:
+        for field, name in BADGE_FIELDS.items():
+            if badge == name:
+                result[pk][field] = True
+
+    for values in result.values():
+        values['instructor_eligible'] = all(
+            values[field] for field, _ in ELIGIBILITY_REQUIREMENTS
+        )
+    return dict(result)
+
+
+def update_eligibility(pks):
+    """Recalculate `InstructorEligibility` records of persons with `pks`."""
+    InstructorEligibility = django_apps.get_model('workshops',
+                                                  'InstructorEligibility')
+    pks = set(pks)
+    if not pks:
+        return
+
+    with transaction.atomic():
+        calculated = calculate_eligibility(pks=pks)
+        InstructorEligibility.objects.filter(person__in=pks).delete()
+        InstructorEligibility.objects.bulk_create(
+            InstructorEligibility(person_id=pk, **values)
+            for pk, values in calculated.items()
+        )
+
+
+def rebuild_eligibility(get_model=django_apps.get_model):
+    """Recreate `InstructorEligibility` records of all persons.  `get_model`
+    can be used to provide historical models in migrations."""
+    InstructorEligibility = get_model('workshops', 'InstructorEligibility')
+
+    with transaction.atomic():
+        InstructorEligibility.objects.all().delete()
+        InstructorEligibility.objects.bulk_create(
+            InstructorEligibility(person_id=pk, **values)
+            for pk, values in calculate_eligibility(get_model).items()
+        )
@@ -9,6 +9,7 @@ from dal.autocomplete import (
     ModelSelect2Multiple as DALModelSelect2Multiple,
     TagSelect2 as DALTagSelect2,
 )
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MaxLengthValidator
 from django.db import models
 from django import forms
@@ -76,3 +77,42 @@ class ModelSelect2Multiple(Select2WidgetMixin, DALModelSelect2Multiple):
 
 class TagSelect2(Select2WidgetMixin, DALTagSelect2):
     pass
+
+#------------------------------------------------------------
+
+# maximum number of objects selected in `ModelIDListField` by default.  It
+# must stay below Django's limit of fields in a request
+# (`DATA_UPLOAD_MAX_NUMBER_FIELDS`, 1000 by default), which counts every
+# posted value, including the selected IDs and the other fields of a form;
+# otherwise requests with too many IDs are rejected before the form can
+# report a readable error.
+MAX_SELECTED_IDS = 500
+
+
+class ModelIDListField(forms.ModelMultipleChoiceField):
+    """Objects selected by their IDs, e.g. with checkboxes on a listing or
+    with `ModelSelect2Multiple` widget (both render only selected objects,
+    never all objects in `queryset`).
+
+    Posted IDs are validated with one query, and only if there are at most
+    `max_ids` distinct IDs."""
+
+    widget = forms.MultipleHiddenInput
+    default_error_messages = {
+        'max_ids': 'Select at most %(limit)d items (%(count)d selected).',
+    }
+
+    def __init__(self, queryset, max_ids=MAX_SELECTED_IDS, **kwargs):
+        self.max_ids = max_ids
+        super().__init__(queryset, **kwargs)
+
+    def clean(self, value):
+        if isinstance(value, (list, tuple)):
+            count = len(set(str(pk) for pk in value))
+            if count > self.max_ids:
+                raise ValidationError(
+                    self.error_messages['max_ids'],
+                    code='max_ids',
+                    params={'limit': self.max_ids, 'count': count},
+                )
+        return super().clean(value)
@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime, time, timedelta
 import re
 
 from dal import autocomplete
@@ -9,9 +9,13 @@ from dal_select2.widgets import (
     ModelSelect2Multiple,
 )
 import django_filters
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.forms import widgets
+from django.utils import timezone
 from django_countries import Countries
+from reversion import revisions as reversion
+from reversion.models import Revision, Version
 
 from workshops.forms import bootstrap_helper_filter, SIDEBAR_DAL_WIDTH
 from workshops.models import (
@@ -394,6 +398,7 @@ class PersonFilter(AMYFilterSet):
     order_by = NamesOrderingFilter(
         fields=(
             'email',
+            'num_taught',
         ),
     )
 
@@ -827,3 +832,60 @@ class DCSelfOrganizedEventRequestFilter(AMYFilterSet, StateFilterSet):
         order_by = [
             '-created_at', 'created_at',
         ]
+
+
+def versioned_models_choices():
+    """Content types of models under version control, as choices."""
+    content_types = ContentType.objects.get_for_models(
+        *reversion.get_registered_models()
+    )
+    return sorted(
+        ((ct.pk, model._meta.verbose_name.capitalize())
+         for model, ct in content_types.items()),
+        key=lambda choice: choice[1],
+    )
+
+
+def filter_changed_model(qs, name, value):
+    # a subquery instead of a join, so that revisions aren't repeated
+    return qs.filter(pk__in=Version.objects.filter(content_type=value)
+                                           .values('revision'))
+
+
+def filter_changed_after(qs, name, value):
+    # compare with a datetime (not a date) to make use of the index on
+    # `date_created`
+    return qs.filter(date_created__gte=timezone.make_aware(
+        datetime.combine(value, time.min)))
+
+
+def filter_changed_before(qs, name, value):
+    return qs.filter(date_created__lt=timezone.make_aware(
+        datetime.combine(value + timedelta(days=1), time.min)))
+
+
+class ChangesLogFilter(AMYFilterSet):
+    user = django_filters.ModelChoiceFilter(
+        queryset=Person.objects.all(),
+        label='Changed by',
+        widget=autocomplete.ModelSelect2(
+            url='person-lookup',
+            attrs=SIDEBAR_DAL_WIDTH,
+        ),
+    )
+    model = django_filters.ChoiceFilter(
+        choices=versioned_models_choices,
+        label='Type of object',
+        method=filter_changed_model,
+    )
+    changed_after = django_filters.DateFilter(method=filter_changed_after)
+    changed_before = django_filters.DateFilter(method=filter_changed_before)
+
+    class Meta:
+        model = Revision
+        fields = [
+            'user',
+            'model',
+            'changed_after',
+            'changed_before',
+        ]
@@ -52,6 +52,7 @@ from workshops.fields import (
     ModelSelect2,
     ModelSelect2Multiple,
     TagSelect2,
+    ModelIDListField,
 )
 
 
@@ -242,6 +243,11 @@ class WorkshopStaffForm(forms.Form):
                                  min_value=-180.0,
                                  max_value=180.0,
                                  required=False)
+    radius = forms.FloatField(label='Within (km)',
+                              min_value=0.0,
+                              required=False,
+                              help_text='Distance from the airport or '
+                                        'coordinates.')
     airport = forms.ModelChoiceField(
         label='Airport',
         required=False,
@@ -317,6 +323,8 @@ class WorkshopStaffForm(forms.Form):
                     HTML('<hr>'),
                     'latitude',
                     'longitude',
+                    HTML('<hr>'),
+                    'radius',
                     css_class='card-body'
                 ),
                 css_class='card',
@@ -354,6 +362,12 @@ class WorkshopStaffForm(forms.Form):
             raise forms.ValidationError(
                 'Must specify an airport OR a country, OR use coordinates, OR '
                 'none of them.')
+
+        # radius is only meaningful with a location to measure it from
+        if cleaned_data.get('radius') is not None and not (airport or latlng):
+            raise forms.ValidationError(
+                'Must specify an airport or coordinates if searching within '
+                'a radius.')
         return cleaned_data
 
 
@@ -1670,14 +1684,8 @@ class BulkAddTrainingProgressForm(forms.ModelForm):
         widget=ModelSelect2(url='ttt-event-lookup')
     )
 
-    trainees = forms.ModelMultipleChoiceField(queryset=Person.objects.all())
-    # TODO: add trainees lookup?
-    # trainees = forms.ModelMultipleChoiceField(
-    #     label='Trainees',
-    #     required=False,
-    #     queryset=Person.objects.all(),
-    #     widget=ModelSelect2(url='person-lookup'),
-    # )
+    # checkboxes are rendered in the template
+    trainees = ModelIDListField(queryset=Person.objects.all())
 
     helper = BootstrapHelper(additional_form_class='training-progress',
                              submit_label='Add',
@@ -1714,11 +1722,14 @@ class BulkAddTrainingProgressForm(forms.ModelForm):
 
         trainees = cleaned_data.get('trainees')
 
-        # check if all trainees have at least one training task
-        for trainee in trainees:
-            training_tasks = trainee.get_training_tasks()
-
-            if not training_tasks:
+        # check if all trainees have at least one training task (with one
+        # query for all trainees)
+        if trainees:
+            trained = Task.objects.filter(
+                person__in=trainees, role__name='learner',
+                event__tags__name='TTT',
+            ).values('person')
+            if trainees.exclude(pk__in=trained).exists():
                 raise ValidationError("It's not possible to add training "
                                       "progress to a trainee without any "
                                       "training task.")
@@ -1728,14 +1739,8 @@ class BulkDiscardProgressesForm(forms.Form):
     """Form used to bulk discard all TrainingProgresses associated with
     selected trainees."""
 
-    trainees = forms.ModelMultipleChoiceField(queryset=Person.objects.all())
-    # TODO: add trainees lookup?
-    # trainees = forms.ModelMultipleChoiceField(
-    #     label='Trainees',
-    #     required=False,
-    #     queryset=Person.objects.all(),
-    #     widget=ModelSelect2(url='person-lookup'),
-    # )
+    # checkboxes are rendered in the template
+    trainees = ModelIDListField(queryset=Person.objects.all())
 
     helper = BootstrapHelper(add_submit_button=False,
                              form_tag=False,
@@ -1774,15 +1779,9 @@ class BulkChangeTrainingRequestForm(forms.Form):
     """Form used to bulk discard training requests or bulk unmatch trainees
     from trainings."""
 
-    requests = forms.ModelMultipleChoiceField(
-        queryset=TrainingRequest.objects.all())
-    # TODO: add training-requests lookup?
-    # requests = forms.ModelMultipleChoiceField(
-    #     label='Requests',
-    #     required=False,
-    #     queryset=TrainingRequest.objects.all()
-    #     widget=ModelSelect2(url='???-lookup'),
-    # )
+    # checkboxes are rendered in the template
+    requests = ModelIDListField(
+        queryset=TrainingRequest.objects.select_related('person'))
 
     helper = BootstrapHelper(add_submit_button=False,
                              form_tag=False,
@@ -1831,8 +1830,9 @@ class BulkChangeTrainingRequestForm(forms.Form):
 
 
 class BulkMatchTrainingRequestForm(forms.Form):
-    requests = forms.ModelMultipleChoiceField(
-        queryset=TrainingRequest.objects.all())
+    # checkboxes are rendered in the template
+    requests = ModelIDListField(
+        queryset=TrainingRequest.objects.select_related('person'))
 
     event = forms.ModelChoiceField(
         label='Training',
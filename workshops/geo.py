@@ -0,0 +1,308 @@
+"""Searching airports by location.
+
+Airports are kept in an in-process grid index (see `AirportIndex`), so that
+finding airports close to some point doesn't require scanning and sorting
+whole table.  `ByAirportDistance` uses it to order objects (e.g. people) by
+distance from their airport.  Distances are great-circle distances in
+kilometers."""
+
+from collections import defaultdict
+from collections.abc import Sequence
+from functools import reduce
+import math
+import operator
+import time
+
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.functions import Least
+
+from workshops.models import Airport
+
+
+EARTH_RADIUS_KM = 6371.0
+
+# maximum age of the index; airport changes made in other processes
+# aren't signalled to this one
+AIRPORT_INDEX_MAX_AGE = 10 * 60  # seconds
+
+
+def great_circle_distance(lat1, lng1, lat2, lng2):
+    """Distance between two points (in degrees), in kilometers, calculated
+    with haversine formula."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class MathFunc(Func):
+    output_field = FloatField()
+
+
+class Sin(MathFunc):
+    function = 'SIN'
+
+
+class Cos(MathFunc):
+    function = 'COS'
+
+
+class ASin(MathFunc):
+    function = 'ASIN'
+
+
+class Sqrt(MathFunc):
+    function = 'SQRT'
+
+
+# functions above, for SQLite which doesn't have them built in (see
+# `workshops.signals.register_math_functions`)
+SQLITE_MATH_FUNCTIONS = {
+    'SIN': math.sin,
+    'COS': math.cos,
+    'ASIN': math.asin,
+    'SQRT': math.sqrt,
+}
+
+
+def distance_to(lat, lng, prefix=''):
+    """Database expression for great-circle distance, in kilometers, from
+    (`lat`, `lng`) to points stored in `latitude` and `longitude` fields
+    (prefixed with `prefix`, e.g. "airport__").  Calculated like
+    `great_circle_distance()`."""
+    def radians(value):
+        return value * Value(math.pi / 180, output_field=FloatField())
+
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2 = radians(F(prefix + 'latitude'))
+    lng2 = radians(F(prefix + 'longitude'))
+    half_dlat = Sin((lat2 - Value(lat1)) / Value(2.0))
+    half_dlng = Sin((lng2 - Value(lng1)) / Value(2.0))
+    a = (half_dlat * half_dlat +
+         Value(math.cos(lat1)) * Cos(lat2) * half_dlng * half_dlng)
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Value(1.0), Sqrt(a)))
+
+
+def bounding_box(lat, lng, radius):
+    """Latitude range and list of longitude ranges (None for all longitudes)
+    containing all points within `radius` km from (`lat`, `lng`).  Longitudes
+    crossing the antimeridian are split in two ranges."""
+    angle = radius / EARTH_RADIUS_KM
+    delta = math.degrees(angle)
+    lat_min, lat_max = lat - delta, lat + delta
+    latitudes = (max(lat_min, -90), min(lat_max, 90))
+
+    # the circle contains a pole or is wider than its parallel
+    cos_lat = math.cos(math.radians(lat))
+    if (angle >= math.pi / 2 or lat_min <= -90 or lat_max >= 90 or
+            math.sin(angle) >= cos_lat):
+        return latitudes, None
+
+    lng_delta = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    west, east = lng - lng_delta, lng + lng_delta
+    if west < -180:
+        return latitudes, [(west + 360, 180), (-180, east)]
+    if east > 180:
+        return latitudes, [(west, 180), (-180, east - 360)]
+    return latitudes, [(west, east)]
+
+
+def bounding_box_q(lat, lng, radius, prefix=''):
+    """Condition for points stored in `latitude` and `longitude` fields
+    (prefixed with `prefix`) to lie in `bounding_box()`.  It needs no
+    calculations, so it's cheap to check before `distance_to()`."""
+    latitudes, longitudes = bounding_box(lat, lng, radius)
+    q = Q(**{prefix + 'latitude__range': latitudes})
+    if longitudes is not None:
+        q &= reduce(operator.or_, [
+            Q(**{prefix + 'longitude__range': longitude_range})
+            for longitude_range in longitudes
+        ])
+    return q
+
+
+class AirportIndex:
+    """Airports grouped in cells of `CELL_SIZE` x `CELL_SIZE` degrees.
+
+    Searching within a radius only looks at cells overlapping the circle
+    (with longitude wrapping around the antimeridian and all longitudes
+    included near the poles), and then checks exact distances."""
+
+    CELL_SIZE = 5  # degrees
+    LAT_CELLS = 180 // CELL_SIZE
+    LNG_CELLS = 360 // CELL_SIZE
+
+    def __init__(self, airports):
+        """`airports` is an iterable of (pk, latitude, longitude) tuples."""
+        self.cells = defaultdict(list)
+        self.size = 0
+        for pk, lat, lng in airports:
+            self.cells[self._cell(lat, lng)].append((pk, lat, lng))
+            self.size += 1
+
+    def _lat_cell(self, lat):
+        return min(int((lat + 90) // self.CELL_SIZE), self.LAT_CELLS - 1)
+
+    def _lng_cell(self, lng):
+        return int((lng + 180) // self.CELL_SIZE) % self.LNG_CELLS
+
+    def _cell(self, lat, lng):
+        return self._lat_cell(lat), self._lng_cell(lng)
+
+    def _cells_within(self, lat, lng, radius):
+        """Cells possibly containing points within `radius` km from
+        (`lat`, `lng`)."""
+        angle = radius / EARTH_RADIUS_KM
+        if angle >= math.pi:
+            return list(self.cells)
+
+        delta = math.degrees(angle)
+        lat_min, lat_max = lat - delta, lat + delta
+        lat_cells = range(self._lat_cell(max(lat_min, -90)),
+                          self._lat_cell(min(lat_max, 90)) + 1)
+
+        # width of the circle in longitude; the circle contains a pole or
+        # is wider than its parallel
+        cos_lat = math.cos(math.radians(lat))
+        if lat_min <= -90 or lat_max >= 90 or math.sin(angle) >= cos_lat:
+            lng_cells = range(self.LNG_CELLS)
+        else:
+            lng_delta = math.degrees(math.asin(math.sin(angle) / cos_lat))
+            first = self._lng_cell(lng - lng_delta)
+            count = int(2 * lng_delta // self.CELL_SIZE) + 2
+            lng_cells = [(first + i) % self.LNG_CELLS
+                         for i in range(min(count, self.LNG_CELLS))]
+
+        return [(i, j) for i in lat_cells for j in lng_cells
+                if (i, j) in self.cells]
+
+    def within(self, lat, lng, radius):
+        """List of (distance, pk) tuples for airports within `radius` km from
+        (`lat`, `lng`), closest first."""
+        results = []
+        for cell in self._cells_within(lat, lng, radius):
+            for pk, airport_lat, airport_lng in self.cells[cell]:
+                distance = great_circle_distance(lat, lng,
+                                                 airport_lat, airport_lng)
+                if distance <= radius:
+                    results.append((distance, pk))
+        results.sort()
+        return results
+
+    def nearest(self, lat, lng, k, radius=None):
+        """List of (distance, pk) tuples for `k` airports nearest to
+        (`lat`, `lng`), closest first.  Optionally only airports within
+        `radius` km are returned."""
+        max_radius = math.pi * EARTH_RADIUS_KM
+        if radius is not None:
+            max_radius = min(radius, max_radius)
+
+        # widen the search until it finds enough airports
+        search_radius = min(500.0, max_radius)
+        while True:
+            results = self.within(lat, lng, search_radius)
+            if len(results) >= k or search_radius >= max_radius:
+                return results[:k]
+            search_radius = min(search_radius * 4, max_radius)
+
+
+_airport_index = None
+_airport_index_built = None
+
+
+def airport_index():
+    """Index of all airports, built on first use and rebuilt after airports
+    change (see `workshops.signals.airport_changed`)."""
+    global _airport_index, _airport_index_built
+
+    now = time.monotonic()
+    if (_airport_index is None or
+            now - _airport_index_built > AIRPORT_INDEX_MAX_AGE):
+        _airport_index = AirportIndex(
+            Airport.objects.values_list('pk', 'latitude', 'longitude')
+        )
+        _airport_index_built = now
+    return _airport_index
+
+
+def reset_airport_index():
+    """Drop the index, so that it's rebuilt on next use."""
+    global _airport_index
+    _airport_index = None
+
+
+class ByAirportDistance(Sequence):
+    """Objects from `queryset` ordered by distance from their airport (at
+    `prefix`) to (`lat`, `lng`), optionally only ones within `radius` km.
+    Can be paginated like a queryset.
+
+    Distance is calculated only for objects close enough to fill the
+    requested slice: nearest airports are found in the index, widening the
+    search until it covers enough objects."""
+
+    def __init__(self, queryset, lat, lng, radius=None, prefix='airport__',
+                 ordering=('distance', )):
+        self.queryset = queryset
+        self.lat, self.lng = lat, lng
+        self.radius = radius
+        self.prefix = prefix
+        self.ordering = ordering
+
+    def _within(self, radius):
+        distance = distance_to(self.lat, self.lng, prefix=self.prefix)
+        queryset = self.queryset.annotate(distance=distance)
+        if radius is None:
+            return queryset
+        return queryset.filter(bounding_box_q(self.lat, self.lng, radius,
+                                              prefix=self.prefix),
+                               distance__lte=radius)
+
+    def _search_radius(self, needed):
+        """Radius containing at least `needed` objects, or `radius` if all
+        of them are needed."""
+        k = max(needed, 1)
+        while True:
+            nearest = airport_index().nearest(self.lat, self.lng, k,
+                                              radius=self.radius)
+            if len(nearest) < k:
+                return self.radius
+            # with a margin for rounding errors of distances calculated in
+            # the database
+            search_radius = nearest[-1][0] + 0.001
+            if self.radius is not None:
+                search_radius = min(search_radius, self.radius)
+            if self._within(search_radius).count() >= needed:
+                return search_radius
+            k *= 4
+
+    def matching(self):
+        """All objects (within `radius`), unordered."""
+        if self.radius is None:
+            return self.queryset
+        return self._within(self.radius)
+
+    def ordered(self, radius=None):
+        return self._within(radius).order_by(*self.ordering)
+
+    def count(self):
+        return self.matching().count()
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self.ordered(self.radius))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = key.start or 0, key.stop
+            if key.step is not None or start < 0 or stop is None or stop < 0:
+                return list(self)[key]
+            return list(self.ordered(self._search_radius(stop))[start:stop])
+
+        if key < 0:
+            return list(self)[key]
+        objects = self[key:key + 1]
+        if not objects:
+            raise IndexError('Index out of range.')
+        return objects[0]
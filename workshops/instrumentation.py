@@ -0,0 +1,229 @@
+"""Measuring database work done by views.
+
+`QueryInstrumentationMiddleware` records every query run while handling
+a request, and adds request's numbers to statistics per URL name.  The
+numbers are also logged (logger `workshops.instrumentation`), with a warning
+if a view exceeds its query budget.
+
+Budgets are declared with `@query_budget(n)` decorator on function-based
+views, or `query_budget = n` attribute of class-based views.  Tests can
+check them with `TestBase.assertWithinQueryBudget`.
+
+Queries are recorded until the response is closed, so that queries run while
+streaming a response's content (e.g. `StreamingHttpResponse`) or rendering it
+late are counted as well.
+
+Statistics are kept in memory of every process and are exposed in
+Prometheus text format by `query_stats` view.
+
+`debug_toolbar.middleware.DebugToolbarMiddleware` is listed before this
+middleware in `MIDDLEWARE` (see `amy/settings.py`), so queries run by the
+toolbar itself are never counted."""
+
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+import logging
+import re
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger('workshops.instrumentation')
+
+# lists of query parameters, e.g. in `IN (%s, %s, %s)`, of any length have
+# the same fingerprint
+PARAMS_LIST_REGEX = re.compile(r'\(%s(\s*,\s*%s)*\)')
+
+
+def query_budget(budget):
+    """Declare the maximum number of queries a function-based view may run
+    (including queries run by middlewares and templates)."""
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    budget = getattr(view, 'query_budget', None)
+    if budget is None:
+        # class-based views
+        budget = getattr(getattr(view, 'view_class', None), 'query_budget',
+                         None)
+    return budget
+
+
+def fingerprint(sql):
+    """SQL with whitespace and lists of parameters normalized."""
+    return PARAMS_LIST_REGEX.sub('(%s, ...)', ' '.join(sql.split()))
+
+
+class RequestQueryStats:
+    """Queries run during a single request."""
+
+    def __init__(self, view_name, budget=None):
+        self.view_name = view_name
+        self.budget = budget
+        self.fingerprints = Counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # used as a database execute wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        """Number of queries repeating an already run query (with possibly
+        different parameters)."""
+        return sum(n - 1 for n in self.fingerprints.values())
+
+    def most_repeated(self, n=3):
+        return [(sql, count) for sql, count in self.fingerprints.most_common(n)
+                if count > 1]
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+
+class ViewStats:
+    """Statistics of all requests handled by views, by URL name."""
+
+    FIELDS = ('requests', 'queries', 'duplicates', 'sql_seconds', 'seconds',
+              'over_budget')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+            self.max_queries = defaultdict(int)
+            self.budgets = dict()
+
+    def add(self, stats):
+        with self.lock:
+            totals = self.totals[stats.view_name]
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['duplicates'] += stats.duplicates
+            totals['sql_seconds'] += stats.sql_time
+            totals['seconds'] += stats.duration
+            totals['over_budget'] += int(stats.over_budget)
+            self.max_queries[stats.view_name] = max(
+                self.max_queries[stats.view_name], stats.queries,
+            )
+            if stats.budget is not None:
+                self.budgets[stats.view_name] = stats.budget
+
+    def prometheus(self):
+        """Statistics in Prometheus text exposition format."""
+        metrics = [
+            ('requests', 'counter', 'Number of handled requests'),
+            ('queries', 'counter', 'Number of database queries'),
+            ('duplicates', 'counter',
+             'Number of database queries repeated within a request'),
+            ('sql_seconds', 'counter', 'Time spent on database queries'),
+            ('seconds', 'counter',
+             'Time spent on handling requests, including rendering'),
+            ('over_budget', 'counter',
+             'Number of requests exceeding the query budget'),
+        ]
+        with self.lock:
+            totals = {view: dict(values)
+                      for view, values in self.totals.items()}
+            max_queries = dict(self.max_queries)
+            budgets = dict(self.budgets)
+
+        lines = []
+        for field, type_, help_ in metrics:
+            name = 'amy_view_{}_total'.format(field)
+            lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} {}'.format(name, type_))
+            for view in sorted(totals):
+                lines.append('{}{{view="{}"}} {}'.format(
+                    name, view, round(totals[view][field], 6),
+                ))
+
+        for name, help_, values in [
+            ('amy_view_max_queries', 'Highest number of queries in a request',
+             max_queries),
+            ('amy_view_query_budget', 'Declared query budget', budgets),
+        ]:
+            lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} gauge'.format(name))
+            for view in sorted(values):
+                lines.append('{}{{view="{}"}} {}'.format(
+                    name, view, values[view],
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+view_stats = ViewStats()
+
+
+class QueryRecording:
+    """Record queries run on all database connections into `stats`, from
+    creation until `close()`."""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.start = time.perf_counter()
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(stats))
+
+    def close(self):
+        """Stop recording and add request's statistics to `view_stats`.
+        Called when the response is closed, more calls are ignored."""
+        if self.stack is None:
+            return
+        self.stack.close()
+        self.stack = None
+        stats = self.stats
+        stats.duration = time.perf_counter() - self.start
+
+        # not resolved URLs (e.g. 404 pages) aren't recorded
+        if stats.view_name is not None:
+            view_stats.add(stats)
+            log = logger.warning if stats.over_budget else logger.debug
+            log('%s: %d queries (%d duplicates, budget %s), %.1f ms SQL, '
+                '%.1f ms total', stats.view_name, stats.queries,
+                stats.duplicates, stats.budget, stats.sql_time * 1000,
+                stats.duration * 1000)
+
+
+class QueryInstrumentationMiddleware:
+    """Record queries run during every request (see module's docstring).
+    Request's statistics are available as `request.query_stats`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request.query_stats = RequestQueryStats(view_name=None)
+        recording = QueryRecording(stats)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            recording.close()
+            raise
+        # the server (or test client) closes the response after sending its
+        # content
+        response._closable_objects.append(recording)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request.query_stats.view_name = match.view_name if match else None
+        request.query_stats.budget = get_query_budget(view_func)
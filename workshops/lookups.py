@@ -6,41 +6,106 @@ import re
 from dal import autocomplete
 from django.contrib.auth.models import Group
 from django.conf.urls import url
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Case, When, Value, IntegerField
+from django.http import HttpResponse
 
 from workshops import models
+from workshops.search import lookup_cache, search as search_index
 from workshops.util import OnlyForAdminsNoRedirectMixin, LoginNotRequiredMixin
 
 
+def search(queryset, term, q):
+    """Search using the index; short words of typed term match beginnings of
+    words, so that even the first keystrokes use the index."""
+    return search_index(queryset, term, q, short_words_as_prefixes=True)
+
+
+class CachedLookupMixin:
+    """Keep responses in `workshops.search.lookup_cache`, put results
+    starting with the query (in any of `prefix_fields`) first, and limit them
+    to `max_results`."""
+    prefix_fields = ()
+    max_results = 100
+
+    def get_cache_key(self, request):
+        """Responses depend on the query (with forwarded fields) and, when
+        the view can create objects, on user's permission to add them.
+        Access to the view is checked before the cache is used."""
+        can_add = bool(self.create_field) and self.has_add_permission(request)
+        return (
+            type(self).__name__,
+            tuple(sorted((key, tuple(values))
+                         for key, values in request.GET.lists())),
+            can_add,
+        )
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        content = lookup_cache.get(key)
+        if content is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = response.content
+            lookup_cache.set(key, content)
+        return HttpResponse(content, content_type='application/json')
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.q:
+            ordering = queryset.query.order_by or \
+                queryset.model._meta.ordering
+            prefix_q = reduce(operator.or_, [
+                Q(**{'{}__istartswith'.format(field): self.q})
+                for field in self.prefix_fields
+            ])
+            queryset = queryset.annotate(
+                prefix_match=Case(When(prefix_q, then=Value(1)),
+                                  default=Value(0),
+                                  output_field=IntegerField()),
+            ).order_by('-prefix_match', *ordering, 'pk')
+            queryset = queryset[:self.max_results]
+        return super().paginate_queryset(queryset, page_size)
+
+
 class EventLookupView(OnlyForAdminsNoRedirectMixin,
+                      CachedLookupMixin,
                       autocomplete.Select2QuerySetView):
+    prefix_fields = ('slug', )
+
     def get_queryset(self):
         results = models.Event.objects.all()
 
         if self.q:
-            results = results.filter(slug__icontains=self.q)
+            results = search(results, self.q, Q(slug__icontains=self.q))
 
         return results
 
 
 class TTTEventLookupView(OnlyForAdminsNoRedirectMixin,
+                         CachedLookupMixin,
                          autocomplete.Select2QuerySetView):
+    prefix_fields = ('slug', )
+
     def get_queryset(self):
         results = models.Event.objects.filter(tags__name='TTT')
 
         if self.q:
-            results = results.filter(slug__icontains=self.q)
+            results = search(results, self.q, Q(slug__icontains=self.q))
 
         return results
 
 
 class OrganizationLookupView(OnlyForAdminsNoRedirectMixin,
+                             CachedLookupMixin,
                              autocomplete.Select2QuerySetView):
+    prefix_fields = ('domain', 'fullname')
+
     def get_queryset(self):
         results = models.Organization.objects.all()
 
         if self.q:
-            results = results.filter(
+            results = search(
+                results, self.q,
                 Q(domain__icontains=self.q) | Q(fullname__icontains=self.q)
             )
 
@@ -48,7 +113,11 @@ class OrganizationLookupView(OnlyForAdminsNoRedirectMixin,
 
 
 class MembershipLookupView(OnlyForAdminsNoRedirectMixin,
+                           CachedLookupMixin,
                            autocomplete.Select2QuerySetView):
+    prefix_fields = ('organization__domain', 'organization__fullname',
+                     'variant')
+
     def get_queryset(self):
         results = models.Membership.objects.all()
 
@@ -60,8 +129,11 @@ class MembershipLookupView(OnlyForAdminsNoRedirectMixin,
                 date = None
 
             # filter by organization name
-            org_q = (Q(organization__domain__icontains=self.q) |
-                     Q(organization__fullname__icontains=self.q))
+            organizations = search(
+                models.Organization.objects.all(), self.q,
+                Q(domain__icontains=self.q) | Q(fullname__icontains=self.q)
+            )
+            org_q = Q(organization__in=organizations)
 
             # filter by variant
             variant_q = Q(variant__icontains=self.q)
@@ -78,7 +150,10 @@ class MembershipLookupView(OnlyForAdminsNoRedirectMixin,
 
 
 class PersonLookupView(OnlyForAdminsNoRedirectMixin,
+                       CachedLookupMixin,
                        autocomplete.Select2QuerySetView):
+    prefix_fields = ('personal', 'family', 'email', 'username')
+
     def get_queryset(self):
         results = models.Person.objects.all()
 
@@ -102,18 +177,21 @@ class PersonLookupView(OnlyForAdminsNoRedirectMixin,
                 filters.append(complex_q)
 
             # this is brilliant: it applies OR to all search filters
-            results = results.filter(reduce(operator.or_, filters))
+            results = search(results, self.q, reduce(operator.or_, filters))
 
         return results
 
 
 class AdminLookupView(OnlyForAdminsNoRedirectMixin,
+                      CachedLookupMixin,
                       autocomplete.Select2QuerySetView):
     """The same as PersonLookup, but allows only to select administrators.
 
     Administrator is anyone with superuser power or in "administrators" group.
     """
 
+    prefix_fields = ('personal', 'family', 'email', 'username')
+
     def get_queryset(self):
         admin_group = Group.objects.get(name='administrators')
         results = models.Person.objects.filter(
@@ -121,7 +199,8 @@ class AdminLookupView(OnlyForAdminsNoRedirectMixin,
         )
 
         if self.q:
-            results = results.filter(
+            results = search(
+                results, self.q,
                 Q(personal__icontains=self.q) |
                 Q(family__icontains=self.q) |
                 Q(email__icontains=self.q) |
@@ -132,12 +211,16 @@ class AdminLookupView(OnlyForAdminsNoRedirectMixin,
 
 
 class AirportLookupView(OnlyForAdminsNoRedirectMixin,
+                        CachedLookupMixin,
                         autocomplete.Select2QuerySetView):
+    prefix_fields = ('iata', 'fullname')
+
     def get_queryset(self):
         results = models.Airport.objects.all()
 
         if self.q:
-            results = results.filter(
+            results = search(
+                results, self.q,
                 Q(iata__icontains=self.q) | Q(fullname__icontains=self.q)
             )
 
@@ -168,12 +251,15 @@ class LanguageLookupView(LoginNotRequiredMixin,
 
 
 class TrainingRequestLookupView(OnlyForAdminsNoRedirectMixin,
+                                CachedLookupMixin,
                                 autocomplete.Select2QuerySetView):
     """The same as PersonLookup, but allows only to select administrators.
 
     Administrator is anyone with superuser power or in "administrators" group.
     """
 
+    prefix_fields = ('personal', 'family', 'email')
+
     def get_queryset(self):
         results = models.TrainingRequest.objects.all()
 
@@ -189,7 +275,8 @@ class TrainingRequestLookupView(OnlyForAdminsNoRedirectMixin,
                 # empty Q
                 name_q = Q(id=0)
 
-            results = results.filter(
+            results = search(
+                results, self.q,
                 Q(personal__icontains=self.q) |
                 Q(family__icontains=self.q) |
                 Q(email__icontains=self.q) |
@@ -1,11 +1,17 @@
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 from functools import partial
 import json
 import socket
 import sys
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlparse
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from github import Github
 from github.GithubException import GithubException
 import requests
@@ -13,7 +19,10 @@ from rest_framework.utils.encoders import JSONEncoder
 
 from workshops.models import Event
 from workshops.util import (
+    WEBSITE_REQUEST_TIMEOUT,
     fetch_event_metadata,
+    http_session,
+    metadata_hash,
     parse_metadata_from_event_website,
     WrongWorkshopURL,
 )
@@ -80,9 +89,68 @@ def datetime_decode(obj):
         return obj
 
 
+class HostRateLimiter:
+    """Space out requests made to the same host by at least `interval`
+    seconds.  Can be shared by many threads."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_request = dict()
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request to `url`'s host is allowed."""
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request.get(host, now))
+            self.next_request[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class BranchHead:
+    """Stand-in for PyGithub's `Branch` when only SHA of its head commit is
+    known (e.g. fetched with GraphQL)."""
+
+    def __init__(self, sha):
+        self.commit = SimpleNamespace(sha=sha)
+
+
 class Command(BaseCommand):
     help = 'Check if events have had their metadata updated.'
 
+    GITHUB_API_URL = 'https://api.github.com/'
+    GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+    # fields changed by this command
+    UPDATE_FIELDS = (
+        'repository_last_commit_hash',
+        'repository_metadata',
+        'repository_metadata_hash',
+        'metadata_all_changes',
+        'metadata_changed',
+    )
+
+    # metadata fields stored as ISO-formatted dates
+    METADATA_DATE_FIELDS = ('start', 'end')
+
+    METADATA_TO_CHECK = (
+        ('instructors', 'Instructors changed'),
+        ('helpers', 'Helpers changed'),
+        ('start', 'Start date changed'),
+        ('end', 'End date changed'),
+        ('country', 'Country changed'),
+        ('venue', 'Venue changed'),
+        ('address', 'Address changed'),
+        ('latitude', 'Latitude changed'),
+        ('longitude', 'Longitude changed'),
+        ('contact', 'Contact details changed'),
+        ('reg_key', 'Eventbrite key changed'),
+    )
+
+    rate_limiter = None
+
     def add_arguments(self, parser):
         parser.add_argument(
             '-t', '--token', help='GitHub API token', required=True,
@@ -98,6 +166,26 @@ class Command(BaseCommand):
             help='Age (in days) of the oldest events that can be checked.  '
                  'Default: 180'
         )
+        parser.add_argument(
+            '--workers', default=1, type=int,
+            help='Number of events checked concurrently.  Default: 1'
+        )
+        parser.add_argument(
+            '--batch-size', default=50, type=int,
+            help='Number of events saved in a single transaction.  '
+                 'Default: 50'
+        )
+        parser.add_argument(
+            '--host-interval', default=0.2, type=float,
+            help='Minimum time (in seconds) between requests to the same '
+                 'host.  Default: 0.2'
+        )
+        parser.add_argument(
+            '--graphql-batch-size', default=50, type=int,
+            help='Number of repositories whose branches are checked in a '
+                 'single GitHub GraphQL query; 0 checks every repository '
+                 'with separate REST API calls.  Default: 50'
+        )
 
     def get_events(self, cutoff_days=180):
         """Get all active events.
@@ -122,8 +210,14 @@ class Command(BaseCommand):
             return groups['name'], groups['repo']
         raise WrongWorkshopURL()
 
+    def throttle(self, url):
+        """Wait for the rate limiter (if any) before requesting `url`."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(url)
+
     def get_event_metadata(self, event_url):
         """Get metadata from event (location, instructors, helpers, etc.)."""
+        self.throttle(event_url)
         metadata = fetch_event_metadata(event_url)
         # normalize the metadata
         metadata = parse_metadata_from_event_website(metadata)
@@ -138,20 +232,117 @@ class Command(BaseCommand):
         return json.dumps(obj, cls=JSONEncoder)
 
     def deserialize(self, obj):
-        """Deserialize object from the database."""
-        objs = json.loads(obj)
-        # convert strings to datetimes (if they match format)
-        return datetime_decode(objs)
+        """Deserialize metadata from the database.  Only date fields are
+        converted, other values are kept as JSON types."""
+        metadata = json.loads(obj)
+        for field in self.METADATA_DATE_FIELDS:
+            if isinstance(metadata.get(field), str):
+                metadata[field] = datetime_match(metadata[field])
+        return metadata
 
     def load_from_github(self, github, repo_url, default_branch='gh-pages'):
         """Fetch repository data from GitHub API."""
         owner, repo_name = self.parse_github_url(repo_url)
+        self.throttle(self.GITHUB_API_URL)
         repo = github.get_repo("{}/{}".format(owner, repo_name))
+        self.throttle(self.GITHUB_API_URL)
         branch = repo.get_branch('gh-pages')
         return branch
 
+    def fetch_branch_shas(self, token, repos, branch='gh-pages'):
+        """Dictionary of SHAs of `branch` heads by (owner, name) from
+        `repos`, fetched with a single GitHub GraphQL query.  Repositories
+        without the branch (or inaccessible) are left out."""
+        repos = list(repos)
+        fields = [
+            'r{}: repository(owner: {}, name: {}) '
+            '{{ ref(qualifiedName: {}) {{ target {{ oid }} }} }}'.format(
+                i, json.dumps(owner), json.dumps(name),
+                json.dumps('refs/heads/' + branch),
+            )
+            for i, (owner, name) in enumerate(repos)
+        ]
+        self.throttle(self.GITHUB_API_URL)
+        response = http_session().post(
+            self.GITHUB_GRAPHQL_URL,
+            json={'query': '{ ' + ' '.join(fields) + ' }'},
+            headers={'Authorization': 'bearer {}'.format(token)},
+            timeout=WEBSITE_REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        # missing repositories are reported in "errors", while data for
+        # others is still returned
+        data = response.json().get('data') or {}
+
+        shas = {}
+        for i, repo in enumerate(repos):
+            ref = (data.get('r{}'.format(i)) or {}).get('ref')
+            if ref:
+                shas[repo] = ref['target']['oid']
+        return shas
+
+    def prefetch_branch_shas(self, token, events, batch_size):
+        """Dictionary of SHAs of events' branches by event's ID, fetched in
+        GraphQL queries for `batch_size` events each.  Events missing from
+        the result have to be checked with REST API."""
+        repos = {}
+        for event in events:
+            try:
+                repos[event.pk] = self.parse_github_url(event.repository_url)
+            except WrongWorkshopURL:
+                pass
+
+        pks = list(repos)
+        shas = {}
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start:start + batch_size]
+            try:
+                fetched = self.fetch_branch_shas(
+                    token, {repos[pk] for pk in batch},
+                )
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print('GraphQL query failed ({}), falling back to REST API'
+                      .format(e), file=sys.stderr)
+                continue
+            for pk in batch:
+                if repos[pk] in fetched:
+                    shas[pk] = fetched[repos[pk]]
+        return shas
+
+    def fetch(self, github, event, initial_run=False, sha=None):
+        """Fetch event's branch (unless its head's `sha` is known) and, if it
+        changed (or on initial run), its metadata.  Returns (branch,
+        metadata) tuple; metadata are `None` if they weren't fetched.
+
+        This is run in worker threads, so it mustn't touch the database."""
+        if sha is not None:
+            branch = BranchHead(sha)
+        else:
+            branch = self.load_from_github(github, event.repository_url)
+        metadata = None
+        if (initial_run or
+                branch.commit.sha != event.repository_last_commit_hash):
+            metadata = self.get_event_metadata(event.url)
+        return branch, metadata
+
+    def save_events(self, events):
+        """Save changes made to `events` in a single transaction."""
+        with transaction.atomic():
+            for event in events:
+                event.save(update_fields=self.UPDATE_FIELDS)
+
     def detect_changes(self, branch, event, save_metadata=False):
         """Detect changes made to event's metadata."""
+        hash_changed = branch.commit.sha != event.repository_last_commit_hash
+        changes = self.apply_changes(branch, event, save_metadata=save_metadata)
+        if hash_changed:
+            event.save(update_fields=self.UPDATE_FIELDS)
+        return changes
+
+    def apply_changes(self, branch, event, metadata_new=None,
+                      save_metadata=False):
+        """Detect changes made to event's metadata and update (but don't
+        save) the event.  `metadata_new` are fetched if not provided."""
         changes = []
 
         # compare commit hashes
@@ -159,7 +350,14 @@ class Command(BaseCommand):
             # Hashes differ? Update commit hash and compare stored metadata
             event.repository_last_commit_hash = branch.commit.sha
 
-            metadata_new = self.get_event_metadata(event.url)
+            if metadata_new is None:
+                metadata_new = self.get_event_metadata(event.url)
+
+            # same hash means same metadata, so there's no need to compare
+            # them field by field
+            hash_new = metadata_hash(metadata_new)
+            if hash_new == event.repository_metadata_hash:
+                return changes
 
             try:
                 metadata_old = self.deserialize(event.repository_metadata)
@@ -168,24 +366,10 @@ class Command(BaseCommand):
                 # so let's set it to the default value
                 metadata_old = self.empty_metadata()
 
-            metadata_to_check = (
-                ('instructors', 'Instructors changed'),
-                ('helpers', 'Helpers changed'),
-                ('start', 'Start date changed'),
-                ('end', 'End date changed'),
-                ('country', 'Country changed'),
-                ('venue', 'Venue changed'),
-                ('address', 'Address changed'),
-                ('latitude', 'Latitude changed'),
-                ('longitude', 'Longitude changed'),
-                ('contact', 'Contact details changed'),
-                ('reg_key', 'Eventbrite key changed'),
-            )
-
             changed = False
             # look for changed metadata
-            for key, reason in metadata_to_check:
-                if metadata_new[key] != metadata_old[key]:
+            for key, reason in self.METADATA_TO_CHECK:
+                if metadata_new[key] != metadata_old.get(key):
                     changes.append(reason)
                     changed = True
 
@@ -193,71 +377,112 @@ class Command(BaseCommand):
                 if save_metadata:
                     # we may not want to update the metadata
                     event.repository_metadata = self.serialize(metadata_new)
+                    event.repository_metadata_hash = hash_new
 
                 event.metadata_all_changes = "\n".join(changes)
                 event.metadata_changed = True
 
-            event.save()
-
         return changes
 
     def init(self, branch, event):
         """Load initial data into event's repository and metadata information."""
+        self.apply_initial(branch, event)
+        event.save(update_fields=self.UPDATE_FIELDS)
+
+    def apply_initial(self, branch, event, metadata=None):
+        """Set initial repository and metadata information, but don't save
+        the event.  `metadata` are fetched if not provided."""
+        if metadata is None:
+            metadata = self.get_event_metadata(event.url)
         event.repository_last_commit_hash = branch.commit.sha
-        metadata = self.get_event_metadata(event.url)
         event.repository_metadata = self.serialize(metadata)
+        event.repository_metadata_hash = metadata_hash(metadata)
         event.metadata_all_changes = ''
         event.metadata_changed = False
-        event.save()
+
+    def report_error(self, event, exc):
+        """Print information about an error that occurred when checking
+        `event`."""
+        if isinstance(exc, GithubException):
+            msg = 'GitHub error when accessing {} repo'.format(event.slug)
+        elif isinstance(exc, socket.timeout):
+            msg = 'Timeout when accessing {} repo'.format(event.slug)
+        elif isinstance(exc, WrongWorkshopURL):
+            msg = 'Wrong URL for {}'.format(event.slug)
+        elif isinstance(exc, requests.exceptions.RequestException):
+            msg = 'Network error when accessing {}'.format(event.slug)
+        else:
+            msg = 'Unknown error ({}): {}'.format(event.slug, exc)
+        print(msg, file=sys.stderr)
 
     def handle(self, *args, **options):
-        """Run."""
+        """Run.
+
+        Branches and metadata are fetched concurrently by `--workers` threads
+        (requests to the same host are spaced out by `--host-interval`
+        seconds), while the database is updated only from the main thread,
+        in batches of `--batch-size` events.  Unless it's the initial run,
+        branches' SHAs are first fetched with GraphQL, for
+        `--graphql-batch-size` repositories per query, and events with
+        unchanged SHA are skipped."""
         token = options['token']
         initial_run = options['init']
         slug = options['slug']
         cutoff_days = options['cutoff_days']
+        workers = max(options['workers'], 1)
+        batch_size = max(options['batch_size'], 1)
+        graphql_batch_size = max(options['graphql_batch_size'], 0)
 
         g = Github(token)
+        self.rate_limiter = HostRateLimiter(options['host_interval'])
 
         # get all events
         events = self.get_events(cutoff_days)
 
         if slug:
             events = events.filter(slug=slug)
+        events = list(events)
+
+        shas = {}
+        if not initial_run and graphql_batch_size:
+            shas = self.prefetch_branch_shas(token, events, graphql_batch_size)
 
         # dict of events with changes that will be updated in
         # the separate loop
         events_for_update = dict()
 
-        # go through all events
-        for event in events:
-            try:
-                if initial_run:
-                    branch = self.load_from_github(g, event.repository_url)
-                    self.init(branch, event)
-                    print('Initialized {}'.format(event.slug))
-                else:
-                    branch = self.load_from_github(g, event.repository_url)
-                    changes = self.detect_changes(branch, event)
-                    if changes:
-                        events_for_update[event.slug] = changes
-                        print('Detected changes in {}'.format(event.slug))
-
-            except GithubException:
-                print('GitHub error when accessing {} repo'.format(event.slug),
-                      file=sys.stderr)
-
-            except socket.timeout:
-                print('Timeout when accessing {} repo'.format(event.slug),
-                      file=sys.stderr)
-
-            except WrongWorkshopURL:
-                print('Wrong URL for {}'.format(event.slug), file=sys.stderr)
-
-            except requests.exceptions.RequestException:
-                print('Network error when accessing {}'.format(event.slug),
-                      file=sys.stderr)
-
-            except Exception as e:
-                print('Unknown error ({}): {}'.format(event.slug, e),
-                      file=sys.stderr)
+        # events waiting to be saved
+        batch = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.fetch, g, event, initial_run,
+                                shas.get(event.pk)): event
+                for event in events
+                if (event.pk not in shas or
+                    shas[event.pk] != event.repository_last_commit_hash)
+            }
+
+            for future in as_completed(futures):
+                event = futures[future]
+                try:
+                    branch, metadata = future.result()
+                    if initial_run:
+                        self.apply_initial(branch, event, metadata)
+                        batch.append(event)
+                        print('Initialized {}'.format(event.slug))
+                    elif metadata is not None:
+                        changes = self.apply_changes(branch, event, metadata)
+                        batch.append(event)
+                        if changes:
+                            events_for_update[event.slug] = changes
+                            print('Detected changes in {}'.format(event.slug))
+
+                except Exception as e:
+                    self.report_error(event, e)
+
+                if len(batch) >= batch_size:
+                    self.save_events(batch)
+                    batch = []
+
+        self.save_events(batch)
@@ -14,6 +14,7 @@ from django_countries import countries as Countries
 from faker import Faker
 from faker.providers import BaseProvider
 
+from workshops.eligibility import update_eligibility
 from workshops.models import (
     Airport,
     Role,
@@ -314,6 +315,7 @@ class Command(BaseCommand):
                 date = self.faker.date_time_between(start_date='-5y').date()
                 awards.append(Award(person=person, badge=badge, awarded=date))
             Award.objects.bulk_create(awards)
+            update_eligibility([person.pk])
 
             if randbool(0.75):
                 # Add one or more qualifications
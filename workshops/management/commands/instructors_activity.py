@@ -1,11 +1,17 @@
-import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import os
+import subprocess
 
-from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Prefetch
 from django.template.loader import get_template
+from django.utils.functional import cached_property
 
-from workshops.models import Badge, Person, Role
+from workshops.models import Award, Badge, Person, Role, Task
 
 logger = logging.getLogger()
 
@@ -32,18 +38,51 @@ class Command(BaseCommand):
             default='team@carpentries.org',
             help='E-mail used in "from:" field.',
         )
+        parser.add_argument(
+            '--batch-size', default=50, type=int,
+            help='Number of emails sent between progress reports and '
+                 'checkpoint updates.  Default: 50',
+        )
+        parser.add_argument(
+            '--workers', default=4, type=int,
+            help='Number of `mail` commands run concurrently.  Default: 4',
+        )
+        parser.add_argument(
+            '--checkpoint', action='store',
+            help='File with IDs of persons already sent to.  They are skipped '
+                 'and the file is updated after each batch, so an '
+                 'interrupted mailing can be resumed.  The file is removed '
+                 'once all emails are sent.',
+        )
 
-    def foreign_tasks(self, tasks, person, roles):
-        """List of other instructors' tasks, per event."""
+    def event_tasks(self, event_ids, roles):
+        """Dictionary of lists of tasks in `roles` by event ID, fetched for
+        all events with `event_ids` at once."""
+        tasks = Task.objects.filter(event__in=event_ids, role__in=roles) \
+                            .select_related('person')
+        result = defaultdict(list)
+        for task in tasks:
+            result[task.event_id].append(task)
+        return result
+
+    def foreign_tasks(self, tasks, person, roles, event_tasks=None):
+        """List of other instructors' tasks, per event.  `event_tasks` (see
+        `self.event_tasks`) is fetched if not provided."""
+        if event_tasks is None:
+            event_tasks = self.event_tasks([t.event_id for t in tasks], roles)
         return [
-            task.event.task_set.filter(role__in=roles)
-                               .exclude(person=person)
-                               .select_related('person')
+            [t for t in event_tasks.get(task.event_id, [])
+             if t.person_id != person.pk]
             for task in tasks
         ]
 
     def fetch_activity(self, may_contact_only=True):
-        roles = Role.objects.filter(name__in=['instructor', 'helper'])
+        """List of records (used as templates' context) for all instructors.
+
+        Tasks, awards and lessons of all instructors are fetched in a few
+        queries and grouped in memory, regardless of the number of
+        instructors."""
+        roles = list(Role.objects.filter(name__in=['instructor', 'helper']))
         instructor_badges = Badge.objects.instructor_badges()
 
         instructors = Person.objects.filter(badges__in=instructor_badges)
@@ -52,33 +91,50 @@ class Command(BaseCommand):
             instructors = instructors.exclude(may_contact=False)
 
         # let's get some things faster
-        instructors = instructors.select_related('airport') \
-                                 .prefetch_related('task_set', 'lessons',
-                                                   'award_set', 'badges')
+        instructors = instructors.select_related('airport').prefetch_related(
+            'lessons',
+            Prefetch(
+                'award_set',
+                queryset=Award.objects.filter(badge__in=instructor_badges)
+                                      .select_related('badge'),
+                to_attr='instructor_awards',
+            ),
+        )
 
         # don't repeat the records
-        instructors = instructors.distinct()
+        instructors = list(instructors.distinct())
+
+        tasks_by_person = defaultdict(list)
+        tasks = Task.objects.filter(person__in=instructors, role__in=roles) \
+                            .select_related('event', 'role')
+        for task in tasks:
+            tasks_by_person[task.person_id].append(task)
+
+        event_tasks = self.event_tasks(
+            {task.event_id for task in tasks}, roles,
+        )
 
         result = []
         for person in instructors:
-            tasks = person.task_set.filter(role__in=roles) \
-                                   .select_related('event', 'role')
+            tasks = tasks_by_person[person.pk]
             record = {
                 'person': person,
                 'lessons': person.lessons.all(),
-                'instructor_awards': person.award_set.filter(
-                    badge__in=person.badges.instructor_badges()
-                ),
-                'tasks': zip(tasks,
-                             self.foreign_tasks(tasks, person, roles)),
+                'instructor_awards': person.instructor_awards,
+                'tasks': zip(tasks, self.foreign_tasks(tasks, person, roles,
+                                                       event_tasks)),
             }
             result.append(record)
 
         return result
 
+    @cached_property
+    def template(self):
+        # loaded once and reused for all messages
+        return get_template('mailing/instructor_activity.txt')
+
     def make_message(self, record):
-        tmplt = get_template('mailing/instructor_activity.txt')
-        return tmplt.render(context=record)
+        return self.template.render(context=record)
 
     def subject(self, record):
         # in future we can vary the subject depending on the record details
@@ -87,32 +143,70 @@ class Command(BaseCommand):
     def recipient(self, record):
         return record['person'].email
 
-    def send_message(self, subject, message, sender, recipient, for_real=False,
-                     django_mailing=False):
+    def mail_command(self, subject, message, sender, recipient):
+        """Send one message with the system `mail` command."""
+        subprocess.run(
+            ['mail', '-s', subject, '-r', sender, recipient],
+            input=message, universal_newlines=True, check=True,
+        )
+
+    def send_messages(self, datatuple, for_real=False, django_mailing=False):
+        """Send (subject, message, sender, recipient) messages.  Return list
+        of errors (`None` for messages sent successfully)."""
+        errors = [None] * len(datatuple)
+
         if for_real:
             if django_mailing:
-                send_mail(subject, message, sender, [recipient])
+                # messages are sent one by one over one connection, kept open
+                # between batches, so that a failure (e.g. a dropped
+                # connection) affects only messages that weren't sent
+                for i, (subject, message, sender, recipient) \
+                        in enumerate(datatuple):
+                    email = EmailMessage(subject, message, sender,
+                                         [recipient],
+                                         connection=self.connection)
+                    try:
+                        if not self.connection.send_messages([email]):
+                            errors[i] = 'message not sent'
+                    except Exception as e:
+                        errors[i] = e
 
             else:
-                command = 'mail -s "{subject}" -r {sender} {recipient}'.format(
-                    subject=subject,
-                    sender=sender,
-                    recipient=recipient,
-                )
-
-                writer = os.popen(command, 'w')
-                writer.write(message)
-                writer.close()
-
-        if self.verbosity >= 2:
-            # write only a header
-            self.stdout.write('-' * 40 + '\n')
-            self.stdout.write('To: {}\n'.format(recipient))
-            self.stdout.write('Subject: {}\n'.format(subject))
-            self.stdout.write('From: {}\n'.format(sender))
-        if self.verbosity >= 3:
-            # write whole message out
-            self.stdout.write(message + '\n')
+                futures = [self.executor.submit(self.mail_command, *data)
+                           for data in datatuple]
+                errors = [future.exception() for future in futures]
+
+        for (subject, message, sender, recipient), error in zip(datatuple,
+                                                               errors):
+            if self.verbosity >= 2:
+                # write only a header
+                self.stdout.write('-' * 40 + '\n')
+                self.stdout.write('To: {}\n'.format(recipient))
+                self.stdout.write('Subject: {}\n'.format(subject))
+                self.stdout.write('From: {}\n'.format(sender))
+            if self.verbosity >= 3:
+                # write whole message out
+                self.stdout.write(message + '\n')
+            if error is not None:
+                self.stderr.write('Failed to send to {}: {}\n'
+                                  .format(recipient, error))
+
+        return errors
+
+    def load_checkpoint(self, path):
+        """Set of IDs of persons already sent to."""
+        if not path or not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(json.load(f))
+
+    def save_checkpoint(self, path, sent):
+        # write to a temporary file first, so that an interruption doesn't
+        # leave the checkpoint corrupted
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted(sent), f)
+        os.replace(tmp_path, path)
 
     def handle(self, *args, **options):
         # default is dummy run - only actually send mail if told to
@@ -128,16 +222,67 @@ class Command(BaseCommand):
         self.verbosity = int(options['verbosity'])
 
         sender = options['sender']
+        batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
 
-        results = self.fetch_activity(not no_may_contact_only)
+        # checkpoints are kept only when sending for real
+        checkpoint = options['checkpoint'] if send_for_real else None
+        sent = self.load_checkpoint(checkpoint)
 
-        for result in results:
-            message = self.make_message(result)
-            subject = self.subject(result)
-            recipient = self.recipient(result)
-            self.send_message(subject, message, sender, recipient,
-                              for_real=send_for_real,
-                              django_mailing=django_mailing)
+        results = [
+            record for record in self.fetch_activity(not no_may_contact_only)
+            if record['person'].pk not in sent
+        ]
+        if sent and self.verbosity >= 1:
+            self.stdout.write('Skipping {} instructors already sent to.\n'
+                              .format(len(sent)))
+
+        self.connection = get_connection()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        sent_count = 0
+        failed_count = 0
+        try:
+            if send_for_real and django_mailing:
+                self.connection.open()
+
+            for start in range(0, len(results), batch_size):
+                batch = results[start:start + batch_size]
+                datatuple = [
+                    (self.subject(record), self.make_message(record), sender,
+                     self.recipient(record))
+                    for record in batch
+                ]
+                errors = self.send_messages(datatuple,
+                                            for_real=send_for_real,
+                                            django_mailing=django_mailing)
+
+                for record, error in zip(batch, errors):
+                    if error is None:
+                        sent.add(record['person'].pk)
+                        sent_count += 1
+                    else:
+                        failed_count += 1
+                if checkpoint:
+                    self.save_checkpoint(checkpoint, sent)
+
+                if self.verbosity >= 1:
+                    self.stdout.write(
+                        'Progress: {} of {} emails processed.\n'.format(
+                            start + len(batch), len(results))
+                    )
+        finally:
+            self.executor.shutdown()
+            self.connection.close()
 
         if self.verbosity >= 1:
-            self.stdout.write('Sent {} emails.\n'.format(len(results)))
+            self.stdout.write('Sent {} emails.\n'.format(sent_count))
+
+        if failed_count:
+            msg = 'Failed to send {} emails.'.format(failed_count)
+            if checkpoint:
+                msg += ('  Run again with the same --checkpoint to retry '
+                        'them.')
+            raise CommandError(msg)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from workshops.duplicates import rebuild_keys
+from workshops.models import DuplicateKey
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds keys used for finding possible duplicates from scratch.'
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        rebuild_keys()
+        print('Duplicate keys rebuilt: {} entries'.format(
+            DuplicateKey.objects.count()))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from workshops.object_history import (
+    rebuild_object_history,
+    stale_object_history,
+)
+
+
+class Command(BaseCommand):
+    help = ('Recreates summaries of objects\' history (when and by whom '
+            'they were created and last modified) from all versions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true', default=False,
+            help='Only report objects with wrong or missing history '
+                 'summary; fail if there are any',
+        )
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        if options['check']:
+            stale, orphaned = stale_object_history()
+            for content_type_id, object_id in stale:
+                print('Object {}#{}: wrong or missing history'.format(
+                    content_type_id, object_id))
+            for pk in orphaned:
+                print('History {}: object has no versions'.format(pk))
+            if stale or orphaned:
+                raise CommandError(
+                    'Wrong history of {} objects'.format(
+                        len(stale) + len(orphaned)))
+            print('History summaries are correct')
+            return
+
+        print('History summaries rebuilt: {} objects updated'.format(
+            rebuild_object_history()))
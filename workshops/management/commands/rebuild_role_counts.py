@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from workshops.role_counts import (
+    ROLE_COUNT_FIELDS,
+    rebuild_role_counts,
+    stale_role_counts,
+)
+
+
+def format_counts(counts):
+    return ', '.join('{}={}'.format(field, count)
+                     for field, count in zip(ROLE_COUNT_FIELDS, counts))
+
+
+class Command(BaseCommand):
+    help = ('Recalculates numbers of tasks persons had in specific roles '
+            '(e.g. how many times they taught) from scratch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true', default=False,
+            help='Only report persons with wrong role counts; fail if there '
+                 'are any',
+        )
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        if options['check']:
+            stale = stale_role_counts()
+            for pk, stored, calculated in stale:
+                print('Person {}: stored {}; calculated {}'.format(
+                    pk, format_counts(stored), format_counts(calculated)))
+            if stale:
+                raise CommandError(
+                    'Wrong role counts of {} persons'.format(len(stale)))
+            print('Role counts are correct')
+            return
+
+        print('Role counts rebuilt: {} persons updated'.format(
+            rebuild_role_counts()))
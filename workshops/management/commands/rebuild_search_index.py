@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from workshops.models import SearchTrigram
+from workshops.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds search index from scratch.'
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        rebuild_index()
+        print('Search index rebuilt: {} entries'.format(
+            SearchTrigram.objects.count()))
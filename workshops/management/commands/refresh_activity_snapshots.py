@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from workshops.models import ActivitySnapshot, Event
+from workshops.reports import refresh_activity_snapshots
+
+
+class Command(BaseCommand):
+    help = ('Recalculates monthly activity snapshots used by "All activity '
+            'over time" report, e.g. after changes made without signals '
+            '(bulk updates, renamed tags or roles).')
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        dates = Event.objects.aggregate(first=Min('start'), last=Max('start'))
+        if dates['first'] is None:
+            ActivitySnapshot.objects.all().delete()
+            print('No events with start date -- snapshots removed')
+            return
+
+        # snapshots outside of the range would be left without any events
+        ActivitySnapshot.objects.exclude(
+            month__gte=dates['first'].replace(day=1),
+            month__lte=dates['last'],
+        ).delete()
+        snapshots = refresh_activity_snapshots(dates['first'], dates['last'])
+        print('Refreshed {} monthly snapshots'.format(len(snapshots)))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from workshops.scoring import stale_scores, update_scores
+
+
+class Command(BaseCommand):
+    help = ('Recalculates automatic scores of all training requests, e.g. '
+            'after the scoring rubric changed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true', default=False,
+            help='Only report requests with wrong automatic score; fail if '
+                 'there are any',
+        )
+
+    def handle(self, *args, **options):
+        '''Main entry point.'''
+
+        if options['check']:
+            stale = stale_scores()
+            for pk, stored, calculated in stale:
+                print('Training request {}: stored {}; calculated {}'.format(
+                    pk, stored, calculated))
+            if stale:
+                raise CommandError(
+                    'Wrong automatic scores of {} training requests'.format(
+                        len(stale)))
+            print('Automatic scores are correct')
+            return
+
+        print('Automatic scores recalculated: {} training requests updated'
+              .format(update_scores()))
@@ -0,0 +1,35 @@
+# Generated by Django 2.1 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0156_auto_20180927_1516'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivitySnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month this snapshot covers.', unique=True)),
+                ('workshops_swc', models.PositiveIntegerField(default=0)),
+                ('workshops_dc', models.PositiveIntegerField(default=0)),
+                ('workshops_swc_or_dc', models.PositiveIntegerField(default=0)),
+                ('workshops_wise', models.PositiveIntegerField(default=0)),
+                ('workshops_ttt', models.PositiveIntegerField(default=0)),
+                ('workshops_self_organized', models.PositiveIntegerField(default=0)),
+                ('learners_swc', models.PositiveIntegerField(blank=True, null=True)),
+                ('learners_dc', models.PositiveIntegerField(blank=True, null=True)),
+                ('instructors_swc', models.TextField(blank=True, default='[]', help_text="JSON-serialized list of instructors' IDs (one entry per instructor task) in SWC workshops")),
+                ('instructors_dc', models.TextField(blank=True, default='[]', help_text="JSON-serialized list of instructors' IDs (one entry per instructor task) in DC workshops")),
+                ('missing_attendance', models.TextField(blank=True, default='[]', help_text='JSON-serialized list of slugs of events without attendance')),
+                ('missing_instructors', models.TextField(blank=True, default='[]', help_text='JSON-serialized list of slugs of events without instructors')),
+            ],
+            options={
+                'ordering': ('month',),
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 2.1 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+# fields indexed when the index was introduced; the index can be rebuilt with
+# current fields by `rebuild_search_index` command
+SEARCHABLE_FIELDS = {
+    'organization': ('domain', 'fullname', 'notes'),
+    'event': ('slug', 'host__domain', 'host__fullname', 'url', 'contact',
+              'venue', 'address', 'notes'),
+    'person': ('personal', 'family', 'email', 'username', 'github'),
+    'airport': ('iata', 'fullname'),
+    'trainingrequest': ('personal', 'family', 'email', 'github',
+                        'group_name', 'affiliation', 'location', 'comment'),
+}
+
+
+def trigrams(text):
+    """Set of trigrams of all words in `text`."""
+    result = set()
+    for word in str(text or '').lower().split():
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def build_search_index(apps, schema_editor):
+    """Index all searchable objects."""
+    SearchTrigram = apps.get_model('workshops', 'SearchTrigram')
+
+    for name, fields in SEARCHABLE_FIELDS.items():
+        model = apps.get_model('workshops', name)
+        objects = model.objects.order_by().values_list('pk', *fields)
+        batch = []
+        for pk, *values in objects.iterator():
+            batch += [
+                SearchTrigram(model=name, object_id=pk, trigram=trigram)
+                for trigram in set().union(*map(trigrams, values))
+            ]
+            if len(batch) >= 1000:
+                SearchTrigram.objects.bulk_create(batch)
+                batch = []
+        SearchTrigram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0157_activitysnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Name of the model of the indexed object.', max_length=40)),
+                ('object_id', models.PositiveIntegerField()),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchtrigram',
+            unique_together={('model', 'object_id', 'trigram')},
+        ),
+        migrations.AlterIndexTogether(
+            name='searchtrigram',
+            index_together={('model', 'trigram')},
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 2.1 on 2026-10-17 07:25
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# kinds of keys stored for every model when the keys were introduced; keys
+# can be rebuilt with current code by `rebuild_duplicate_keys` command
+DUPLICATE_KEY_KINDS = {
+    'person': ('name', 'switched', 'phonetic'),
+    'trainingrequest': ('name', 'email'),
+}
+
+KEY_LENGTH = 255
+
+SOUNDEX_CODES = dict(
+    [(letter, '1') for letter in 'bfpv'] +
+    [(letter, '2') for letter in 'cgjkqsxz'] +
+    [(letter, '3') for letter in 'dt'] +
+    [('l', '4')] +
+    [(letter, '5') for letter in 'mn'] +
+    [('r', '6')]
+)
+
+
+def normalize(text):
+    """Lower-case `text` without accents and with single spaces."""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def soundex(text):
+    """Soundex code of `text`, or an empty string if it doesn't contain any
+    letters."""
+    letters = re.sub(r'[^a-z]', '', normalize(text))
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != previous:
+            code += digit
+        # "h" and "w" don't separate letters with the same code
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def object_keys(model_name, personal, family, email):
+    """Set of (kind, key) tuples for an object of `model_name`."""
+    personal, family = normalize(personal), normalize(family)
+    keys = {
+        'email': normalize(email),
+        'phonetic': '{} {}'.format(soundex(personal), soundex(family)),
+    }
+    if personal or family:
+        keys['name'] = '{}|{}'.format(personal, family)
+        keys['switched'] = '{}|{}'.format(family, personal)
+
+    return {
+        (kind, keys[kind][:KEY_LENGTH])
+        for kind in DUPLICATE_KEY_KINDS[model_name]
+        if keys.get(kind, '').strip()
+    }
+
+
+def build_duplicate_keys(apps, schema_editor):
+    """Store keys of all persons and training requests."""
+    DuplicateKey = apps.get_model('workshops', 'DuplicateKey')
+
+    for name in DUPLICATE_KEY_KINDS:
+        model = apps.get_model('workshops', name)
+        objects = model.objects.order_by() \
+                               .values_list('pk', 'personal', 'family',
+                                            'email')
+        DuplicateKey.objects.bulk_create(
+            DuplicateKey(model=name, object_id=pk, kind=kind, key=key)
+            for pk, *values in objects.iterator()
+            for kind, key in object_keys(name, *values)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0158_searchtrigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='Name of the model of the object.', max_length=40)),
+                ('object_id', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('name', 'Normalized name'), ('switched', 'Normalized name with switched personal and family'), ('phonetic', 'Phonetic code of name'), ('email', 'Normalized email')], max_length=10)),
+                ('key', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='duplicatekey',
+            unique_together={('model', 'object_id', 'kind', 'key')},
+        ),
+        migrations.AlterIndexTogether(
+            name='duplicatekey',
+            index_together={('model', 'kind', 'key')},
+        ),
+        migrations.RunPython(build_duplicate_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 2.1 on 2026-10-17 07:36
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, When
+
+
+# Person fields and roles counted in them
+ROLE_COUNT_FIELDS = {
+    'num_taught': 'instructor',
+    'num_helper': 'helper',
+    'num_organizer': 'organizer',
+    'num_learner': 'learner',
+}
+
+
+def calculate_role_counts(apps, schema_editor):
+    """Count tasks of every person in each role; persons with the same counts
+    are updated together."""
+    Person = apps.get_model('workshops', 'Person')
+    Task = apps.get_model('workshops', 'Task')
+
+    tasks = Task.objects.order_by().values('person').annotate(**{
+        field: Count(Case(When(role__name=role, then=1),
+                          output_field=IntegerField()))
+        for field, role in ROLE_COUNT_FIELDS.items()
+    })
+    by_counts = defaultdict(list)
+    for values in tasks:
+        counts = tuple(values[field] for field in ROLE_COUNT_FIELDS)
+        by_counts[counts].append(values['person'])
+
+    for counts, pks in by_counts.items():
+        Person.objects.filter(pk__in=pks) \
+                      .update(**dict(zip(ROLE_COUNT_FIELDS, counts)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0159_duplicatekey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='num_helper',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Number of times helped'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='num_learner',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Number of times attended'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='num_organizer',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Number of times organized'),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='num_taught',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Number of times taught'),
+        ),
+        migrations.RunPython(calculate_role_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 2.1 on 2026-10-17 07:55
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# fields telling if any of requirements (names of `TrainingRequirement`) was
+# passed
+PASSED_FIELDS = {
+    'passed_training': ('Training', ),
+    'passed_swc_homework': ('SWC Homework', ),
+    'passed_dc_homework': ('DC Homework', ),
+    'passed_discussion': ('Discussion', ),
+    'passed_swc_demo': ('SWC Demo', ),
+    'passed_dc_demo': ('DC Demo', ),
+    'passed_homework': ('SWC Homework', 'DC Homework'),
+    'passed_demo': ('SWC Demo', 'DC Demo'),
+}
+
+# requirements necessary to become an instructor
+ELIGIBILITY_REQUIREMENTS = (
+    'passed_training', 'passed_homework', 'passed_discussion', 'passed_demo',
+)
+
+# fields telling if a badge was awarded
+BADGE_FIELDS = {
+    'is_swc_instructor': 'swc-instructor',
+    'is_dc_instructor': 'dc-instructor',
+}
+
+ELIGIBILITY_FIELDS = (tuple(PASSED_FIELDS) + ('instructor_eligible', ) +
+                      tuple(BADGE_FIELDS))
+
+
+def calculate_eligibility(apps, schema_editor):
+    """Create eligibility records of persons with passed requirements or
+    instructor badges."""
+    InstructorEligibility = apps.get_model('workshops',
+                                           'InstructorEligibility')
+    TrainingProgress = apps.get_model('workshops', 'TrainingProgress')
+    Award = apps.get_model('workshops', 'Award')
+
+    result = defaultdict(lambda: dict.fromkeys(ELIGIBILITY_FIELDS, False))
+
+    passed = TrainingProgress.objects.filter(state='p', discarded=False) \
+                                     .order_by() \
+                                     .values_list('trainee',
+                                                  'requirement__name')
+    for pk, requirement in passed.distinct():
+        for field, requirements in PASSED_FIELDS.items():
+            if requirement in requirements:
+                result[pk][field] = True
+
+    awarded = Award.objects.filter(badge__name__in=BADGE_FIELDS.values()) \
+                           .order_by().values_list('person', 'badge__name')
+    for pk, badge in awarded:
+        for field, name in BADGE_FIELDS.items():
+            if badge == name:
+                result[pk][field] = True
+
+    for values in result.values():
+        values['instructor_eligible'] = all(
+            values[field] for field in ELIGIBILITY_REQUIREMENTS
+        )
+
+    InstructorEligibility.objects.bulk_create(
+        InstructorEligibility(person_id=pk, **values)
+        for pk, values in result.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0160_person_role_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstructorEligibility',
+            fields=[
+                ('person', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('passed_training', models.BooleanField(default=False)),
+                ('passed_swc_homework', models.BooleanField(default=False)),
+                ('passed_dc_homework', models.BooleanField(default=False)),
+                ('passed_discussion', models.BooleanField(default=False)),
+                ('passed_swc_demo', models.BooleanField(default=False)),
+                ('passed_dc_demo', models.BooleanField(default=False)),
+                ('passed_homework', models.BooleanField(default=False, help_text='SWC or DC Homework was passed.')),
+                ('passed_demo', models.BooleanField(default=False, help_text='SWC or DC Demo was passed.')),
+                ('instructor_eligible', models.BooleanField(db_index=True, default=False, help_text='All requirements necessary to become an instructor were passed.')),
+                ('is_swc_instructor', models.BooleanField(db_index=True, default=False)),
+                ('is_dc_instructor', models.BooleanField(db_index=True, default=False)),
+            ],
+        ),
+        migrations.RunPython(calculate_eligibility,
+                             migrations.RunPython.noop),
+    ]
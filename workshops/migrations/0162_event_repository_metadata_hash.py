@@ -0,0 +1,46 @@
+# Generated by Django 2.1 on 2026-10-17 08:43
+
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+def metadata_hash(metadata):
+    """Stable SHA-256 hash of metadata (the same as calculated by
+    `workshops.util.metadata_hash` when this migration was created)."""
+    data = json.dumps(metadata, cls=DjangoJSONEncoder, sort_keys=True,
+                      separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def hash_metadata(apps, schema_editor):
+    """Store hashes of events' website metadata."""
+    Event = apps.get_model('workshops', 'Event')
+    events = Event.objects.exclude(repository_metadata='') \
+                          .only('repository_metadata')
+    for event in events.iterator():
+        try:
+            metadata = json.loads(event.repository_metadata)
+        except ValueError:
+            continue
+        Event.objects.filter(pk=event.pk).update(
+            repository_metadata_hash=metadata_hash(metadata),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0161_instructoreligibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='repository_metadata_hash',
+            field=models.CharField(blank=True, default='', help_text="SHA-256 hash of metadata from event's website", max_length=64),
+        ),
+        migrations.RunPython(hash_metadata, migrations.RunPython.noop),
+    ]
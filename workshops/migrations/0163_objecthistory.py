@@ -0,0 +1,70 @@
+# Generated by Django 2.1 on 2026-10-17 09:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def summarize_object_history(apps, schema_editor):
+    """Store dates and authors of the first and the latest version of every
+    object under version control."""
+    ObjectHistory = apps.get_model('workshops', 'ObjectHistory')
+    Version = apps.get_model('reversion', 'Version')
+
+    versions = Version.objects.order_by('pk').values_list(
+        'content_type', 'object_id', 'pk', 'revision__date_created',
+        'revision__user',
+    )
+    first = dict()
+    last = dict()
+    for content_type_id, object_id, *values in versions.iterator():
+        key = (content_type_id, object_id)
+        first.setdefault(key, values)
+        last[key] = values
+
+    histories = []
+    for key, (version, date, user) in first.items():
+        history = ObjectHistory(
+            content_type_id=key[0], object_id=key[1],
+            created_version_id=version, created_at=date, created_by_id=user,
+        )
+        if last[key] != first[key]:
+            (history.last_modified_version_id, history.last_modified_at,
+             history.last_modified_by_id) = last[key]
+        histories.append(history)
+    ObjectHistory.objects.bulk_create(histories, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        ('workshops', '0162_event_repository_metadata_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=191)),
+                ('created_at', models.DateTimeField()),
+                ('last_modified_at', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('created_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='reversion.Version')),
+                ('last_modified_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('last_modified_version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='reversion.Version')),
+            ],
+            options={
+                'verbose_name_plural': 'object histories',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='objecthistory',
+            unique_together={('content_type', 'object_id')},
+        ),
+        migrations.RunPython(summarize_object_history,
+                             migrations.RunPython.noop),
+    ]
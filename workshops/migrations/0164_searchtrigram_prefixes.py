@@ -0,0 +1,59 @@
+from django.db import migrations
+
+
+# fields indexed when prefixes were added to the index; the index can be
+# rebuilt with current fields by `rebuild_search_index` command
+SEARCHABLE_FIELDS = {
+    'organization': ('domain', 'fullname', 'notes'),
+    'event': ('slug', 'host__domain', 'host__fullname', 'url', 'contact',
+              'venue', 'address', 'notes'),
+    'person': ('personal', 'family', 'email', 'username', 'github'),
+    'airport': ('iata', 'fullname'),
+    'trainingrequest': ('personal', 'family', 'email', 'github',
+                        'group_name', 'affiliation', 'location', 'comment'),
+}
+
+
+def prefixes(text):
+    """Set of one- and two-character prefixes of all words in `text`."""
+    result = set()
+    for word in str(text or '').lower().split():
+        result.update((word[:1], word[:2]))
+    return result
+
+
+def remove_prefixes(apps, schema_editor):
+    SearchTrigram = apps.get_model('workshops', 'SearchTrigram')
+    SearchTrigram.objects.filter(trigram__regex=r'^.{1,2}$').delete()
+
+
+def add_prefixes(apps, schema_editor):
+    """Index prefixes of words of all searchable objects (replacing ones
+    added if the index was rebuilt already)."""
+    SearchTrigram = apps.get_model('workshops', 'SearchTrigram')
+    remove_prefixes(apps, schema_editor)
+
+    for name, fields in SEARCHABLE_FIELDS.items():
+        model = apps.get_model('workshops', name)
+        objects = model.objects.order_by().values_list('pk', *fields)
+        batch = []
+        for pk, *values in objects.iterator():
+            batch += [
+                SearchTrigram(model=name, object_id=pk, trigram=prefix)
+                for prefix in set().union(*map(prefixes, values))
+            ]
+            if len(batch) >= 1000:
+                SearchTrigram.objects.bulk_create(batch)
+                batch = []
+        SearchTrigram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workshops', '0163_objecthistory'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_prefixes, remove_prefixes),
+    ]
@@ -13,10 +13,11 @@ from django.db import models
 from django.db.models import (
     ExpressionWrapper,
     Q, F,
-    IntegerField,
     PositiveIntegerField,
-    Sum, Case, When, Value,
+    Case, When, Value,
+    Func, IntegerField, OuterRef, Subquery,
 )
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.urls import reverse
@@ -25,7 +26,12 @@ from reversion import revisions as reversion
 from social_django.models import UserSocialAuth
 
 from workshops import github_auth
+from workshops.eligibility import (
+    ELIGIBILITY_FIELDS,
+    ELIGIBILITY_REQUIREMENTS,
+)
 from workshops.fields import NullableGithubUsernameField
+from workshops.role_counts import ROLE_COUNT_FIELDS
 
 STR_SHORT   =  10         # length of short strings
 STR_MED     =  40         # length of medium strings
@@ -156,6 +162,41 @@ class Organization(models.Model):
         ordering = ('domain', )
 
 
+def count_subquery(queryset):
+    """Number of objects in `queryset` (usually filtered with `OuterRef`) as
+    an expression for annotations."""
+    counted = queryset.order_by().annotate(
+        count=Func(F('pk'), function='COUNT'),
+    ).values('count')
+    return Subquery(counted, output_field=IntegerField())
+
+
+class MembershipQuerySet(models.query.QuerySet):
+    def annotate_with_usage(self):
+        """Annotate memberships with the numbers of workshops and instructor
+        training seats used during the agreement.  Annotations have the same
+        names as `Membership` properties they replace, so listing
+        memberships doesn't require additional queries for every one of
+        them."""
+        events = Event.objects.filter(
+            host=OuterRef('organization'),
+            start__gte=OuterRef('agreement_start'),
+            start__lt=OuterRef('agreement_end'),
+        )
+        learner_tasks = Task.objects.filter(seat_membership=OuterRef('pk'),
+                                            role__name='learner')
+        return self.annotate(
+            workshops_without_admin_fee_completed=count_subquery(
+                events.filter(Membership.NO_FEE)
+                      .exclude(Membership.SELF_ORGANIZED)
+            ),
+            self_organized_workshops_completed=count_subquery(
+                events.filter(Membership.SELF_ORGANIZED)
+            ),
+            seats_instructor_training_utilized=count_subquery(learner_tasks),
+        )
+
+
 @reversion.register
 class Membership(models.Model):
     """Represent a details of Organization's membership."""
@@ -224,18 +265,26 @@ class Membership(models.Model):
     def get_absolute_url(self):
         return reverse('membership_details', args=[self.id])
 
+    # events counted in workshops' usage
+    SELF_ORGANIZED = (Q(administrator=None) |
+                      Q(administrator__domain='self-organized'))
+    NO_FEE = Q(admin_fee=0) | Q(admin_fee=None)
+
+    objects = MembershipQuerySet.as_manager()
+
+    def _agreement_events(self):
+        return Event.objects.filter(host_id=self.organization_id,
+                                    start__gte=self.agreement_start,
+                                    start__lt=self.agreement_end)
+
+    # values of following properties are provided by
+    # `Membership.objects.annotate_with_usage()`, if it was used
+
     @cached_property
     def workshops_without_admin_fee_completed(self):
         """Count workshops without admin fee hosted the during agreement."""
-        self_organized = (Q(administrator=None) |
-                          Q(administrator__domain='self-organized'))
-        no_fee = Q(admin_fee=0) | Q(admin_fee=None)
-        date_started = Q(start__gte=self.agreement_start, start__lt=self.agreement_end)
-
-        return Event.objects.filter(host=self.organization) \
-                            .filter(date_started) \
-                            .filter(no_fee) \
-                            .exclude(self_organized).count()
+        return self._agreement_events().filter(self.NO_FEE) \
+                                       .exclude(self.SELF_ORGANIZED).count()
 
     @cached_property
     def workshops_without_admin_fee_remaining(self):
@@ -249,13 +298,7 @@ class Membership(models.Model):
     @cached_property
     def self_organized_workshops_completed(self):
         """Count self-organized workshops hosted the year agreement started."""
-        self_organized = (Q(administrator=None) |
-                          Q(administrator__domain='self-organized'))
-        date_started = Q(start__gte=self.agreement_start, start__lt=self.agreement_end)
-
-        return Event.objects.filter(host=self.organization) \
-                            .filter(date_started) \
-                            .filter(self_organized).count()
+        return self._agreement_events().filter(self.SELF_ORGANIZED).count()
 
     @cached_property
     def self_organized_workshops_remaining(self):
@@ -390,50 +433,17 @@ class PersonManager(BaseUserManager):
             return super().get_by_natural_key(username)
 
     def annotate_with_instructor_eligibility(self):
-        def passed(requirement):
-            return Sum(Case(When(trainingprogress__requirement__name=requirement,
-                                 trainingprogress__state='p',
-                                 trainingprogress__discarded=False,
-                                 then=1),
-                            default=0,
-                            output_field=IntegerField()))
-
-        def passed_either(req_a, req_b):
-            return Sum(Case(When(trainingprogress__requirement__name=req_a,
-                                 trainingprogress__state='p',
-                                 trainingprogress__discarded=False,
-                                 then=1),
-                            When(trainingprogress__requirement__name=req_b,
-                                 trainingprogress__state='p',
-                                 trainingprogress__discarded=False,
-                                 then=1),
-                            default=0,
-                            output_field=IntegerField()))
-
-        return self.annotate(
-            passed_training=passed('Training'),
-            passed_swc_homework=passed('SWC Homework'),
-            passed_dc_homework=passed('DC Homework'),
-            passed_discussion=passed('Discussion'),
-            passed_swc_demo=passed('SWC Demo'),
-            passed_dc_demo=passed('DC Demo'),
-            passed_homework=passed_either('SWC Homework', 'DC Homework'),
-            passed_demo=passed_either('SWC Demo', 'DC Demo'),
-        ).annotate(
-            # We're using Maths to calculate "binary" score for a person to
-            # be instructor badge eligible. Legend:
-            # * means "AND"
-            # + means "OR"
-            instructor_eligible=(
-                F('passed_training') *
-                (F('passed_swc_homework') + F('passed_dc_homework')) *
-                F('passed_discussion') *
-                (F('passed_swc_demo') + F('passed_dc_demo'))
-            )
-        )
+        """Add fields of persons' `InstructorEligibility` records (e.g.
+        `passed_training` or `instructor_eligible`), false for persons
+        without a record."""
+        return self.annotate(**{
+            field: Coalesce(F('instructoreligibility__' + field), Value(False),
+                            output_field=models.BooleanField())
+            for field in ELIGIBILITY_FIELDS
+        })
 
 
-@reversion.register
+@reversion.register(exclude=list(ROLE_COUNT_FIELDS))
 class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
     '''Represent a single person.'''
     UNDISCLOSED = 'U'
@@ -538,6 +548,25 @@ class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
         blank=True, default='',
     )
 
+    # numbers of tasks in specific roles, maintained by `Task` signals (see
+    # `workshops.role_counts`)
+    num_taught = models.PositiveIntegerField(
+        default=0, editable=False, db_index=True,
+        verbose_name='Number of times taught',
+    )
+    num_helper = models.PositiveIntegerField(
+        default=0, editable=False, db_index=True,
+        verbose_name='Number of times helped',
+    )
+    num_organizer = models.PositiveIntegerField(
+        default=0, editable=False, db_index=True,
+        verbose_name='Number of times organized',
+    )
+    num_learner = models.PositiveIntegerField(
+        default=0, editable=False, db_index=True,
+        verbose_name='Number of times attended',
+    )
+
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = [
         'personal',
@@ -629,14 +658,9 @@ class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
         passed yet by the trainee and are mandatory to become SWC Instructor.
         """
 
-        fields = [
-            ('passed_training', 'Training'),
-            ('passed_homework', 'SWC or DC Homework'),
-            ('passed_discussion', 'Discussion'),
-            ('passed_demo', 'SWC or DC Demo'),
-        ]
         try:
-            return [name for field, name in fields if not getattr(self, field)]
+            return [name for field, name in ELIGIBILITY_REQUIREMENTS
+                    if not getattr(self, field)]
         except AttributeError as e:
             raise Exception('Did you forget to call '
                             'annotate_with_instructor_eligibility()?') from e
@@ -645,14 +669,9 @@ class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
         """Returns set of requirements' names (list of strings) that are not
         passed yet by the trainee and are mandatory to become DC Instructor."""
 
-        fields = [
-            ('passed_training', 'Training'),
-            ('passed_homework', 'SWC or DC Homework'),
-            ('passed_discussion', 'Discussion'),
-            ('passed_demo', 'SWC or DC Demo'),
-        ]
         try:
-            return [name for field, name in fields if not getattr(self, field)]
+            return [name for field, name in ELIGIBILITY_REQUIREMENTS
+                    if not getattr(self, field)]
         except AttributeError as e:
             raise Exception('Did you forget to call '
                             'annotate_with_instructor_eligibility()?') from e
@@ -679,6 +698,22 @@ class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
             if github_username_has_changed:
                 UserSocialAuth.objects.filter(user=self).delete()
 
+            # don't overwrite role counts changed after this instance was
+            # loaded
+            for field in ROLE_COUNT_FIELDS:
+                setattr(self, field, getattr(orig, field))
+        else:
+            # new person can't have any tasks yet (even if copied from
+            # another person)
+            for field in ROLE_COUNT_FIELDS:
+                setattr(self, field, 0)
+
+        self.normalize_fields()
+        super().save(*args, **kwargs)
+
+    def normalize_fields(self):
+        """Prepare fields for saving; called by `save()`, but needs to be
+        called explicitly when saving with `bulk_create()`."""
         # save empty string as NULL to the database - otherwise there are
         # issues with UNIQUE constraint failing
         self.personal = self.personal.strip()
@@ -690,7 +725,6 @@ class Person(AbstractBaseUser, PermissionsMixin, DataPrivacyAgreementMixin):
         self.airport = self.airport or None
         self.github = self.github or None
         self.twitter = self.twitter or None
-        super().save(*args, **kwargs)
 
 
 def is_admin(user):
@@ -1168,6 +1202,9 @@ class Event(AssignmentMixin, models.Model):
     repository_metadata = models.TextField(
         blank=True, default='',
         help_text='JSON-serialized metadata from event\'s website')
+    repository_metadata_hash = models.CharField(
+        max_length=64, blank=True, default='',
+        help_text='SHA-256 hash of metadata from event\'s website')
     metadata_all_changes = models.TextField(
         blank=True, default='', help_text='List of detected metadata changes')
     metadata_changed = models.BooleanField(
@@ -2439,76 +2476,20 @@ class TrainingRequest(CreatedUpdatedMixin,
                                             'be matched with a training.'})
 
     def recalculate_score_auto(self):
-        """Calculate automatic score according to the rubric:
-        https://github.com/carpentries/instructor-training/blob/gh-pages/files/rubric.md"""
-        score = 0
-
-        # location based points (country not on the list of countries)
-        # according to
-        # https://github.com/swcarpentry/amy/issues/1327#issuecomment-422539917
-        # and
-        # https://github.com/swcarpentry/amy/issues/1327#issuecomment-423292177
-        not_scoring_countries = [
-            'US', 'CA', 'NZ', 'GB', 'AU', 'AT', 'BE', 'CY', 'CZ',
-            'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'HU', 'IE', 'IT', 'LV', 'LT',
-            'LU', 'MT', 'NL', 'PL', 'PT', 'RO', 'SK', 'SI', 'ES', 'SE',
-            'CH', 'IS', 'NO',
-        ]
-        if self.country and self.country.code not in not_scoring_countries:
-            score += 1
-
-        if self.underresourced:
-            score += 1
-
-        # economics or social sciences, arts, humanities, or library science
-        scoring_domains = [
-            'Humanities', 'Library and information science',
-            'Economics/business', 'Social sciences',
-        ]
-        for domain in self.domains.all():
-            if domain.name in scoring_domains:
-                score += 1
-                break
-
-        # +1 for each previous involvement with The Carpentries (max. 3)
-        prev_inv_count = len(self.previous_involvement.all())
-        score += prev_inv_count if prev_inv_count <= 3 else 3
-
-        # previous training in teaching: "a certification or short course"
-        # or "a full degree"
-        if self.previous_training in ['course', 'full']:
-            score += 1
-
-        # previous experience in teaching: "TA for full course"
-        # or "primary instructor for full course"
-        if self.previous_experience in ['ta', 'courses']:
-            score += 1
-
-        # using tools "every day" or "a few times a week"
-        if self.programming_language_usage_frequency in ['daily', 'weekly']:
-            score += 1
+        """Calculate automatic score according to the rubric (see
+        `workshops.scoring`)."""
+        from workshops.scoring import field_points, relation_points
 
+        score = field_points(self)
+        if self.pk:
+            # points for M2M fields take one query
+            score += relation_points([self.pk]).get(self.pk, 0)
         return score
 
     def save(self, *args, **kwargs):
-        """Run recalculation upon save."""
-        inserted = False
-
-        # save first so that there's an ID present
-        if not self.pk:
-            super().save(*args, **kwargs)
-            inserted = True
-
-        score = self.recalculate_score_auto()
-
-        if self.pk and score != self.score_auto:
-            self.score_auto = score
-
-        # we cannot force insert for the second time - this time it should
-        # be an UPDATE query
-        if inserted and 'force_insert' in kwargs:
-            kwargs.pop('force_insert')
-
+        """Run recalculation upon save.  New requests don't have any M2M
+        relations yet, so they're saved only once."""
+        self.score_auto = self.recalculate_score_auto()
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -2612,3 +2593,176 @@ class TrainingProgress(CreatedUpdatedMixin, models.Model):
 
     class Meta:
         ordering = ['created_at']
+
+
+class InstructorEligibility(models.Model):
+    """Requirements passed by a trainee and instructor badges awarded to
+    them, precomputed from training progresses and awards; kept up-to-date by
+    signals (see `workshops.eligibility`)."""
+
+    person = models.OneToOneField(Person, on_delete=models.CASCADE,
+                                  primary_key=True)
+
+    passed_training = models.BooleanField(default=False)
+    passed_swc_homework = models.BooleanField(default=False)
+    passed_dc_homework = models.BooleanField(default=False)
+    passed_discussion = models.BooleanField(default=False)
+    passed_swc_demo = models.BooleanField(default=False)
+    passed_dc_demo = models.BooleanField(default=False)
+    passed_homework = models.BooleanField(
+        default=False, help_text='SWC or DC Homework was passed.')
+    passed_demo = models.BooleanField(
+        default=False, help_text='SWC or DC Demo was passed.')
+    instructor_eligible = models.BooleanField(
+        default=False, db_index=True,
+        help_text='All requirements necessary to become an instructor were '
+                  'passed.')
+
+    is_swc_instructor = models.BooleanField(default=False, db_index=True)
+    is_dc_instructor = models.BooleanField(default=False, db_index=True)
+
+    def __str__(self):
+        return 'Instructor eligibility of {}'.format(self.person)
+
+    def get_missing_requirements(self):
+        """Names of requirements not passed yet, but necessary to become an
+        instructor."""
+        return [name for field, name in ELIGIBILITY_REQUIREMENTS
+                if not getattr(self, field)]
+
+#------------------------------------------------------------
+
+
+class ActivitySnapshot(models.Model):
+    """Precomputed numbers for a single month of events, used by "All
+    activity over time" report.  Snapshots are kept up-to-date by signals
+    fired when events or tasks change (see `workshops.reports`)."""
+
+    month = models.DateField(
+        unique=True,
+        help_text='First day of the month this snapshot covers.',
+    )
+    workshops_swc = models.PositiveIntegerField(default=0)
+    workshops_dc = models.PositiveIntegerField(default=0)
+    workshops_swc_or_dc = models.PositiveIntegerField(default=0)
+    workshops_wise = models.PositiveIntegerField(default=0)
+    workshops_ttt = models.PositiveIntegerField(default=0)
+    workshops_self_organized = models.PositiveIntegerField(default=0)
+    learners_swc = models.PositiveIntegerField(null=True, blank=True)
+    learners_dc = models.PositiveIntegerField(null=True, blank=True)
+    instructors_swc = models.TextField(
+        blank=True, default='[]',
+        help_text='JSON-serialized list of instructors\' IDs (one entry per '
+                  'instructor task) in SWC workshops')
+    instructors_dc = models.TextField(
+        blank=True, default='[]',
+        help_text='JSON-serialized list of instructors\' IDs (one entry per '
+                  'instructor task) in DC workshops')
+    missing_attendance = models.TextField(
+        blank=True, default='[]',
+        help_text='JSON-serialized list of slugs of events without attendance')
+    missing_instructors = models.TextField(
+        blank=True, default='[]',
+        help_text='JSON-serialized list of slugs of events without '
+                  'instructors')
+
+    class Meta:
+        ordering = ('month', )
+
+    def __str__(self):
+        return 'Activity snapshot for {:%Y-%m}'.format(self.month)
+
+#------------------------------------------------------------
+
+
+class SearchTrigram(models.Model):
+    """Three-character fragment, or one- or two-character prefix, of a word
+    in text of a searchable object.  Used to narrow down search results
+    before matching them against searched term; kept up-to-date by signals
+    (see `workshops.search`)."""
+
+    model = models.CharField(
+        max_length=STR_MED,
+        help_text='Name of the model of the indexed object.',
+    )
+    object_id = models.PositiveIntegerField()
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = ('model', 'object_id', 'trigram')
+        index_together = ('model', 'trigram')
+
+    def __str__(self):
+        return '{}#{}: {}'.format(self.model, self.object_id, self.trigram)
+
+#------------------------------------------------------------
+
+
+class DuplicateKey(models.Model):
+    """Key built from name or email of a person or training request.  Objects
+    sharing a key are possible duplicates; kept up-to-date by signals (see
+    `workshops.duplicates`)."""
+
+    KIND_CHOICES = (
+        ('name', 'Normalized name'),
+        ('switched', 'Normalized name with switched personal and family'),
+        ('phonetic', 'Phonetic code of name'),
+        ('email', 'Normalized email'),
+    )
+
+    model = models.CharField(
+        max_length=STR_MED,
+        help_text='Name of the model of the object.',
+    )
+    object_id = models.PositiveIntegerField()
+    kind = models.CharField(max_length=STR_SHORT, choices=KIND_CHOICES)
+    key = models.CharField(max_length=STR_LONGEST)
+
+    class Meta:
+        unique_together = ('model', 'object_id', 'kind', 'key')
+        index_together = ('model', 'kind', 'key')
+
+    def __str__(self):
+        return '{}#{}: {} {}'.format(self.model, self.object_id, self.kind,
+                                     self.key)
+
+#------------------------------------------------------------
+
+
+class ObjectHistory(models.Model):
+    """When and by whom an object was created and last modified, taken from
+    the first and the latest of its versions (see `reversion`); kept
+    up-to-date by signals (see `workshops.object_history`)."""
+
+    # objects are referenced the same way as in `reversion.models.Version`
+    content_type = models.ForeignKey('contenttypes.ContentType',
+                                     on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=191)
+
+    created_version = models.ForeignKey(
+        'reversion.Version', on_delete=models.SET_NULL, null=True,
+        blank=True, related_name='+',
+    )
+    created_at = models.DateTimeField()
+    created_by = models.ForeignKey(
+        Person, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+',
+    )
+
+    # empty for objects with only one version
+    last_modified_version = models.ForeignKey(
+        'reversion.Version', on_delete=models.SET_NULL, null=True,
+        blank=True, related_name='+',
+    )
+    last_modified_at = models.DateTimeField(null=True, blank=True)
+    last_modified_by = models.ForeignKey(
+        Person, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+',
+    )
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+        verbose_name_plural = 'object histories'
+
+    def __str__(self):
+        return 'History of {}#{}'.format(self.content_type, self.object_id)
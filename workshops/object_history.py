@@ -0,0 +1,144 @@
+"""Summary of objects' history of changes.
+
+`ObjectHistory` of an object under version control holds dates and authors
+of its first and latest versions, so that pages can show them without
+loading whole history of the object (see `last_modified` template tag).
+A signal (see `workshops.signals`) updates summaries when a revision is
+saved; `rebuild_object_history()` recreates them from all versions."""
+
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+# stored fields, in order used by `calculate_object_history()`
+HISTORY_FIELDS = (
+    'created_version_id', 'created_at', 'created_by_id',
+    'last_modified_version_id', 'last_modified_at', 'last_modified_by_id',
+)
+
+
+def record_revision(revision, versions, get_model=django_apps.get_model):
+    """Update history of objects saved in `revision` (`versions` are
+    revision's versions)."""
+    ObjectHistory = get_model('workshops', 'ObjectHistory')
+    Version = get_model('reversion', 'Version')
+
+    by_content_type = defaultdict(dict)
+    for version in versions:
+        by_content_type[version.content_type_id][version.object_id] = version
+
+    with transaction.atomic():
+        for content_type_id, objects in by_content_type.items():
+            histories = ObjectHistory.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=list(objects),
+            )
+            existing = set(histories.values_list('object_id', flat=True))
+            if existing:
+                histories.update(
+                    last_modified_version=Subquery(
+                        Version.objects.filter(
+                            revision=revision,
+                            content_type=OuterRef('content_type'),
+                            object_id=OuterRef('object_id'),
+                        ).values('pk')[:1]
+                    ),
+                    last_modified_at=revision.date_created,
+                    last_modified_by=revision.user_id,
+                )
+
+            ObjectHistory.objects.bulk_create([
+                ObjectHistory(
+                    content_type_id=content_type_id,
+                    object_id=object_id,
+                    created_version=version,
+                    created_at=revision.date_created,
+                    created_by_id=revision.user_id,
+                )
+                for object_id, version in objects.items()
+                if object_id not in existing
+            ])
+
+
+def calculate_object_history(get_model=django_apps.get_model):
+    """Dictionary of history (tuples ordered like `HISTORY_FIELDS`) by
+    (content type ID, object ID), calculated from all versions.  Versions'
+    serialized data isn't loaded."""
+    Version = get_model('reversion', 'Version')
+
+    versions = Version.objects.order_by('pk').values_list(
+        'content_type', 'object_id', 'pk', 'revision__date_created',
+        'revision__user',
+    )
+    first = dict()
+    last = dict()
+    for content_type_id, object_id, *values in versions.iterator():
+        key = (content_type_id, object_id)
+        first.setdefault(key, tuple(values))
+        last[key] = tuple(values)
+
+    return {
+        key: created + (last[key] if last[key] != created
+                        else (None, None, None))
+        for key, created in first.items()
+    }
+
+
+def _compare_object_history(get_model):
+    """Calculated history, keys of objects with wrong or missing history,
+    IDs of wrong histories and IDs of histories of objects without
+    versions."""
+    ObjectHistory = get_model('workshops', 'ObjectHistory')
+
+    calculated = calculate_object_history(get_model)
+    missing = set(calculated)
+    wrong = []
+    wrong_pks = []
+    orphaned_pks = []
+    for pk, content_type_id, object_id, *stored in \
+            ObjectHistory.objects.values_list(
+                'pk', 'content_type', 'object_id', *HISTORY_FIELDS,
+            ).iterator():
+        key = (content_type_id, object_id)
+        missing.discard(key)
+        if key not in calculated:
+            orphaned_pks.append(pk)
+        elif calculated[key] != tuple(stored):
+            wrong.append(key)
+            wrong_pks.append(pk)
+    return calculated, wrong + sorted(missing), wrong_pks, orphaned_pks
+
+
+def stale_object_history(get_model=django_apps.get_model):
+    """Tuple of: list of (content type ID, object ID) of objects with wrong
+    or missing history, and list of IDs of histories of objects without any
+    versions."""
+    _, stale, _, orphaned_pks = _compare_object_history(get_model)
+    return stale, orphaned_pks
+
+
+def rebuild_object_history(get_model=django_apps.get_model,
+                           batch_size=500):
+    """Recreate wrong or missing histories of all objects and remove
+    histories of objects without versions; return number of changed
+    histories."""
+    ObjectHistory = get_model('workshops', 'ObjectHistory')
+
+    with transaction.atomic():
+        calculated, stale, wrong_pks, orphaned_pks = \
+            _compare_object_history(get_model)
+
+        to_delete = wrong_pks + orphaned_pks
+        for start in range(0, len(to_delete), batch_size):
+            ObjectHistory.objects.filter(
+                pk__in=to_delete[start:start + batch_size],
+            ).delete()
+        ObjectHistory.objects.bulk_create([
+            ObjectHistory(content_type_id=key[0], object_id=key[1],
+                          **dict(zip(HISTORY_FIELDS, calculated[key])))
+            for key in stale
+        ], batch_size=batch_size)
+
+    return len(stale) + len(orphaned_pks)
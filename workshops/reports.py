@@ -0,0 +1,325 @@
+"""Data for reports.
+
+"All activity over time" report is backed by `ActivitySnapshot` table: every
+row holds numbers for events that started in a single month.  Snapshots are
+refreshed by signals (see `workshops.signals`) whenever an event, its tags or
+its tasks change (once per transaction, when it's committed), so answering
+a query for any date range is a matter of reading a few rows and adding them
+up.  Only the partial months at both ends of the range need to be computed on
+the fly.
+
+Changes which don't send signals aren't noticed: `QuerySet.update()` or raw
+SQL on events, tags or tasks, and renaming tags, roles or the self-organized
+organization (snapshots match them by name or domain).  After such changes
+snapshots should be recalculated with `refresh_activity_snapshots` command.
+
+Cumulative "over time" reports are calculated by the database, see
+`cumulative_over_time`."""
+
+from collections import defaultdict
+import datetime
+import json
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from workshops.models import ActivitySnapshot, Event, Task
+
+
+ACTIVITY_TAGS = ('SWC', 'DC', 'WiSE', 'TTT')
+
+# fields of `ActivitySnapshot` stored as JSON-serialized lists
+ACTIVITY_LIST_FIELDS = (
+    'instructors_swc',
+    'instructors_dc',
+    'missing_attendance',
+    'missing_instructors',
+)
+
+
+def month_start(date):
+    """Return first day of the month `date` is in."""
+    return date.replace(day=1)
+
+
+def next_month(date):
+    """Return first day of the month following the month `date` is in."""
+    return (month_start(date) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def empty_activity():
+    """Activity data for a period without any events."""
+    return {
+        'workshops_swc': 0,
+        'workshops_dc': 0,
+        'workshops_swc_or_dc': 0,
+        'workshops_wise': 0,
+        'workshops_ttt': 0,
+        'workshops_self_organized': 0,
+        'learners_swc': None,
+        'learners_dc': None,
+        'instructors_swc': [],
+        'instructors_dc': [],
+        'missing_attendance': [],
+        'missing_instructors': [],
+    }
+
+
+def _add_nullable(a, b):
+    """Sum two numbers, but treat `None` as "no data" (not as zero)."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def merge_activity(a, b):
+    """Add up activity data from two separate periods."""
+    result = {}
+    for key, value in a.items():
+        if key.startswith('learners_'):
+            result[key] = _add_nullable(value, b[key])
+        else:
+            result[key] = value + b[key]
+    return result
+
+
+def compute_activity(events):
+    """Calculate activity data for `events`, grouped by month the events
+    started in.  This takes three queries regardless of number of events."""
+    events = events.exclude(start=None)
+
+    tags = defaultdict(set)
+    tag_rows = (
+        Event.tags.through.objects
+        .filter(event__in=events, tag__name__in=ACTIVITY_TAGS)
+        .values_list('event_id', 'tag__name')
+    )
+    for event_id, tag_name in tag_rows:
+        tags[event_id].add(tag_name)
+
+    instructors = defaultdict(list)
+    task_rows = (
+        Task.objects
+        .filter(event__in=events, role__name='instructor')
+        .values_list('event_id', 'person_id')
+    )
+    for event_id, person_id in task_rows:
+        instructors[event_id].append(person_id)
+
+    months = defaultdict(empty_activity)
+    event_rows = events.order_by('start', 'slug').values_list(
+        'id', 'slug', 'start', 'attendance', 'administrator__domain',
+    )
+    for id_, slug, start, attendance, administrator in event_rows:
+        activity = months[month_start(start)]
+        event_tags = tags[id_]
+
+        if 'SWC' in event_tags:
+            activity['workshops_swc'] += 1
+            activity['learners_swc'] = _add_nullable(
+                activity['learners_swc'], attendance)
+            activity['instructors_swc'] += instructors[id_]
+        if 'DC' in event_tags:
+            activity['workshops_dc'] += 1
+            activity['learners_dc'] = _add_nullable(
+                activity['learners_dc'], attendance)
+            activity['instructors_dc'] += instructors[id_]
+        if 'SWC' in event_tags or 'DC' in event_tags:
+            activity['workshops_swc_or_dc'] += 1
+        if 'WiSE' in event_tags:
+            activity['workshops_wise'] += 1
+        if 'TTT' in event_tags:
+            activity['workshops_ttt'] += 1
+        if administrator == 'self-organized':
+            activity['workshops_self_organized'] += 1
+
+        if attendance is None:
+            activity['missing_attendance'].append(slug)
+        if not instructors[id_]:
+            activity['missing_instructors'].append(slug)
+
+    return months
+
+
+def snapshot_to_activity(snapshot):
+    """Read activity data stored in `ActivitySnapshot` instance."""
+    activity = empty_activity()
+    for key in activity:
+        value = getattr(snapshot, key)
+        if key in ACTIVITY_LIST_FIELDS:
+            value = json.loads(value)
+        activity[key] = value
+    return activity
+
+
+def activity_to_snapshot_fields(activity):
+    """Prepare activity data for storing in `ActivitySnapshot` instance."""
+    return {
+        key: json.dumps(value) if key in ACTIVITY_LIST_FIELDS else value
+        for key, value in activity.items()
+    }
+
+
+def refresh_activity_snapshots(start, end):
+    """Recalculate and store snapshots for all months between `start` and
+    `end` (inclusive)."""
+    first, last = month_start(start), month_start(end)
+    events = Event.objects.filter(start__gte=first, start__lt=next_month(last))
+    computed = compute_activity(events)
+
+    snapshots = []
+    month = first
+    while month <= last:
+        activity = computed.get(month, empty_activity())
+        snapshot, _ = ActivitySnapshot.objects.update_or_create(
+            month=month, defaults=activity_to_snapshot_fields(activity),
+        )
+        snapshots.append(snapshot)
+        month = next_month(month)
+    return snapshots
+
+
+def refresh_activity_months(months):
+    """Recalculate and store snapshots for `months` (any collection of first
+    days of months).  Consecutive months are refreshed together."""
+    months = sorted(months)
+    first = months[0]
+    for previous, month in zip(months, months[1:] + [None]):
+        if month != next_month(previous):
+            refresh_activity_snapshots(first, previous)
+            first = month
+
+
+def _create_missing_snapshots(months):
+    """Calculate and store snapshots for `months` (a sorted list of months
+    not present in the snapshot table)."""
+    events = Event.objects.filter(start__gte=months[0],
+                                  start__lt=next_month(months[-1]))
+    computed = compute_activity(events)
+    fields = {
+        month: activity_to_snapshot_fields(
+            computed.get(month, empty_activity())
+        )
+        for month in months
+    }
+
+    try:
+        with transaction.atomic():
+            return ActivitySnapshot.objects.bulk_create([
+                ActivitySnapshot(month=month, **fields[month])
+                for month in months
+            ])
+    except IntegrityError:
+        # some snapshots were created in the meantime by another request;
+        # they're calculated from the same data, so they're kept
+        return [
+            ActivitySnapshot.objects.get_or_create(
+                month=month, defaults=fields[month],
+            )[0]
+            for month in months
+        ]
+
+
+def activity_over_time(start, end):
+    """Calculate activity data for events started between `start` and `end`
+    (inclusive).
+
+    Months fully contained in the range are read from the snapshot table
+    (missing snapshots are created on the way), the remaining days at both
+    ends of the range are computed directly."""
+    first_full = start if start.day == 1 else next_month(start)
+    after_last_full = month_start(end + datetime.timedelta(days=1))
+
+    if first_full >= after_last_full:
+        # range doesn't cover any full month
+        months = compute_activity(
+            Event.objects.filter(start__gte=start, start__lte=end)
+        )
+        return _merge_months(months)
+
+    snapshots = {
+        snapshot.month: snapshot
+        for snapshot in ActivitySnapshot.objects.filter(
+            month__gte=first_full, month__lt=after_last_full,
+        )
+    }
+
+    missing = []
+    month = first_full
+    while month < after_last_full:
+        if month not in snapshots:
+            missing.append(month)
+        month = next_month(month)
+    if missing:
+        for snapshot in _create_missing_snapshots(missing):
+            snapshots[snapshot.month] = snapshot
+
+    months = {month: snapshot_to_activity(snapshot)
+              for month, snapshot in snapshots.items()}
+
+    # partial months at both ends of the range
+    if start < first_full or after_last_full <= end:
+        edges = Q(start__gte=start, start__lt=first_full) | \
+            Q(start__gte=after_last_full, start__lte=end)
+        months.update(compute_activity(Event.objects.filter(edges)))
+
+    return _merge_months(months)
+
+
+def _merge_months(months):
+    """Add up activity data from `months` (a dictionary of month and activity
+    data) in chronological order."""
+    result = empty_activity()
+    for month in sorted(months):
+        result = merge_activity(result, months[month])
+    return result
+
+
+def _supports_window_functions(connection):
+    if connection.vendor == 'sqlite':
+        # Django doesn't enable window functions for SQLite, even though
+        # SQLite supports them since 3.25
+        return connection.Database.sqlite_version_info >= (3, 25, 0)
+    return connection.features.supports_over_clause
+
+
+def cumulative_over_time(queryset):
+    """Yield `(date, count)` tuples with running total of `count` values from
+    `queryset`, one tuple per date, ordered by date.
+
+    `queryset` must provide `date` and `count` for every row (for example with
+    `annotate()`).  Rows are grouped by date and summed up in a single query;
+    running total is calculated with a window function or, if the database
+    doesn't support them, while reading the results."""
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    window = _supports_window_functions(connection)
+
+    inner_sql, params = (
+        queryset.order_by().values('date', 'count').query.sql_with_params()
+    )
+    if window:
+        total = 'SUM(COALESCE(SUM({count}), 0)) OVER (ORDER BY {date})'
+    else:
+        total = 'COALESCE(SUM({count}), 0)'
+    sql = (
+        'SELECT {date}, ' + total + ' FROM ({inner}) {series} '
+        'WHERE {date} IS NOT NULL GROUP BY {date} ORDER BY {date}'
+    ).format(date=qn('date'), count=qn('count'), inner=inner_sql,
+             series=qn('series'))
+
+    running_total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for date, count in cursor:
+            # raw queries don't convert dates on some backends (e.g. SQLite)
+            if isinstance(date, str):
+                date = parse_date(date)
+            if window:
+                running_total = int(count)
+            else:
+                running_total += int(count)
+            yield date, running_total
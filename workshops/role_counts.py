@@ -0,0 +1,111 @@
+"""Numbers of tasks persons had in specific roles.
+
+Counts are stored in `Person` fields (e.g. `Person.num_taught`), so that
+listings can filter and sort persons by them without joining and grouping
+whole `Task` table.  Signals (see `workshops.signals`) keep the counts
+up-to-date when tasks change (once per transaction, when it's committed); code changing tasks without sending signals
+(e.g. `bulk_create()` or `QuerySet.update()`) has to call
+`update_role_counts()` itself."""
+
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, When
+
+# Person fields and roles counted in them
+ROLE_COUNT_FIELDS = {
+    'num_taught': 'instructor',
+    'num_helper': 'helper',
+    'num_organizer': 'organizer',
+    'num_learner': 'learner',
+}
+
+NO_TASKS = dict.fromkeys(ROLE_COUNT_FIELDS, 0)
+
+
+def _counts(values):
+    return tuple(values[field] for field in ROLE_COUNT_FIELDS)
+
+
+def calculate_role_counts(get_model=django_apps.get_model, pks=None):
+    """Dictionary of role counts (tuples ordered like `ROLE_COUNT_FIELDS`) by
+    person's ID, calculated from tasks.  Persons without tasks are skipped.
+    `get_model` can be used to provide historical models in migrations."""
+    Task = get_model('workshops', 'Task')
+
+    tasks = Task.objects.order_by()
+    if pks is not None:
+        tasks = tasks.filter(person__in=pks)
+    tasks = tasks.values('person').annotate(**{
+        field: Count(Case(When(role__name=role, then=1),
+                          output_field=IntegerField()))
+        for field, role in ROLE_COUNT_FIELDS.items()
+    })
+    return {values['person']: _counts(values) for values in tasks}
+
+
+def stored_role_counts(get_model=django_apps.get_model, pks=None):
+    """Dictionary of role counts by person's ID, as stored in `Person`."""
+    Person = get_model('workshops', 'Person')
+
+    persons = Person.objects.order_by()
+    if pks is not None:
+        persons = persons.filter(pk__in=pks)
+    return {values['pk']: _counts(values)
+            for values in persons.values('pk', *ROLE_COUNT_FIELDS)}
+
+
+def _write_role_counts(Person, changed):
+    """Store `changed` (dictionary of role counts by person's ID), with one
+    query for all persons with the same counts."""
+    by_counts = defaultdict(list)
+    for pk, counts in changed.items():
+        by_counts[counts].append(pk)
+
+    for counts, pks in by_counts.items():
+        Person.objects.filter(pk__in=pks) \
+                      .update(**dict(zip(ROLE_COUNT_FIELDS, counts)))
+
+
+def update_role_counts(pks):
+    """Recalculate role counts of persons with `pks`.  Only changed counts are
+    written."""
+    Person = django_apps.get_model('workshops', 'Person')
+    pks = set(pks)
+    if not pks:
+        return
+
+    with transaction.atomic():
+        calculated = calculate_role_counts(pks=pks)
+        stored = stored_role_counts(pks=pks)
+        no_tasks = _counts(NO_TASKS)
+        _write_role_counts(Person, {
+            pk: calculated.get(pk, no_tasks)
+            for pk, counts in stored.items()
+            if calculated.get(pk, no_tasks) != counts
+        })
+
+
+def stale_role_counts(get_model=django_apps.get_model):
+    """List of (person's ID, stored counts, calculated counts) tuples for all
+    persons whose stored role counts are wrong."""
+    calculated = calculate_role_counts(get_model)
+    no_tasks = _counts(NO_TASKS)
+    return [
+        (pk, counts, calculated.get(pk, no_tasks))
+        for pk, counts in sorted(stored_role_counts(get_model).items())
+        if calculated.get(pk, no_tasks) != counts
+    ]
+
+
+def rebuild_role_counts(get_model=django_apps.get_model):
+    """Recalculate role counts of all persons; return number of persons whose
+    counts were wrong."""
+    Person = get_model('workshops', 'Person')
+
+    with transaction.atomic():
+        stale = stale_role_counts(get_model)
+        _write_role_counts(Person, {pk: calculated
+                                    for pk, _, calculated in stale})
+    return len(stale)
@@ -0,0 +1,163 @@
+"""Automatic score of training requests.
+
+Score is calculated according to the rubric:
+https://github.com/carpentries/instructor-training/blob/gh-pages/files/rubric.md
+
+`TrainingRequest.save()` stores the score, and a signal (see
+`workshops.signals`) updates it when request's domains or previous
+involvement change (once per transaction, when it's committed).
+`update_scores()` recalculates scores of any number of requests with a few
+queries, e.g. after the rubric changes."""
+
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Least
+
+# location based points (country not on the list of countries) according to
+# https://github.com/swcarpentry/amy/issues/1327#issuecomment-422539917
+# and
+# https://github.com/swcarpentry/amy/issues/1327#issuecomment-423292177
+NOT_SCORING_COUNTRIES = [
+    'US', 'CA', 'NZ', 'GB', 'AU', 'AT', 'BE', 'CY', 'CZ',
+    'DK', 'EE', 'FI', 'FR', 'DE', 'GR', 'HU', 'IE', 'IT', 'LV', 'LT',
+    'LU', 'MT', 'NL', 'PL', 'PT', 'RO', 'SK', 'SI', 'ES', 'SE',
+    'CH', 'IS', 'NO',
+]
+
+# economics or social sciences, arts, humanities, or library science
+SCORING_DOMAINS = [
+    'Humanities', 'Library and information science',
+    'Economics/business', 'Social sciences',
+]
+
+# +1 for each previous involvement with The Carpentries (max. 3)
+MAX_INVOLVEMENT_POINTS = 3
+
+# +1 for one of these answers (field name and values)
+SCORING_ANSWERS = (
+    # previous training in teaching: "a certification or short course" or
+    # "a full degree"
+    ('previous_training', ['course', 'full']),
+    # previous experience in teaching: "TA for full course" or "primary
+    # instructor for full course"
+    ('previous_experience', ['ta', 'courses']),
+    # using tools "every day" or "a few times a week"
+    ('programming_language_usage_frequency', ['daily', 'weekly']),
+)
+
+
+def field_points(request):
+    """Points for request's own fields (ie. not for many-to-many
+    relations), taken from the instance even if it isn't saved."""
+    score = 0
+    if request.country and request.country.code not in NOT_SCORING_COUNTRIES:
+        score += 1
+    if request.underresourced:
+        score += 1
+    for field, values in SCORING_ANSWERS:
+        if getattr(request, field) in values:
+            score += 1
+    return score
+
+
+def _relation_points():
+    """Annotations with points for requests' domains and previous
+    involvement."""
+    from workshops.models import count_subquery
+
+    TrainingRequest = django_apps.get_model('workshops', 'TrainingRequest')
+    Domains = TrainingRequest.domains.through
+    Involvement = TrainingRequest.previous_involvement.through
+
+    return dict(
+        has_scoring_domain=Exists(Domains.objects.filter(
+            trainingrequest=OuterRef('pk'),
+            knowledgedomain__name__in=SCORING_DOMAINS,
+        )),
+        involvement_points=Least(
+            count_subquery(Involvement.objects.filter(
+                trainingrequest=OuterRef('pk'),
+            )),
+            Value(MAX_INVOLVEMENT_POINTS),
+        ),
+    )
+
+
+def relation_points(pks):
+    """Dictionary of points for domains and previous involvement by request's
+    ID, calculated in one query."""
+    TrainingRequest = django_apps.get_model('workshops', 'TrainingRequest')
+    requests = TrainingRequest.objects.filter(pk__in=pks).order_by() \
+                                      .annotate(**_relation_points()) \
+                                      .values_list('pk', 'has_scoring_domain',
+                                                   'involvement_points')
+    return {pk: int(has_scoring_domain) + involvement_points
+            for pk, has_scoring_domain, involvement_points in requests}
+
+
+def _when_points(condition):
+    return Case(When(condition, then=Value(1)), default=Value(0),
+                output_field=IntegerField())
+
+
+def annotate_score(queryset):
+    """Annotate training requests with their calculated score (as
+    `calculated_score`)."""
+    points = [
+        _when_points(~Q(country='') &
+                     ~Q(country__in=NOT_SCORING_COUNTRIES)),
+        _when_points(Q(underresourced=True)),
+        _when_points(Q(has_scoring_domain=True)),
+        F('involvement_points'),
+    ] + [
+        _when_points(Q(**{field + '__in': values}))
+        for field, values in SCORING_ANSWERS
+    ]
+    score = points[0]
+    for expression in points[1:]:
+        score = score + expression
+    return queryset.annotate(**_relation_points()) \
+                   .annotate(calculated_score=score)
+
+
+def stale_scores(queryset=None):
+    """List of (ID, stored score, calculated score) of training requests in
+    `queryset` (all requests by default) with wrong automatic score."""
+    TrainingRequest = django_apps.get_model('workshops', 'TrainingRequest')
+    if queryset is None:
+        queryset = TrainingRequest.objects.all()
+    return list(
+        annotate_score(queryset.order_by('pk'))
+        .exclude(score_auto=F('calculated_score'))
+        .values_list('pk', 'score_auto', 'calculated_score')
+    )
+
+
+def update_scores(queryset=None):
+    """Recalculate and store scores of training requests in `queryset` (all
+    requests by default).  Only changed scores are written, with one query
+    per distinct score.  Returns number of requests with changed score."""
+    TrainingRequest = django_apps.get_model('workshops', 'TrainingRequest')
+
+    with transaction.atomic():
+        by_score = defaultdict(list)
+        for pk, _, score in stale_scores(queryset):
+            by_score[score].append(pk)
+
+        for score, pks in by_score.items():
+            TrainingRequest.objects.filter(pk__in=pks) \
+                                   .update(score_auto=score)
+
+    return sum(len(pks) for pks in by_score.values())
@@ -0,0 +1,238 @@
+"""Search index.
+
+Words from text fields of searchable objects are split into trigrams
+(three-character fragments), which are stored in `SearchTrigram` table
+together with words' one- and two-character prefixes.  Signals (see
+`workshops.signals`) keep the table up-to-date when objects change.
+
+Searching for a term first finds objects containing all trigrams of the
+term's words, using the index, and only these candidates are matched against
+the term itself.  Words shorter than three characters are either looked up as
+prefixes, so they match only beginnings of words (e.g. "jo" finds "John", but
+not "Bojan"), or, if they should match anywhere in words, they aren't looked
+up at all.  Autocomplete lookups use prefixes, which keeps the most common,
+short queries from scanning whole tables.
+
+Autocomplete lookups additionally keep their recent responses in
+`lookup_cache`, which is cleared whenever indexed objects change."""
+
+from collections import OrderedDict
+from functools import reduce
+import threading
+import time
+
+from django.apps import apps as django_apps
+from django.db.models import Count
+
+# fields indexed for every searchable model; order of the fields is used when
+# ranking results (the first fields are the most important)
+SEARCHABLE_FIELDS = {
+    'organization': ('domain', 'fullname', 'notes'),
+    'event': ('slug', 'host__domain', 'host__fullname', 'url', 'contact',
+              'venue', 'address', 'notes'),
+    'person': ('personal', 'family', 'email', 'username', 'github'),
+    'airport': ('iata', 'fullname'),
+    'trainingrequest': ('personal', 'family', 'email', 'github',
+                        'group_name', 'affiliation', 'location', 'comment'),
+}
+
+BATCH_SIZE = 1000
+
+
+def trigrams(text):
+    """Set of trigrams of all words in `text`."""
+    result = set()
+    for word in str(text or '').lower().split():
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def prefixes(text):
+    """Set of one- and two-character prefixes of all words in `text`."""
+    result = set()
+    for word in str(text or '').lower().split():
+        result.update((word[:1], word[:2]))
+    return result
+
+
+def index_entries(text):
+    """Set of index entries (trigrams and prefixes) of `text`."""
+    return trigrams(text) | prefixes(text)
+
+
+def term_entries(term, short_words_as_prefixes=True):
+    """Set of index entries that objects matching `term` must have: trigrams
+    of term's words, and (optionally) whole words shorter than three
+    characters."""
+    result = set()
+    for word in str(term or '').lower().split():
+        if len(word) >= 3:
+            result.update(trigrams(word))
+        elif short_words_as_prefixes:
+            result.add(word)
+    return result
+
+
+def _model_name(model):
+    return model._meta.model_name
+
+
+def _document_entries(model, pks=None):
+    """Yield (pk, index entries) for objects of `model`, optionally only objects
+    with `pks`."""
+    fields = SEARCHABLE_FIELDS[_model_name(model)]
+    objects = model.objects.order_by()
+    if pks is not None:
+        objects = objects.filter(pk__in=pks)
+    for pk, *values in objects.values_list('pk', *fields).iterator():
+        yield pk, set().union(*map(index_entries, values))
+
+
+def index_objects(model, pks):
+    """Bring index entries of `model` objects with `pks` up-to-date.  Only
+    changed trigrams are written."""
+    SearchTrigram = django_apps.get_model('workshops', 'SearchTrigram')
+    name = _model_name(model)
+
+    current = {pk: set() for pk in pks}
+    entries = SearchTrigram.objects.filter(model=name, object_id__in=pks)
+    for object_id, trigram in entries.values_list('object_id', 'trigram'):
+        current[object_id].add(trigram)
+
+    new_entries = []
+    for pk, document in _document_entries(model, pks):
+        existing = current.pop(pk)
+        removed = existing - document
+        if removed:
+            entries.filter(object_id=pk, trigram__in=removed).delete()
+        new_entries += [
+            SearchTrigram(model=name, object_id=pk, trigram=trigram)
+            for trigram in document - existing
+        ]
+    SearchTrigram.objects.bulk_create(new_entries)
+
+    # remaining objects don't exist anymore
+    if current:
+        entries.filter(object_id__in=current).delete()
+
+
+def unindex_objects(model, pks):
+    """Remove index entries of `model` objects with `pks`."""
+    SearchTrigram = django_apps.get_model('workshops', 'SearchTrigram')
+    SearchTrigram.objects.filter(model=_model_name(model),
+                                 object_id__in=pks).delete()
+
+
+def rebuild_index(get_model=django_apps.get_model):
+    """Recreate whole index.  `get_model` can be used to provide historical
+    models in migrations."""
+    SearchTrigram = get_model('workshops', 'SearchTrigram')
+    SearchTrigram.objects.all().delete()
+
+    for name in SEARCHABLE_FIELDS:
+        model = get_model('workshops', name)
+        batch = []
+        for pk, document in _document_entries(model):
+            batch += [
+                SearchTrigram(model=name, object_id=pk, trigram=trigram)
+                for trigram in document
+            ]
+            if len(batch) >= BATCH_SIZE:
+                SearchTrigram.objects.bulk_create(batch)
+                batch = []
+        SearchTrigram.objects.bulk_create(batch)
+
+    lookup_cache.clear()
+
+
+def search(queryset, term, q, short_words_as_prefixes=False):
+    """Filter `queryset` with `q` (conditions matching `term`), but look only
+    at objects that, according to the index, contain all words of `term`.
+    With `short_words_as_prefixes`, words shorter than three characters
+    have to be beginnings of objects' words."""
+    SearchTrigram = django_apps.get_model('workshops', 'SearchTrigram')
+
+    entries = term_entries(term, short_words_as_prefixes)
+    if entries:
+        candidates = (
+            SearchTrigram.objects
+            .filter(model=_model_name(queryset.model),
+                    trigram__in=entries)
+            .values('object_id')
+            .annotate(matched=Count('trigram'))
+            .filter(matched=len(entries))
+            .values('object_id')
+        )
+        queryset = queryset.filter(pk__in=candidates)
+
+    return queryset.filter(q)
+
+
+def _field_value(obj, field):
+    return reduce(lambda o, attr: getattr(o, attr, None),
+                  field.split('__'), obj)
+
+
+def rank(objects, term):
+    """Sort `objects` by relevance to `term`: exact matches go first, then
+    prefix matches, then other matches; each of them by importance of the
+    matched field.  Order of equally relevant objects is kept."""
+    term = term.lower()
+
+    def relevance(obj):
+        fields = SEARCHABLE_FIELDS[_model_name(obj)]
+        best = (0, 0)
+        for position, field in enumerate(fields):
+            value = str(_field_value(obj, field) or '').lower()
+            if value == term:
+                match = 3
+            elif value.startswith(term):
+                match = 2
+            elif term in value:
+                match = 1
+            else:
+                continue
+            best = max(best, (match, -position))
+        return best
+
+    return sorted(objects, key=relevance, reverse=True)
+
+
+class LRUCache:
+    """In-process cache keeping `size` most recently used entries, each for
+    at most `timeout` seconds."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value or None."""
+        with self.lock:
+            try:
+                value, expires = self.entries[key]
+            except KeyError:
+                return None
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# responses of autocomplete lookups; changes made in other processes aren't
+# signalled to this one, so entries expire quickly
+lookup_cache = LRUCache(size=1000, timeout=60)
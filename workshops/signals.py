@@ -1,3 +1,66 @@
+import threading
+import weakref
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils.dateparse import parse_date
+
+# values collected by `_on_commit_once()`, by database alias and name;
+# connections are local to threads, so are transactions and their values
+_pending_on_commit = threading.local()
+
+
+def _on_commit_once(using, name, values, process):
+    """Collect `values` in a set, which is passed to `process(values, using)`
+    once the current transaction on `using` database commits.
+
+    Values collected under the same `name` during a transaction are
+    processed together, so that e.g. many changes of the same objects cause
+    only one recalculation.  They're dropped if the transaction is rolled
+    back (values from a rolled back savepoint may still be processed with
+    the rest of the transaction, which only recalculates them again)."""
+    values = set(values or ())
+    if not values:
+        return
+
+    using = using or DEFAULT_DB_ALIAS
+    pending = _pending_on_commit.__dict__.setdefault(using, {})
+    collected, callback_ref = pending.get(name, (None, None))
+
+    # Django forgets callbacks of rolled back transactions, so the callback
+    # is still alive only if it waits for the commit
+    if callback_ref is not None and callback_ref() is not None:
+        collected.update(values)
+        return
+
+    collected = values
+
+    def callback():
+        # values collected from now on belong to another transaction
+        if pending.get(name, (None, None))[0] is collected:
+            del pending[name]
+        process(collected, using)
+
+    pending[name] = (collected, weakref.ref(callback))
+    # outside of a transaction the callback runs right away
+    transaction.on_commit(callback, using=using)
+
+
+def _rescore_training_requests(pks, using):
+    # imported here, because this module is loaded before models are ready
+    from workshops.models import TrainingRequest
+    from workshops.scoring import annotate_score
+
+    # only requests with changed score are saved; they're saved (not
+    # updated with a query), so that the change is visible to save signals
+    # and version control
+    requests = annotate_score(
+        TrainingRequest.objects.using(using).filter(pk__in=pks)
+    ).exclude(score_auto=F('calculated_score'))
+    for request in requests:
+        request.save(update_fields=['score_auto'])
+
+
 def trainingrequest_m2m_changed(sender, **kwargs):
     """Signal receiver for TrainingRequest m2m_changed signal.
 
@@ -6,18 +69,342 @@ def trainingrequest_m2m_changed(sender, **kwargs):
     automatic score, which depends on these M2M fields.
 
     Originally calculation takes place in model's `save` method, but
-    it was being called before M2M fields changed."""
+    it was being called before M2M fields changed.  Requests changed in
+    a transaction are rescored once, when it's committed."""
+    action = kwargs.get('action', '')
+    instance = kwargs.get('instance')
+    using = kwargs.get('using')
+
+    if not kwargs.get('reverse'):
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            pks = {instance.pk}
+        else:
+            return
+
+    # the relation was changed from the other side (e.g.
+    # `KnowledgeDomain.trainingrequest_set`), so `pk_set` contains requests'
+    # IDs
+    elif action in ['post_add', 'post_remove']:
+        pks = kwargs.get('pk_set')
+
+    # `pk_set` isn't provided when clearing, so the requests have to be
+    # found before they're removed
+    elif action == 'pre_clear':
+        pks = sender.objects.using(using) \
+                            .filter(**{type(instance)._meta.model_name:
+                                       instance}) \
+                            .values_list('trainingrequest_id', flat=True)
+    else:
+        return
+
+    _on_commit_once(using, 'training request scores', pks,
+                    _rescore_training_requests)
+
+
+def _as_date(value):
+    """Dates assigned to model fields aren't converted until the instance is
+    reloaded, so they can still be strings at this point."""
+    if isinstance(value, str):
+        return parse_date(value)
+    return value
+
+
+# event fields used by activity snapshots (see `workshops.reports`)
+ACTIVITY_EVENT_FIELDS = {'slug', 'start', 'attendance', 'administrator'}
+
+
+def _activity_fields_updated(kwargs):
+    """False if the save touched only fields irrelevant for activity
+    snapshots (e.g. website metadata)."""
+    update_fields = kwargs.get('update_fields')
+    return not update_fields or bool(ACTIVITY_EVENT_FIELDS &
+                                     set(update_fields))
 
-    # react only on "post_add"/"post_remove", forward (not reverse) action
+
+def _refresh_pending_activity(pending, using):
+    """Refresh activity snapshots for months and months of events collected
+    (as ("month", date) and ("event", ID) tuples) in a transaction.  Events
+    are fetched in one query."""
+    # imported here, because this module is loaded before models are ready
+    from workshops.models import Event
+    from workshops.reports import refresh_activity_months
+
+    months = {value for kind, value in pending if kind == 'month'}
+    event_ids = {value for kind, value in pending if kind == 'event'}
+    if event_ids:
+        starts = Event.objects.using(using).filter(pk__in=event_ids) \
+                                           .exclude(start=None) \
+                                           .values_list('start', flat=True)
+        months.update(start.replace(day=1) for start in starts)
+    if months:
+        refresh_activity_months(months)
+
+
+def _schedule_activity_refresh(using, months=(), event_ids=()):
+    """Refresh activity snapshots for `months` and months of events with
+    `event_ids` when the current transaction commits, once for all changes
+    made in the transaction."""
+    _on_commit_once(
+        using, 'activity snapshots',
+        [('month', month) for month in months] +
+        [('event', pk) for pk in event_ids or ()],
+        _refresh_pending_activity,
+    )
+
+
+def _refresh_activity_snapshot(*dates, using=None):
+    """Refresh activity snapshots for months of `dates` after the current
+    transaction commits."""
+    _schedule_activity_refresh(using, months={
+        date.replace(day=1) for date in map(_as_date, dates)
+        if date is not None
+    })
+
+
+def event_activity_post_init(sender, **kwargs):
+    """Signal receiver for Event post_init signal.
+
+    Remember event's start date as loaded, so that the activity snapshot for
+    the previous month can be refreshed if the date changes (without
+    fetching the event again before saving)."""
+    instance = kwargs.get('instance')
+    # deferred start date isn't loaded
+    instance._previous_start = _as_date(instance.__dict__.get('start'))
+
+
+def event_activity_changed(sender, **kwargs):
+    """Signal receiver for Event post_save and post_delete signals.
+
+    Refresh activity snapshot for the month the event started in (and the
+    month it used to start in, if the start date changed)."""
+    instance = kwargs.get('instance')
+    if kwargs.get('raw') or not _activity_fields_updated(kwargs):
+        return
+
+    start = _as_date(instance.start)
+    previous_start = getattr(instance, '_previous_start', None)
+    _refresh_activity_snapshot(start, previous_start,
+                               using=kwargs.get('using'))
+    instance._previous_start = start
+
+
+def event_tags_changed(sender, **kwargs):
+    """Signal receiver for Event.tags m2m_changed signal.
+
+    Refresh activity snapshots, since they count workshops by tags."""
     action = kwargs.get('action', '')
-    forward = not kwargs.get('reverse', True)
-    instance = kwargs.get('instance', None)
+    instance = kwargs.get('instance')
     using = kwargs.get('using')
 
-    # There's a catch - we can alter the relation from a different side, ie.
-    # from KnowledgeDomain.trainingrequest_set, but it's harder to recalculate
-    # because we'd have to make N recalculations. Therefore we only allow
-    # `forward` direction.
-    if instance and forward and action in ['post_add', 'post_remove']:
-        # recalculation happens in `save()` method
-        instance.save(using=using)
+    if not kwargs.get('reverse'):
+        if action in ['post_add', 'post_remove', 'post_clear']:
+            _refresh_activity_snapshot(instance.start, using=using)
+
+    # the relation was changed from Tag's side, so `pk_set` contains
+    # events' IDs
+    elif action in ['post_add', 'post_remove']:
+        _schedule_activity_refresh(using, event_ids=kwargs.get('pk_set'))
+
+    # `pk_set` isn't provided when clearing, so the tag's events have to be
+    # found before they're removed
+    elif action == 'pre_clear':
+        _schedule_activity_refresh(using, event_ids=set(
+            sender.objects.using(using).filter(tag=instance)
+                                       .values_list('event_id', flat=True)
+        ))
+
+
+def task_activity_changed(sender, **kwargs):
+    """Signal receiver for Task post_delete signal.
+
+    Refresh activity snapshot for the task's event, because it counts
+    instructors.  Saving a task doesn't need a separate receiver, because
+    `Task.save()` saves the event as well.  If the event is deleted too,
+    the snapshot is refreshed by `event_activity_changed`."""
+    instance = kwargs.get('instance')
+    _schedule_activity_refresh(kwargs.get('using'),
+                               event_ids={instance.event_id})
+
+
+def airport_changed(sender, **kwargs):
+    """Signal receiver for Airport post_save and post_delete signals.
+
+    Drop the airport index, so that it's rebuilt with new coordinates."""
+    # imported here, because this module is loaded before models are ready
+    from workshops.geo import reset_airport_index
+
+    reset_airport_index()
+
+
+def register_math_functions(sender, connection, **kwargs):
+    """Signal receiver for connection_created signal.
+
+    Add math functions used for calculating distances (see
+    `workshops.geo.distance_to`) to SQLite, which lacks them."""
+    if connection.vendor != 'sqlite':
+        return
+
+    # imported here, because this module is loaded before models are ready
+    from workshops.geo import SQLITE_MATH_FUNCTIONS
+
+    def null_safe(function):
+        return lambda x: None if x is None else function(x)
+
+    for name, function in SQLITE_MATH_FUNCTIONS.items():
+        connection.connection.create_function(name, 1, null_safe(function))
+
+
+def search_index_update(sender, **kwargs):
+    """Signal receiver for post_save signal of searchable models.
+
+    Update search index entries of the saved object.  For organizations,
+    entries of hosted events are updated too, because events are searchable
+    by host's name."""
+    from workshops.search import (
+        SEARCHABLE_FIELDS,
+        index_objects,
+        lookup_cache,
+    )
+
+    instance = kwargs.get('instance')
+    update_fields = kwargs.get('update_fields')
+    fields = {field.split('__')[0]
+              for field in SEARCHABLE_FIELDS[sender._meta.model_name]}
+    if update_fields and not fields & set(update_fields):
+        # e.g. only `last_login` was updated
+        return
+
+    index_objects(sender, [instance.pk])
+    lookup_cache.clear()
+
+    if sender._meta.model_name == 'organization':
+        from workshops.models import Event
+
+        events = Event.objects.filter(host=instance)
+        index_objects(Event, list(events.values_list('pk', flat=True)))
+
+
+def search_index_delete(sender, **kwargs):
+    """Signal receiver for post_delete signal of searchable models.
+
+    Remove search index entries of the deleted object."""
+    from workshops.search import lookup_cache, unindex_objects
+
+    unindex_objects(sender, [kwargs.get('instance').pk])
+    lookup_cache.clear()
+
+
+def lookup_results_changed(sender, **kwargs):
+    """Signal receiver for signals of models whose changes alter results of
+    autocomplete lookups, but aren't indexed (e.g. memberships or event tags).
+
+    Drop cached lookup responses."""
+    from workshops.search import lookup_cache
+
+    lookup_cache.clear()
+
+
+def duplicate_keys_update(sender, **kwargs):
+    """Signal receiver for post_save signal of persons and training requests.
+
+    Update keys used for finding possible duplicates."""
+    from workshops.duplicates import DUPLICATE_KEY_FIELDS, update_keys
+
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not set(DUPLICATE_KEY_FIELDS) & set(update_fields):
+        return
+
+    update_keys(sender, [kwargs.get('instance').pk])
+
+
+def duplicate_keys_delete(sender, **kwargs):
+    """Signal receiver for post_delete signal of persons and training
+    requests.
+
+    Remove keys used for finding possible duplicates."""
+    from workshops.duplicates import remove_keys
+
+    remove_keys(sender, [kwargs.get('instance').pk])
+
+
+def _update_role_counts(pks, using):
+    from workshops.role_counts import update_role_counts
+
+    update_role_counts(pks)
+
+
+def task_role_counts_post_init(sender, **kwargs):
+    """Signal receiver for Task post_init signal.
+
+    Remember task's person as loaded, so that role counts of both persons
+    can be updated if the task is moved to someone else (without fetching
+    the task again before saving)."""
+    instance = kwargs.get('instance')
+    # deferred person isn't loaded
+    instance._previous_person_id = instance.__dict__.get('person_id')
+
+
+def task_role_counts_changed(sender, **kwargs):
+    """Signal receiver for Task post_save and post_delete signals.
+
+    Update role counts (e.g. `Person.num_taught`) of the task's person, once
+    for all tasks changed in a transaction, when it's committed."""
+    if kwargs.get('raw'):
+        return
+
+    instance = kwargs.get('instance')
+    _on_commit_once(kwargs.get('using'), 'role counts',
+                    {instance.person_id,
+                     getattr(instance, '_previous_person_id', None)} - {None},
+                    _update_role_counts)
+    instance._previous_person_id = instance.person_id
+
+
+def _update_eligibility(pks, using):
+    from workshops.eligibility import update_eligibility
+
+    update_eligibility(pks)
+
+
+def instructor_eligibility_post_init(sender, **kwargs):
+    """Signal receiver for TrainingProgress and Award post_init signals.
+
+    Remember the person as loaded, so that instructor eligibility of both
+    persons can be updated if the object is moved to someone else (without
+    fetching the object again before saving)."""
+    from workshops.eligibility import PERSON_FIELDS
+
+    instance = kwargs.get('instance')
+    field = PERSON_FIELDS[sender._meta.model_name]
+    # deferred person isn't loaded
+    instance._previous_person_id = instance.__dict__.get(field + '_id')
+
+
+def instructor_eligibility_changed(sender, **kwargs):
+    """Signal receiver for TrainingProgress and Award post_save and
+    post_delete signals.
+
+    Update instructor eligibility of the trainee or awarded person, once for
+    all objects changed in a transaction, when it's committed."""
+    from workshops.eligibility import PERSON_FIELDS
+
+    if kwargs.get('raw'):
+        return
+
+    instance = kwargs.get('instance')
+    person_id = getattr(instance, PERSON_FIELDS[sender._meta.model_name] +
+                        '_id')
+    _on_commit_once(kwargs.get('using'), 'instructor eligibility',
+                    {person_id,
+                     getattr(instance, '_previous_person_id', None)} - {None},
+                    _update_eligibility)
+    instance._previous_person_id = person_id
+
+
+def object_history_update(sender, **kwargs):
+    """Signal receiver for reversion's post_revision_commit signal.
+
+    Update history summary of objects saved in the revision."""
+    from workshops.object_history import record_revision
+
+    record_revision(kwargs['revision'], kwargs['versions'])
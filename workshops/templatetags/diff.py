@@ -1,76 +1,75 @@
+import hashlib
+
 from django import template
-from django.db.models import Q
+from django.core.cache import caches
 from django.utils.safestring import mark_safe
 
 from reversion_compare.helpers import html_diff, SEMANTIC
 
+from workshops.util import version_related_pks, versions_related_objects
+
 register = template.Library()
 
+# versions don't change, so their diffs can be kept for long
+DIFF_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
 
 @register.simple_tag
 def semantic_diff(left, right, field):
     left_txt = left.field_dict[field] or ''
     right_txt = right.field_dict[field] or ''
-    return mark_safe(html_diff(left_txt, right_txt, cleanup=SEMANTIC))
 
+    # the key depends on compared texts, not only on versions' IDs, so it
+    # can't ever point to a diff of different texts
+    key = 'diff:{}:{}:'.format(left.pk, right.pk) + hashlib.sha1(
+        '{}\0{}'.format(left_txt, right_txt).encode('utf-8')
+    ).hexdigest()
+    cache = caches['default']
+    diff = cache.get(key)
+    if diff is None:
+        diff = html_diff(left_txt, right_txt, cleanup=SEMANTIC)
+        cache.set(key, diff, DIFF_CACHE_TIMEOUT)
+    return mark_safe(diff)
 
-@register.simple_tag
-def relation_diff(left, right, field):
+
+def _labels(objects, css_class, prefix=''):
+    return ''.join('<a class="label {}" href="{}">{}{}</a>'.format(
+            css_class,
+            obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else '#',
+            prefix,
+            obj
+        )
+        for obj in objects
+    )
+
+
+@register.simple_tag(takes_context=True)
+def relation_diff(context, left, right, field):
+    """Labels of objects related in both, only in current (`right`) or only
+    in previous (`left`) version.
+
+    Objects are taken from `related_objects` in the context (see
+    `workshops.util.versions_related_objects`) and fetched only if they're
+    missing there.  Deleted objects are represented by their PKs."""
     model = field.related_model
-    field_name = field.get_attname()
+    related_objects = context.get('related_objects') or {}
+    if model not in related_objects:
+        related_objects = versions_related_objects([left, right], [field])
+    objects = related_objects[model]
+
+    left_PKs = [objects.get(pk, pk)
+                for pk in version_related_pks(left, field)]
+    right_PKs = [objects.get(pk, pk)
+                 for pk in version_related_pks(right, field)]
 
-    if field.many_to_one or field.one_to_one:
-        # {left,right}.field_dict[field_name] is an integer or does not exist
-        # Cast it to a list(empty or single itemed)
-        if left.field_dict.get(field_name):
-            try:
-                left_PKs = [model.objects.get(pk=left.field_dict.get(field_name))]
-            except model.DoesNotExist:
-                left_PKs = [left.field_dict.get(field_name)]
-        else:
-            left_PKs = []
-        if right.field_dict.get(field_name):
-            try:
-                right_PKs = [model.objects.get(pk=right.field_dict.get(field_name))]
-            except model.DoesNotExist:
-                right_PKs = [right.field_dict.get(field_name)]
-        else:
-            right_PKs = []
-    else:
-        left_PKs = []
-        for pk in left.field_dict.get(field_name, []):
-            try:
-                left_PKs.append(model.objects.get(pk=pk))
-            except model.DoesNotExist:
-                left_PKs.append(pk)
-        right_PKs = []
-        for pk in right.field_dict.get(field_name, []):
-            try:
-                right_PKs.append(model.objects.get(pk=pk))
-            except model.DoesNotExist:
-                right_PKs.append(pk)
     # Relations that exist only in the current version
     additions = [obj for obj in right_PKs if obj not in left_PKs]
     # Relations that exist only in the previous version
     deletions = [obj for obj in left_PKs if obj not in right_PKs]
     # Relations that exist only in both versions
     consistent = [obj for obj in left_PKs if obj in right_PKs]
-    add_label = ''.join('<a class="label label-success" href="{}">+{}</a>'.format(
-            obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else '#',
-            obj
-        )
-        for obj in additions
-    )
-    delete_label = ''.join('<a class="label label-danger" href="{}">-{}</a>'.format(
-            obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else '#',
-            obj
-        )
-        for obj in deletions
-    )
-    consistent_label = ''.join('<a class="label label-default" href="{}">{}</a>'.format(
-            obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else '#',
-            obj
-        )
-        for obj in consistent
-    )
-    return mark_safe(''.join([consistent_label, add_label,delete_label]))
+    return mark_safe(''.join([
+        _labels(consistent, 'label-default'),
+        _labels(additions, 'label-success', '+'),
+        _labels(deletions, 'label-danger', '-'),
+    ]))
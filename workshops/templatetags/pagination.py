@@ -14,3 +14,14 @@ def set_page_query(context, page):
     query = context['request'].GET.copy()
     query['page'] = str(page)
     return query.urlencode()
+
+
+@register.simple_tag(takes_context=True)
+def set_cursor_query(context, direction, cursor):
+    """Query for a page of keyset pagination; `direction` is either "after"
+    or "before"."""
+    query = context['request'].GET.copy()
+    for param in ('page', 'after', 'before'):
+        query.pop(param, None)
+    query[direction] = cursor
+    return query.urlencode()
@@ -1,31 +1,28 @@
 from django import template
+from django.contrib.contenttypes.models import ContentType
 
-from reversion.models import Version
+from workshops.models import ObjectHistory
 
 register = template.Library()
 
 
 @register.inclusion_tag('includes/last_modified.html')
 def last_modified(obj):
-    """Get all versions for specific object, display:
+    """Get history summary of specific object, display:
 
     "Created on ASD by DSA."
     "Last modified on ASD by DSA."
     """
-    versions = Version.objects.get_for_object(obj).select_related(
-        'revision','revision__user')
-
     try:
-        last, *_, created = versions
-    except ValueError:  # either len(versions) == 0 or len(versions) == 1
-        try:
-            created = versions[0]
-            last = None
-        except IndexError:  # len(versions) == 0
-            created = None
-            last = None
+        history = ObjectHistory.objects.select_related(
+            'created_by', 'last_modified_by',
+        ).get(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=str(obj.pk),
+        )
+    except ObjectHistory.DoesNotExist:
+        history = None
 
     return {
-        'created': created,
-        'last_modified': last,
+        'history': history,
     }
@@ -10,6 +10,7 @@ import xml.etree.ElementTree as ET
 
 from django.conf import settings
 from django.contrib.auth.models import Group, Permission
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.urls import reverse
 from django_webtest import WebTest
 import webtest.forms
@@ -35,6 +36,25 @@ def dummy_subTest():
     yield
 
 
+@contextlib.contextmanager
+def run_on_commit_callbacks(using=DEFAULT_DB_ALIAS):
+    """Run `transaction.on_commit()` callbacks registered inside the block.
+
+    Test cases are wrapped in transactions which are never committed, so
+    these callbacks wouldn't run otherwise."""
+    connection = connections[using]
+    start = len(connection.run_on_commit)
+    try:
+        yield
+    finally:
+        # callbacks can register more callbacks
+        while len(connection.run_on_commit) > start:
+            callbacks = connection.run_on_commit[start:]
+            del connection.run_on_commit[start:]
+            for _, callback in callbacks:
+                callback()
+
+
 class DummySubTestWhenTestsLaunchedInParallelMixin:
     def subTest(self, *args, **kwargs):
         # If you launch tests in parallel, subTest is not supported yet. To
@@ -553,3 +573,23 @@ class TestBase(DummySubTestWhenTestsLaunchedInParallelMixin,
             expected_value, got_value,
             msg='Expected "{}" to be selected '
                 'while {} is/are selected.'.format(expected, selected))
+
+    ### Instrumentation helpers
+
+    def assertWithinQueryBudget(self, response):
+        """Ensure the view which handled the request (made with
+        `self.client`) declared a query budget and didn't exceed it."""
+        stats = response.wsgi_request.query_stats
+        self.assertIsNotNone(
+            stats.budget,
+            msg='View {} has no query budget declared.'.format(
+                stats.view_name),
+        )
+        repeated = ''.join('\n  {}x {}'.format(count, sql)
+                           for sql, count in stats.most_repeated())
+        self.assertLessEqual(
+            stats.queries, stats.budget,
+            msg='View {} ran {} queries, but its budget is {}.  Most '
+                'repeated queries:{}'.format(stats.view_name, stats.queries,
+                                             stats.budget, repeated),
+        )
@@ -4,10 +4,15 @@ import datetime
 from io import StringIO
 
 from django.contrib.sessions.serializers import JSONSerializer
+from django.db import IntegrityError
+from django.db.models import Q
 from django.urls import reverse
+from reversion.models import Version
 
 from ..models import Organization, Event, Role, Person, Task
+from ..search import search
 from ..util import (
+    create_uploaded_persons_tasks,
     upload_person_task_csv,
     verify_upload_person_task,
 )
@@ -272,6 +277,94 @@ class VerifyUploadPersonTask(CSVBulkUploadTestBase):
         self.assertIn('Person with this username already exists.',
                       data[0]['errors'])
 
+    def test_number_of_queries_doesnt_depend_on_rows(self):
+        """Ensure rows are verified with a fixed number of queries."""
+        def make_rows(count):
+            return [
+                {
+                    'personal': 'Harry', 'family': 'Potter{}'.format(i),
+                    'username': '', 'email': 'h{}@hogwarts.edu'.format(i),
+                    'event': 'foobar', 'role': 'Instructor',
+                    'existing_person_id': self.harry.pk,
+                }
+                for i in range(count)
+            ]
+
+        # events, roles, persons, usernames, similar persons, tasks
+        with self.assertNumQueries(6):
+            verify_upload_person_task(make_rows(2))
+        with self.assertNumQueries(6):
+            verify_upload_person_task(make_rows(50))
+
+    def test_generated_usernames_are_unique(self):
+        """Ensure new persons with the same name get different usernames."""
+        data = self.make_data()
+        data.append(dict(data[0], email='another@example.org'))
+        verify_upload_person_task(data)
+        self.assertEqual(data[0]['personal'], data[-1]['personal'])
+        self.assertEqual(data[0]['family'], data[-1]['family'])
+        self.assertNotEqual(data[0]['username'], data[-1]['username'])
+
+
+class CreateUploadedPersonsTasks(CSVBulkUploadTestBase):
+
+    def make_rows(self, count, role='learner'):
+        data = [
+            {
+                'personal': 'Luna', 'family': 'Lovegood{}'.format(i),
+                'username': '', 'email': 'luna{}@hogwarts.edu'.format(i),
+                'event': 'foobar', 'role': role,
+            }
+            for i in range(count)
+        ]
+        # first verification generates usernames
+        verify_upload_person_task(data)
+        verify_upload_person_task(data)
+        return data
+
+    def test_creating_persons_and_tasks(self):
+        """Ensure persons and tasks are created, and the event, search index
+        and history are updated."""
+        data = self.make_rows(30)
+        data.append({
+            'personal': 'Harry', 'family': 'Potter', 'username': '',
+            'email': 'harry@hogwarts.edu', 'event': 'foobar',
+            'role': 'learner', 'existing_person_id': self.harry.pk,
+        })
+        verify_upload_person_task(data[-1:])
+
+        persons, tasks = create_uploaded_persons_tasks(data)
+
+        self.assertEqual(len(persons), 30)
+        self.assertTrue(all(p.pk for p in persons))
+        self.assertEqual(len(tasks), 31)
+        self.assertEqual(
+            Task.objects.filter(event__slug='foobar',
+                                role__name='learner').count(),
+            31,
+        )
+        self.assertEqual(Event.objects.get(slug='foobar').attendance, 31)
+        self.assertEqual(
+            search(Person.objects.all(), 'Lovegood12', Q()).get(),
+            Person.objects.get(family='Lovegood12'),
+        )
+        self.assertTrue(
+            Version.objects.get_for_object(persons[0]).exists())
+
+        # existing tasks aren't created again
+        persons, tasks = create_uploaded_persons_tasks(data[-1:])
+        self.assertEqual((persons, tasks), ([], []))
+
+    def test_error_for_row_is_reported(self):
+        """Ensure database errors are reported with the row that caused
+        them."""
+        data = self.make_rows(3)
+        data[2]['username'] = data[1]['username']
+        with self.assertRaisesRegex(IntegrityError, 'Lovegood2'):
+            create_uploaded_persons_tasks(data)
+        self.assertFalse(Person.objects.filter(family__startswith='Lovegood')
+                                       .exists())
+
 
 class BulkUploadUsersViewTestCase(CSVBulkUploadTestBase):
 
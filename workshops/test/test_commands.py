@@ -4,14 +4,25 @@ These commands are run via `./manage.py command`."""
 
 from datetime import date, datetime, time
 from io import StringIO
+import json
+import os
+import re
+import tempfile
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+from django.core import mail
+from django.core.mail.backends import locmem
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template.loader import get_template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 import requests_mock
 
 from .base import TestBase
+from ..util import metadata_hash
 from ..management.commands.fake_database import (
     Command as FakeDatabaseCommand,
     Faker
@@ -20,11 +31,14 @@ from ..management.commands.instructors_activity import (
     Command as InstructorsActivityCommand)
 from ..management.commands.check_for_workshop_websites_updates import (
     Command as WebsiteUpdatesCommand,
+    BranchHead,
+    HostRateLimiter,
     WrongWorkshopURL,
     datetime_match,
     datetime_decode)
 from ..models import (
     Airport,
+    Award,
     Role,
     Badge,
     Tag,
@@ -142,6 +156,128 @@ class TestInstructorsActivityCommand(TestBase):
         self.assertEqual(set(persons), set(expecting_persons))
 
 
+    def test_fetching_activity_constant_number_of_queries(self):
+        """Make sure the number of queries doesn't grow with the number of
+        instructors and their tasks."""
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                for record in self.cmd.fetch_activity(may_contact_only=False):
+                    self.cmd.make_message(record)
+            return len(context)
+
+        # load the template beforehand
+        self.cmd.template
+        before = count_queries()
+
+        swc_instructor = Badge.objects.get(name='swc-instructor')
+        for i in range(3):
+            event = Event.objects.create(slug='another-event-{}'.format(i),
+                                         host=self.org_alpha)
+            person = Person.objects.create(
+                personal='Instructor', family=str(i),
+                username='instructor_{}'.format(i),
+                email='instructor{}@example.org'.format(i),
+            )
+            Award.objects.create(person=person, badge=swc_instructor,
+                                 awarded=date(2016, 1, 1))
+            Task.objects.create(event=event, person=person,
+                                role=self.instructor)
+            Task.objects.create(event=event, person=self.hermione,
+                                role=self.helper)
+
+        self.assertEqual(count_queries(), before)
+
+    def test_sending_with_django_mailing(self):
+        """Ensure messages are sent in batches over one connection, and
+        the template is loaded only once."""
+        with patch('workshops.management.commands.instructors_activity.'
+                   'get_template', wraps=get_template) as mock_get_template:
+            call_command('instructors_activity', send_out_for_real=True,
+                         django_mailing=True, no_may_contact_only=True,
+                         batch_size=2, stdout=StringIO())
+
+        self.assertEqual(mock_get_template.call_count, 1)
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            sorted([self.hermione.email, self.harry.email, self.ron.email]),
+        )
+
+    def test_resuming_from_checkpoint(self):
+        """Ensure persons listed in the checkpoint are skipped and the
+        checkpoint is removed once all emails are sent."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            checkpoint = os.path.join(tmpdir, 'checkpoint.json')
+            with open(checkpoint, 'w') as f:
+                json.dump([self.hermione.pk], f)
+
+            call_command('instructors_activity', send_out_for_real=True,
+                         django_mailing=True, no_may_contact_only=True,
+                         checkpoint=checkpoint, stdout=StringIO())
+
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            sorted([self.harry.email, self.ron.email]),
+        )
+
+    def test_failed_batch_kept_in_checkpoint(self):
+        """Ensure persons whose emails failed aren't marked as sent."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            checkpoint = os.path.join(tmpdir, 'checkpoint.json')
+            with patch.object(locmem.EmailBackend, 'send_messages',
+                              side_effect=OSError):
+                with self.assertRaises(CommandError):
+                    call_command('instructors_activity',
+                                 send_out_for_real=True, django_mailing=True,
+                                 no_may_contact_only=True,
+                                 checkpoint=checkpoint, stdout=StringIO(),
+                                 stderr=StringIO())
+
+            with open(checkpoint) as f:
+                self.assertEqual(json.load(f), [])
+
+    def test_resuming_after_connection_failure(self):
+        """Ensure that when the connection fails partway through a batch,
+        messages sent before the failure are recorded, so that nobody gets
+        a second email when the mailing is resumed."""
+        send_messages = locmem.EmailBackend.send_messages
+        calls = []
+
+        def failing_send_messages(backend, messages):
+            calls.append(messages)
+            if len(calls) >= 2:
+                raise OSError('connection lost')
+            return send_messages(backend, messages)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            checkpoint = os.path.join(tmpdir, 'checkpoint.json')
+            with patch.object(locmem.EmailBackend, 'send_messages',
+                              autospec=True,
+                              side_effect=failing_send_messages):
+                with self.assertRaises(CommandError):
+                    call_command('instructors_activity',
+                                 send_out_for_real=True, django_mailing=True,
+                                 no_may_contact_only=True,
+                                 checkpoint=checkpoint, stdout=StringIO(),
+                                 stderr=StringIO())
+
+            # one message per call, and only the first one was sent
+            self.assertEqual([len(messages) for messages in calls],
+                             [1, 1, 1])
+            self.assertEqual(len(mail.outbox), 1)
+            with open(checkpoint) as f:
+                self.assertEqual(len(json.load(f)), 1)
+
+            call_command('instructors_activity', send_out_for_real=True,
+                         django_mailing=True, no_may_contact_only=True,
+                         checkpoint=checkpoint, stdout=StringIO())
+            self.assertFalse(os.path.exists(checkpoint))
+
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            sorted([self.hermione.email, self.harry.email, self.ron.email]),
+        )
+
 class TestWebsiteUpdatesCommand(TestBase):
     maxDiff = None
 
@@ -402,6 +538,161 @@ class TestWebsiteUpdatesCommand(TestBase):
         self.assertEqual(e.metadata_all_changes, '')
         self.assertEqual(e.metadata_changed, False)
 
+    @requests_mock.Mocker()
+    def test_running_concurrently(self, mock):
+        """Ensure events are checked by many workers and saved in batches."""
+        host = Organization.objects.first()
+        common = dict(host=host, start=date.today(), completed=False,
+                      repository_metadata='', metadata_changed=False)
+        unchanged = Event.objects.create(
+            slug='unchanged', repository_last_commit_hash='aaa',
+            url='https://github.com/swcarpentry/unchanged', **common)
+        changed = Event.objects.create(
+            slug='changed', repository_last_commit_hash='bbb',
+            url='https://github.com/swcarpentry/changed', **common)
+        broken = Event.objects.create(
+            slug='broken', repository_last_commit_hash='ccc',
+            url='https://github.com/swcarpentry/broken', **common)
+
+        shas = {
+            'swcarpentry/unchanged': 'aaa',
+            'swcarpentry/changed': 'new-bbb',
+            'swcarpentry/broken': 'new-ccc',
+        }
+
+        def get_repo(name):
+            repo = MagicMock()
+            repo.get_branch.return_value.commit.sha = shas[name]
+            return repo
+
+        mock.get(changed.url, text=self.mocked_event_page)
+        mock.get(broken.url, status_code=500)
+
+        stderr = StringIO()
+        with patch('workshops.management.commands.'
+                   'check_for_workshop_websites_updates.Github') as github, \
+                patch('sys.stdout', StringIO()), patch('sys.stderr', stderr):
+            github.return_value.get_repo.side_effect = get_repo
+            call_command('check_for_workshop_websites_updates', token='x',
+                         workers=3, batch_size=2, host_interval=0,
+                         graphql_batch_size=0)
+
+        # unchanged website isn't downloaded
+        self.assertEqual(
+            {request.url for request in mock.request_history},
+            {changed.url, broken.url},
+        )
+        self.assertIn('Network error when accessing broken',
+                      stderr.getvalue())
+
+        unchanged.refresh_from_db()
+        changed.refresh_from_db()
+        broken.refresh_from_db()
+        self.assertEqual(unchanged.repository_last_commit_hash, 'aaa')
+        self.assertFalse(unchanged.metadata_changed)
+        self.assertEqual(changed.repository_last_commit_hash, 'new-bbb')
+        self.assertTrue(changed.metadata_changed)
+        self.assertIn('Helpers changed', changed.metadata_all_changes)
+        self.assertEqual(broken.repository_last_commit_hash, 'ccc')
+
+    @requests_mock.Mocker()
+    def test_running_with_graphql(self, mock):
+        """Ensure branches are checked with one GraphQL query, and only
+        repositories missing from its result are checked with REST API."""
+        host = Organization.objects.first()
+        common = dict(host=host, start=date.today(), completed=False,
+                      repository_metadata='', metadata_changed=False)
+        unchanged = Event.objects.create(
+            slug='unchanged', repository_last_commit_hash='aaa',
+            url='https://github.com/swcarpentry/unchanged', **common)
+        changed = Event.objects.create(
+            slug='changed', repository_last_commit_hash='bbb',
+            url='https://github.com/swcarpentry/changed', **common)
+        missing = Event.objects.create(
+            slug='missing', repository_last_commit_hash='ccc',
+            url='https://github.com/swcarpentry/missing', **common)
+
+        # "missing" repository doesn't have gh-pages branch
+        shas = {'unchanged': 'aaa', 'changed': 'new-bbb'}
+
+        def graphql_response(request, context):
+            aliases = re.findall(r'(\w+): repository\(owner: "swcarpentry", '
+                                 r'name: "(\w+)"\)', request.json()['query'])
+            return {'data': {
+                alias: {'ref': {'target': {'oid': shas[name]}}}
+                if name in shas else {'ref': None}
+                for alias, name in aliases
+            }}
+
+        mock.post(WebsiteUpdatesCommand.GITHUB_GRAPHQL_URL,
+                  json=graphql_response)
+        mock.get(changed.url, text=self.mocked_event_page)
+        mock.get(missing.url, text=self.mocked_event_page)
+
+        with patch('workshops.management.commands.'
+                   'check_for_workshop_websites_updates.Github') as github, \
+                patch('sys.stdout', StringIO()):
+            github.return_value.get_repo.return_value \
+                  .get_branch.return_value.commit.sha = 'new-ccc'
+            call_command('check_for_workshop_websites_updates', token='x',
+                         host_interval=0)
+
+        graphql_requests = [r for r in mock.request_history
+                            if r.method == 'POST']
+        self.assertEqual(len(graphql_requests), 1)
+        self.assertEqual(graphql_requests[0].headers['Authorization'],
+                         'bearer x')
+        github.return_value.get_repo.assert_called_once_with(
+            'swcarpentry/missing')
+
+        unchanged.refresh_from_db()
+        changed.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertFalse(unchanged.metadata_changed)
+        self.assertEqual(changed.repository_last_commit_hash, 'new-bbb')
+        self.assertTrue(changed.metadata_changed)
+        self.assertEqual(missing.repository_last_commit_hash, 'new-ccc')
+        self.assertTrue(missing.metadata_changed)
+
+    def test_same_metadata_hash(self):
+        """Ensure stored metadata aren't compared field by field when their
+        hash matches new metadata."""
+        metadata = self.expected_metadata_parsed
+        e = Event.objects.create(
+            slug='same-hash', host=Organization.objects.first(),
+            url='https://swcarpentry.github.io/workshop-template/',
+            repository_last_commit_hash='aaa',
+            repository_metadata=self.cmd.serialize(metadata),
+            repository_metadata_hash=metadata_hash(metadata),
+            metadata_changed=False)
+        branch = BranchHead('bbb')
+
+        with patch.object(self.cmd, 'deserialize') as deserialize:
+            changes = self.cmd.apply_changes(branch, e, dict(metadata))
+        deserialize.assert_not_called()
+        self.assertEqual(changes, [])
+        self.assertEqual(e.repository_last_commit_hash, 'bbb')
+        self.assertFalse(e.metadata_changed)
+
+    def test_deserialization_is_typed(self):
+        """Ensure only date fields are decoded from stored metadata."""
+        metadata = dict(self.expected_metadata_parsed,
+                        venue='2016-04-18', contact='16:41:30')
+        deserialized = self.cmd.deserialize(self.cmd.serialize(metadata))
+        self.assertEqual(deserialized, metadata)
+
+    def test_host_rate_limiter(self):
+        """Ensure requests to the same host are spaced out, and requests to
+        different hosts aren't."""
+        limiter = HostRateLimiter(interval=10)
+        with patch('time.sleep') as sleep:
+            limiter.wait('https://swcarpentry.github.io/a/')
+            limiter.wait('https://datacarpentry.github.io/a/')
+            sleep.assert_not_called()
+            limiter.wait('https://swcarpentry.github.io/b/')
+            sleep.assert_called_once()
+            self.assertAlmostEqual(sleep.call_args[0][0], 10, delta=1)
+
     @unittest.skip('This command requires internet connection')
     def test_running(self):
         """Test running whole command."""
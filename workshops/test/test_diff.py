@@ -1,7 +1,16 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from reversion.models import Version
 from reversion.revisions import create_revision
 from reversion import revisions as reversion
+from reversion_compare.helpers import html_diff
 
 from workshops.models import Event, Person, Tag
 from .base import TestBase
@@ -96,6 +105,37 @@ class TestRevisions(TestBase):
             html=True
         )
 
+    def test_related_objects_fetched_in_bulk(self):
+        """Ensure objects related in both versions are fetched with one query
+        per related model, regardless of their number."""
+        with create_revision():
+            for i in range(10):
+                tag = Tag.objects.create(name='tag{}'.format(i))
+                self.event.tags.add(tag)
+            self.event.save()
+        newest = Version.objects.get_for_object(self.event)[0]
+
+        with CaptureQueriesContext(connection) as ctx:
+            rv = self.client.get(reverse('object_changes', args=[newest.pk]))
+        self.assertEqual(rv.status_code, 200)
+        tag_queries = [q for q in ctx.captured_queries
+                       if 'FROM "workshops_tag"' in q['sql']]
+        self.assertEqual(len(tag_queries), 1)
+        self.assertContains(rv, '+{}'.format(tag))
+
+    def test_semantic_diff_cached(self):
+        """Ensure text diffs of the same versions are calculated once."""
+        caches['default'].clear()
+        url = reverse('object_changes', args=[self.newer.pk])
+        with patch('workshops.templatetags.diff.html_diff',
+                   wraps=html_diff) as mock_diff:
+            rv1 = self.client.get(url)
+            self.assertTrue(mock_diff.called)
+            mock_diff.reset_mock()
+            rv2 = self.client.get(url)
+            self.assertFalse(mock_diff.called)
+        self.assertEqual(rv1.content, rv2.content)
+
 
 class TestRegression1083(TestBase):
     def setUp(self):
@@ -126,3 +166,55 @@ class TestRegression1083(TestBase):
 
         back_to_person_view = revision.click('View newest')
         self.assertIn('Brown', back_to_person_view)
+
+
+class TestChangesLog(TestBase):
+    def setUp(self):
+        self._setUpUsersAndLogin()
+        self._setUpOrganizations()
+
+        with create_revision():
+            reversion.set_user(self.admin)
+            self.event = Event.objects.create(host=self.org_alpha,
+                                              slug='event')
+
+        with create_revision():
+            self.person = Person.objects.create(
+                personal='Harry', family='Potter', email='hp@magic.uk')
+
+    def test_log_lists_changed_objects(self):
+        with CaptureQueriesContext(connection) as ctx:
+            rv = self.client.get(reverse('changes_log'))
+        self.assertEqual(rv.status_code, 200)
+        for obj in [self.event, self.person]:
+            version = Version.objects.get_for_object(obj).get()
+            self.assertContains(rv, reverse('object_changes',
+                                            args=[version.pk]))
+        # versions' payloads aren't loaded
+        for query in ctx.captured_queries:
+            self.assertNotIn('serialized_data', query['sql'])
+
+    def test_filtering_by_model(self):
+        rv = self.client.get(reverse('changes_log'), {
+            'model': ContentType.objects.get_for_model(Person).pk,
+        })
+        self.assertEqual([str(v) for change in rv.context['log']
+                          for v in change.version_set.all()],
+                         [str(self.person)])
+
+    def test_filtering_by_user(self):
+        rv = self.client.get(reverse('changes_log'), {'user': self.admin.pk})
+        self.assertEqual([str(v) for change in rv.context['log']
+                          for v in change.version_set.all()],
+                         [str(self.event)])
+
+    def test_filtering_by_date(self):
+        today = timezone.localdate()
+        rv = self.client.get(reverse('changes_log'), {
+            'changed_after': today, 'changed_before': today,
+        })
+        self.assertEqual(len(rv.context['log']), 2)
+        rv = self.client.get(reverse('changes_log'), {
+            'changed_after': today + timedelta(days=1),
+        })
+        self.assertEqual(len(rv.context['log']), 0)
@@ -21,6 +21,7 @@ from ..models import (
     Membership,
 )
 from ..forms import EventForm, EventsMergeForm
+from ..util import metadata_hash
 from .base import TestBase
 
 
@@ -1041,6 +1042,8 @@ class TestEventReviewingRepoChanges(TestBase):
         self.assertEqual(self.event.metadata_changed, False)
         self.assertEqual(self.event.metadata_all_changes, '')
         self.assertEqual(self.event.repository_metadata, self.metadata_serialized)
+        self.assertEqual(self.event.repository_metadata_hash,
+                         metadata_hash(self.metadata))
         for key, value in self.metadata.items():
             if key not in ('slug', 'instructors', 'helpers', 'language'):
                 self.assertEqual(getattr(self.event, key), value)
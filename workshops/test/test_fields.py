@@ -1,7 +1,16 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from .base import TestBase
-from ..fields import NullableGithubUsernameField
+from ..fields import (
+    MAX_SELECTED_IDS,
+    ModelIDListField,
+    ModelSelect2Multiple,
+    NullableGithubUsernameField,
+)
+from ..models import Person
 
 
 class TestNullableGHUsernameField(TestBase):
@@ -37,3 +46,62 @@ class TestNullableGHUsernameField(TestBase):
         for username in self.failing:
             with self.assertRaises(ValidationError):
                 self.field.run_validators(username)
+
+
+class TestModelIDListField(TestBase):
+    def setUp(self):
+        self._setUpAirports()
+        self._setUpNonInstructors()
+        self.field = ModelIDListField(queryset=Person.objects.all(),
+                                      max_ids=2)
+
+    def test_valid_ids_validated_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            persons = self.field.clean([str(self.spiderman.pk),
+                                        str(self.ironman.pk)])
+            self.assertEqual(set(persons), {self.spiderman, self.ironman})
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_too_many_ids(self):
+        """Ensure too many IDs are rejected without any query."""
+        ids = [str(self.spiderman.pk), str(self.ironman.pk),
+               str(self.blackwidow.pk)]
+        with CaptureQueriesContext(connection) as ctx:
+            with self.assertRaises(ValidationError) as cm:
+                self.field.clean(ids)
+        self.assertEqual(cm.exception.code, 'max_ids')
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_repeated_ids_counted_once(self):
+        ids = [str(self.spiderman.pk), str(self.ironman.pk),
+               str(self.spiderman.pk)]
+        persons = self.field.clean(ids)
+        self.assertEqual(set(persons), {self.spiderman, self.ironman})
+
+    def test_default_limit_below_request_fields_limit(self):
+        """Ensure the default limit can be reached before Django rejects the
+        request for having too many fields."""
+        self.assertLess(MAX_SELECTED_IDS,
+                        settings.DATA_UPLOAD_MAX_NUMBER_FIELDS)
+
+    def test_wrong_ids(self):
+        with self.assertRaises(ValidationError):
+            self.field.clean(['0'])
+        with self.assertRaises(ValidationError):
+            self.field.clean(['abc'])
+
+    def test_rendering_doesnt_list_objects(self):
+        """Ensure rendering the field doesn't enumerate the queryset."""
+        with CaptureQueriesContext(connection) as ctx:
+            html = self.field.widget.render('persons', [self.spiderman.pk])
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(html.count('<input'), 1)
+
+    def test_select2_widget_renders_only_selected(self):
+        field = ModelIDListField(
+            queryset=Person.objects.all(),
+            widget=ModelSelect2Multiple(url='person-lookup'),
+        )
+        html = field.widget.render('persons', [self.spiderman.pk])
+        self.assertEqual(html.count('<option'), 1)
+        self.assertIn('value="{}"'.format(self.spiderman.pk), html)
@@ -1,6 +1,7 @@
 from django.urls import reverse
 
-from ..models import Person
+from ..duplicates import object_keys, rebuild_keys, soundex
+from ..models import DuplicateKey, Person, TrainingRequest
 from .base import TestBase
 
 class TestEmptyDuplicates(TestBase):
@@ -77,3 +78,99 @@ class TestFindingDuplicates(TestBase):
         self.assertNotIn(self.potter, switched)
 
     # there might be more to come
+
+    def test_names_are_normalized(self):
+        ron3 = Person.objects.create(
+            personal='RON ', family='weasley', username='weasley_ron_3')
+        rv = self.client.get(self.url)
+        self.assertIn(ron3, rv.context['duplicate_persons'])
+
+    def test_similar_persons(self):
+        hermione = Person.objects.create(
+            personal='Hermione', family='Granger', username='granger_h')
+        hermiona = Person.objects.create(
+            personal='Hermiona', family='Grainger', username='grainger_h')
+        rv = self.client.get(self.url)
+        similar = list(rv.context['similar_persons'])
+        self.assertIn(hermione, similar)
+        self.assertIn(hermiona, similar)
+        self.assertNotIn(self.harry, similar)
+        # similar persons are next to each other
+        self.assertEqual(abs(similar.index(hermione) -
+                             similar.index(hermiona)), 1)
+
+    def test_keys_follow_changes(self):
+        self.ron2.family = 'Weasley-Granger'
+        self.ron2.save()
+        rv = self.client.get(self.url)
+        self.assertNotIn(self.ron, rv.context['duplicate_persons'])
+
+        self.ron2.family = 'Weasley'
+        self.ron2.save()
+        rv = self.client.get(self.url)
+        self.assertIn(self.ron, rv.context['duplicate_persons'])
+
+        self.ron2.delete()
+        rv = self.client.get(self.url)
+        self.assertNotIn(self.ron, rv.context['duplicate_persons'])
+        self.assertFalse(DuplicateKey.objects.filter(
+            model='person', object_id=self.ron2.pk).exists())
+
+    def test_rebuilding_keys(self):
+        keys = set(DuplicateKey.objects.values_list(
+            'model', 'object_id', 'kind', 'key'))
+        DuplicateKey.objects.all().delete()
+        rebuild_keys()
+        self.assertEqual(keys, set(DuplicateKey.objects.values_list(
+            'model', 'object_id', 'kind', 'key')))
+
+
+class TestFindingDuplicateTrainingRequests(TestBase):
+    def setUp(self):
+        self._setUpUsersAndLogin()
+
+        def create(personal, family, email):
+            return TrainingRequest.objects.create(
+                personal=personal, family=family, email=email,
+                reason='Just for fun.',
+            )
+
+        self.first = create('John', 'Smith', 'john@smith.com')
+        self.second = create('John', 'Smith', 'smith@example.org')
+        self.third = create('Jane', 'Doe', 'John@Smith.com')
+        self.fourth = create('Jane', 'Smith', 'jane@example.org')
+
+        self.url = reverse('duplicate_training_requests')
+
+    def test_duplicate_names(self):
+        rv = self.client.get(self.url)
+        names = rv.context['duplicate_names']
+        self.assertEqual(set(names), {self.first, self.second})
+
+    def test_duplicate_emails(self):
+        rv = self.client.get(self.url)
+        emails = rv.context['duplicate_emails']
+        self.assertEqual(set(emails), {self.first, self.third})
+
+
+class TestDuplicateKeys(TestBase):
+    def test_soundex(self):
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('Tymczak'), 'T522')
+        self.assertEqual(soundex('Pfister'), 'P236')
+        self.assertEqual(soundex('Lee'), 'L000')
+        self.assertEqual(soundex('!!'), '')
+
+    def test_object_keys(self):
+        self.assertEqual(
+            object_keys('person', ' Zoë ', 'Smith', 'zoe@example.org'),
+            {('name', 'zoe|smith'), ('switched', 'smith|zoe'),
+             ('phonetic', 'Z000 S530')},
+        )
+        self.assertEqual(
+            object_keys('trainingrequest', 'Zoe', None, 'Zoe@Example.org'),
+            {('name', 'zoe|'), ('email', 'zoe@example.org')},
+        )
+        self.assertEqual(object_keys('person', '', None, None), set())
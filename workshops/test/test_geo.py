@@ -0,0 +1,194 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..geo import (
+    AirportIndex,
+    ByAirportDistance,
+    airport_index,
+    bounding_box_q,
+    distance_to,
+    great_circle_distance,
+)
+from ..models import Airport, Person
+
+
+class TestGreatCircleDistance(TestCase):
+    def test_distance(self):
+        # one degree of longitude on the equator
+        self.assertAlmostEqual(great_circle_distance(0, 0, 0, 1), 111.19,
+                               places=2)
+        self.assertAlmostEqual(great_circle_distance(0, 0, 0, 180),
+                               20015.09, places=2)
+        # longitude doesn't matter at the pole
+        self.assertAlmostEqual(great_circle_distance(90, 0, 90, 120), 0)
+
+
+class TestDistanceTo(TestCase):
+    def test_same_as_great_circle_distance(self):
+        """Ensure distances calculated in the database are the same as ones
+        calculated in Python, also across the antimeridian and the pole."""
+        points = [(0, 0), (0, 10), (10, 179.5), (10, -179.5), (89, 0),
+                  (89, 180), (-45, 90)]
+        for i, (lat, lng) in enumerate(points):
+            Airport.objects.create(iata='A{}'.format(i), fullname=str(i),
+                                   latitude=lat, longitude=lng)
+
+        for lat, lng in [(0, 1), (10, 179.9), (89.5, 90)]:
+            airports = Airport.objects.annotate(
+                distance=distance_to(lat, lng),
+            ).values_list('latitude', 'longitude', 'distance')
+            for airport_lat, airport_lng, distance in airports:
+                self.assertAlmostEqual(
+                    distance,
+                    great_circle_distance(lat, lng, airport_lat, airport_lng),
+                    places=6,
+                )
+
+
+class TestBoundingBox(TestCase):
+    def test_contains_points_within_radius(self):
+        """Ensure the box contains all points within the radius, also across
+        the antimeridian and the pole."""
+        points = [(0, 0), (0, 10), (10, 179.5), (10, -179.5), (89, 0),
+                  (89, 180), (-45, 90), (-89.9, -30)]
+        for i, (lat, lng) in enumerate(points):
+            Airport.objects.create(iata='A{}'.format(i), fullname=str(i),
+                                   latitude=lat, longitude=lng)
+
+        for lat, lng in [(0, 1), (10, 179.9), (10, -179.9), (89.5, 90),
+                         (-60, 90)]:
+            for radius in [0, 100, 1200, 5000, 20000]:
+                within = {
+                    (airport_lat, airport_lng)
+                    for airport_lat, airport_lng in points
+                    if great_circle_distance(lat, lng, airport_lat,
+                                             airport_lng) <= radius
+                }
+                in_box = set(Airport.objects.filter(
+                    bounding_box_q(lat, lng, radius),
+                ).values_list('latitude', 'longitude'))
+                self.assertLessEqual(within, in_box)
+
+    def test_excludes_far_points(self):
+        Airport.objects.create(iata='AAA', fullname='Near', latitude=0,
+                               longitude=0)
+        Airport.objects.create(iata='BBB', fullname='Far', latitude=0,
+                               longitude=20)
+        self.assertEqual(
+            list(Airport.objects.filter(bounding_box_q(0, 1, 500))
+                                .values_list('iata', flat=True)),
+            ['AAA'],
+        )
+
+
+class TestByAirportDistance(TestCase):
+    def setUp(self):
+        # two people at each of 20 airports along the equator
+        for i in range(20):
+            airport = Airport.objects.create(
+                iata='A{:02d}'.format(i), fullname=str(i), latitude=0,
+                longitude=i,
+            )
+            for j in range(2):
+                Person.objects.create(
+                    personal='P', family='{:02d}{}'.format(i, j),
+                    username='p{}_{}'.format(i, j),
+                    email='p{}_{}@example.org'.format(i, j),
+                    airport=airport,
+                )
+        self.people = ByAirportDistance(
+            Person.objects.all(), 0, 0.001, ordering=('distance', 'family'),
+        )
+
+    def families(self, people):
+        return [person.family for person in people]
+
+    def test_slices(self):
+        expected = ['{:02d}{}'.format(i, j) for i in range(20)
+                    for j in range(2)]
+        self.assertEqual(len(self.people), 40)
+        self.assertEqual(self.families(self.people), expected)
+        for start, stop in [(0, 1), (0, 5), (3, 9), (30, 40), (38, 45)]:
+            self.assertEqual(self.families(self.people[start:stop]),
+                             expected[start:stop])
+        self.assertEqual(self.people[7].family, expected[7])
+        with self.assertRaises(IndexError):
+            self.people[40]
+
+    def test_first_page_narrowed(self):
+        """Ensure distance of far people isn't calculated for the first
+        page."""
+        with CaptureQueriesContext(connection) as ctx:
+            self.people[0:3]
+        page_query = ctx.captured_queries[-1]['sql']
+        self.assertIn('BETWEEN', page_query)
+        self.assertIn('LIMIT 3', page_query)
+
+    def test_radius(self):
+        people = ByAirportDistance(Person.objects.all(), 0, 0, radius=250,
+                                   ordering=('distance', 'family'))
+        self.assertEqual(len(people), 6)
+        self.assertEqual(self.families(people[0:10]),
+                         ['000', '001', '010', '011', '020', '021'])
+        self.assertEqual(
+            set(people.matching().values_list('family', flat=True)),
+            {'000', '001', '010', '011', '020', '021'},
+        )
+
+
+class TestAirportIndex(TestCase):
+    def setUp(self):
+        self.index = AirportIndex([
+            (1, 0.0, 0.0),
+            (2, 0.0, 10.0),
+            (3, 10.0, 179.5),
+            (4, 10.0, -179.5),
+            (5, 89.0, 0.0),
+            (6, 89.0, 180.0),
+            (7, -45.0, 90.0),
+        ])
+
+    def pks(self, results):
+        return [pk for _, pk in results]
+
+    def test_within(self):
+        self.assertEqual(self.pks(self.index.within(0, 1, 200)), [1])
+        self.assertEqual(self.pks(self.index.within(0, 1, 1200)), [1, 2])
+        self.assertEqual(self.pks(self.index.within(0, 1, 0)), [])
+
+    def test_within_antimeridian(self):
+        """Airports on the other side of 180th meridian are close."""
+        self.assertEqual(self.pks(self.index.within(10, 179.9, 200)),
+                         [3, 4])
+        self.assertEqual(self.pks(self.index.within(10, -179.9, 200)),
+                         [4, 3])
+
+    def test_within_pole(self):
+        """Airports on the opposite sides of the North Pole are close."""
+        self.assertEqual(self.pks(self.index.within(89.5, 90, 300)), [5, 6])
+
+    def test_nearest(self):
+        self.assertEqual(self.pks(self.index.nearest(0, 4, k=1)), [1])
+        self.assertEqual(self.pks(self.index.nearest(0, 4, k=2)), [1, 2])
+        # far away from all airports
+        self.assertEqual(self.pks(self.index.nearest(-50, 100, k=1)), [7])
+        self.assertEqual(len(self.index.nearest(0, 0, k=100)), 7)
+
+    def test_nearest_within_radius(self):
+        self.assertEqual(
+            self.pks(self.index.nearest(0, 4, k=5, radius=1000)), [1, 2])
+        self.assertEqual(self.index.nearest(-50, 100, k=5, radius=500), [])
+
+    def test_rebuilt_after_airport_changes(self):
+        airport = Airport.objects.create(iata='AAA', fullname='Airport',
+                                         latitude=0, longitude=0)
+        self.assertEqual(self.pks(airport_index().within(0, 0, 10)),
+                         [airport.pk])
+
+        airport.latitude = 30
+        airport.save()
+        self.assertEqual(airport_index().within(0, 0, 10), [])
+
+        airport.delete()
+        self.assertEqual(airport_index().within(30, 0, 10), [])
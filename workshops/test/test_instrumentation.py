@@ -0,0 +1,157 @@
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from ..instrumentation import (
+    QueryInstrumentationMiddleware,
+    fingerprint,
+    view_stats,
+)
+from ..models import (
+    Event,
+    Person,
+    Role,
+    Task,
+    TrainingProgress,
+    TrainingRequirement,
+)
+from .base import TestBase
+
+
+class TestQueryInstrumentation(TestBase):
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+        self._setUpRoles()
+        self._setUpEvents()
+        view_stats.reset()
+
+    def test_fingerprint(self):
+        """Ensure queries differing only in whitespace or lengths of
+        parameters lists have the same fingerprint."""
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT *  FROM t\nWHERE id IN (%s)'),
+        )
+
+    def test_recording_request(self):
+        """Ensure queries run during a request are recorded and added to view
+        statistics."""
+        response = self.client.get(reverse('all_persons'))
+        stats = response.wsgi_request.query_stats
+        self.assertEqual(stats.view_name, 'all_persons')
+        self.assertGreater(stats.queries, 0)
+        self.assertEqual(stats.queries, sum(stats.fingerprints.values()))
+
+        self.client.get(reverse('all_persons'))
+        totals = view_stats.totals['all_persons']
+        self.assertEqual(totals['requests'], 2)
+        self.assertEqual(totals['queries'], 2 * stats.queries)
+
+    def test_recording_streamed_content(self):
+        """Ensure queries run while streaming response's content are
+        recorded, and recording stops when the response is closed."""
+        def rows():
+            for pk in [1, 2, 3]:
+                yield str(Person.objects.filter(pk=pk).exists())
+
+        def view(request):
+            # called by the handler before the view
+            middleware.process_view(request, match.func, (), {})
+            return StreamingHttpResponse(rows())
+
+        match = resolve(reverse('all_persons'))
+        middleware = QueryInstrumentationMiddleware(view)
+        request = RequestFactory().get(reverse('all_persons'))
+        request.resolver_match = match
+        response = middleware(request)
+        stats = request.query_stats
+        self.assertEqual(stats.queries, 0)
+
+        b''.join(response)
+        self.assertEqual(stats.queries, 3)
+        self.assertEqual(view_stats.totals, {})
+
+        response.close()
+        self.assertEqual(view_stats.totals['all_persons']['queries'], 3)
+        self.assertEqual(connection.execute_wrappers, [])
+        Person.objects.exists()
+        self.assertEqual(stats.queries, 3)
+
+    def test_duplicates(self):
+        """Ensure repeated queries are counted as duplicates."""
+        response = self.client.get(reverse('all_persons'))
+        stats = response.wsgi_request.query_stats
+        stats.fingerprints.clear()
+        for pk in [1, 2, 3]:
+            stats(lambda *args: None, 'SELECT 1 WHERE id = %s', [pk],
+                  False, {})
+        self.assertEqual(stats.duplicates, 2)
+        self.assertEqual(stats.most_repeated(),
+                         [('SELECT 1 WHERE id = %s', 3)])
+
+    def test_stats_endpoint(self):
+        """Ensure statistics are exposed in Prometheus text format."""
+        self.client.get(reverse('event_details',
+                                args=['ends-tomorrow-ongoing']))
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode('utf-8')
+        self.assertIn('amy_view_requests_total{view="event_details"} 1',
+                      content)
+        self.assertIn('amy_view_query_budget{view="event_details"} 15',
+                      content)
+
+    def test_stats_endpoint_for_admins_only(self):
+        self.client.logout()
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response.status_code, 302)
+
+
+class TestQueryBudgets(TestBase):
+    """Ensure the number of queries run by views prone to N+1 queries stays
+    within their budgets, also with many related objects."""
+
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+        self._setUpRoles()
+        self._setUpEvents()
+        self._setUpTags()
+
+        self.event = Event.objects.get(slug='ends-tomorrow-ongoing')
+        learner = Role.objects.get(name='learner')
+        training = TrainingRequirement.objects.get(name='Training')
+        for i in range(20):
+            person = Person.objects.create(
+                personal='Trainee', family=str(i),
+                username='trainee_{}'.format(i),
+                email='trainee{}@example.org'.format(i),
+            )
+            Task.objects.create(event=self.event, person=person,
+                                role=learner)
+            TrainingProgress.objects.create(trainee=person,
+                                            requirement=training, state='p')
+        Task.objects.create(
+            event=Event.objects.get(slug='starts-today-ongoing'),
+            person=self.hermione, role=learner,
+        )
+
+    def test_event_details(self):
+        response = self.client.get(reverse('event_details',
+                                           args=[self.event.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+    def test_person_details(self):
+        response = self.client.get(reverse('person_details',
+                                           args=[self.hermione.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+    def test_all_trainees(self):
+        response = self.client.get(reverse('all_trainees'))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
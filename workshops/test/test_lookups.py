@@ -1,7 +1,12 @@
+from unittest.mock import patch
+
+from django.test import RequestFactory
 from django.urls import reverse
 
 from .base import TestBase
-from ..lookups import urlpatterns
+from ..lookups import OrganizationLookupView, PersonLookupView, urlpatterns
+from ..models import Airport, Organization, Person
+from ..search import LRUCache, rebuild_index
 
 
 class TestLookups(TestBase):
@@ -26,3 +31,94 @@ class TestLookups(TestBase):
         for pattern in self.urlpatterns:
             rv = self.client.get(reverse(pattern.name))
             self.assertEqual(rv.status_code, 200, pattern.name)  # OK
+
+
+class TestCachedLookups(TestBase):
+    """Test suite for ranking, limiting and caching lookups' results."""
+
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+
+    def lookup(self, name, q):
+        rv = self.client.get(reverse(name), {'q': q})
+        self.assertEqual(rv.status_code, 200)
+        return [result['text'] for result in rv.json()['results']]
+
+    def test_prefix_matches_first(self):
+        Organization.objects.create(domain='zeta-alpha.org',
+                                    fullname='Zeta Alpha')
+        self.assertEqual(self.lookup('organization-lookup', 'alph')[0],
+                         str(self.org_alpha))
+
+    def test_results_limited(self):
+        Organization.objects.bulk_create([
+            Organization(domain='org{}.com'.format(i),
+                         fullname='Org {}'.format(i))
+            for i in range(10)
+        ])
+        rebuild_index()
+        with patch.object(OrganizationLookupView, 'max_results', 3):
+            rv = self.client.get(reverse('organization-lookup'),
+                                 {'q': 'org'})
+        self.assertEqual(len(rv.json()['results']), 3)
+        self.assertFalse(rv.json()['pagination']['more'])
+
+    def test_results_cached(self):
+        self.assertEqual(self.lookup('airport-lookup', 'AAA'),
+                         [str(self.airport_0_0)])
+
+        # changes made without signals are not noticed
+        Airport.objects.filter(pk=self.airport_0_0.pk).update(iata='QQQ')
+        self.assertEqual(self.lookup('airport-lookup', 'AAA'),
+                         [str(self.airport_0_0)])
+
+        # cache is dropped when any indexed object changes
+        self.airport_0_50.save()
+        self.assertEqual(self.lookup('airport-lookup', 'AAA'), [])
+
+    def test_short_queries(self):
+        """Ensure one- and two-character queries match beginnings of
+        words."""
+        self.assertEqual(self.lookup('airport-lookup', 'AA'),
+                         [str(self.airport_0_0)])
+        self.assertIn(str(self.org_alpha),
+                      self.lookup('organization-lookup', 'al'))
+        # "ph" is inside of "alpha", not at its beginning
+        self.assertNotIn(str(self.org_alpha),
+                         self.lookup('organization-lookup', 'ph'))
+
+    def test_cache_key_depends_on_add_permission(self):
+        """Ensure users who can't add objects don't get cached responses
+        with an option to create them."""
+        factory = RequestFactory()
+        view = PersonLookupView(create_field='personal', q='Her')
+        other = Person.objects.create_user(
+            username='other', personal='Other', family='User',
+            email='other@example.org', password='other')
+
+        def key(user):
+            request = factory.get(reverse('person-lookup'), {'q': 'Her'})
+            request.user = user
+            return view.get_cache_key(request)
+
+        self.assertNotEqual(key(self.admin), key(other))
+        # views without `create_field` don't check permissions at all
+        request = factory.get(reverse('person-lookup'), {'q': 'Her'})
+        request.user = other
+        self.assertFalse(PersonLookupView(q='Her').get_cache_key(request)[-1])
+
+    def test_lru_cache(self):
+        cache = LRUCache(size=2, timeout=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # 'b' was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        cache.timeout = -1
+        cache.set('d', 4)
+        self.assertIsNone(cache.get('d'))
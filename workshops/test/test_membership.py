@@ -1,6 +1,8 @@
 from datetime import timedelta, date
 import itertools
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from .base import TestBase
@@ -173,3 +175,56 @@ class TestMembership(TestBase):
         self.assertEqual(
             self.current.seats_instructor_training_remaining, 18
         )
+
+    def test_annotated_usage(self):
+        """Ensure usage annotations have the same values as properties
+        calculated for a single membership."""
+        membership = Membership.objects.annotate_with_usage() \
+                                       .get(pk=self.current.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                membership.workshops_without_admin_fee_completed, 4)
+            self.assertEqual(membership.self_organized_workshops_completed, 8)
+            self.assertEqual(membership.seats_instructor_training_utilized, 10)
+            self.assertEqual(
+                membership.seats_instructor_training_remaining, 18)
+
+    def test_memberships_list_queries(self):
+        """Ensure number of queries for memberships list doesn't depend on
+        number of memberships."""
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('all_memberships'))
+            self.assertEqual(response.status_code, 200)
+            return len(context)
+
+        before = count_queries()
+        for org in [self.org_alpha, self.org_beta]:
+            Membership.objects.create(
+                variant='partner', agreement_start=self.agreement_start,
+                agreement_end=self.agreement_end,
+                contribution_type='financial', organization=org,
+            )
+        self.assertEqual(count_queries(), before)
+
+    def test_membership_details_queries(self):
+        """Ensure number of queries for membership details doesn't depend on
+        number of tasks using membership's seats."""
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    reverse('membership_details', args=[self.current.pk]))
+            self.assertEqual(response.status_code, 200)
+            return len(context)
+
+        count_queries()  # fill content types cache
+        before = count_queries()
+        for i in range(3):
+            event = Event.objects.create(
+                slug='another-training-{}'.format(i), host=self.org_beta,
+                start=self.agreement_start,
+            )
+            Task.objects.create(event=event, person=self.admin,
+                                role=self.learner,
+                                seat_membership=self.current)
+        self.assertEqual(count_queries(), before)
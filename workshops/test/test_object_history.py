@@ -0,0 +1,144 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from reversion import revisions as reversion
+from reversion.models import Version
+
+from ..models import ObjectHistory, Organization
+from ..object_history import rebuild_object_history, stale_object_history
+from .base import TestBase
+
+
+class TestObjectHistory(TestBase):
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+
+        with reversion.create_revision():
+            reversion.set_user(self.admin)
+            self.org = Organization.objects.create(domain='example.org',
+                                                   fullname='Example')
+
+    def history(self, obj):
+        return ObjectHistory.objects.get(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=str(obj.pk),
+        )
+
+    def edit(self, obj, fullname, user=None):
+        with reversion.create_revision():
+            if user:
+                reversion.set_user(user)
+            obj.fullname = fullname
+            obj.save()
+
+    def render(self, obj):
+        return Template('{% load revisions %}{% last_modified obj %}') \
+            .render(Context({'obj': obj}))
+
+    def test_history_recorded(self):
+        created = Version.objects.get_for_object(self.org).get()
+        history = self.history(self.org)
+        self.assertEqual(history.created_version, created)
+        self.assertEqual(history.created_at, created.revision.date_created)
+        self.assertEqual(history.created_by, self.admin)
+        self.assertIsNone(history.last_modified_version)
+        self.assertIsNone(history.last_modified_at)
+
+        self.edit(self.org, 'Example Organization')
+        self.edit(self.org, 'Example Org', user=self.admin)
+        latest = Version.objects.get_for_object(self.org)[0]
+        history = self.history(self.org)
+        self.assertEqual(history.created_version, created)
+        self.assertEqual(history.last_modified_version, latest)
+        self.assertEqual(history.last_modified_at,
+                         latest.revision.date_created)
+        self.assertEqual(history.last_modified_by, self.admin)
+
+    def test_last_modified_tag(self):
+        self.assertIn('Last modified on: not available.',
+                      self.render(self.org))
+
+        self.edit(self.org, 'Example Organization')
+        content = self.render(self.org)
+        self.assertIn('Created on', content)
+        self.assertIn(self.admin.full_name, content)
+        self.assertIn('Last modified on', content)
+        self.assertIn('by unknown user.', content)
+
+        # objects without versions
+        org = Organization.objects.create(domain='other.org',
+                                          fullname='Other')
+        self.assertIn('Created on: not available.', self.render(org))
+
+    def test_last_modified_tag_constant_queries(self):
+        """Ensure the number of queries doesn't depend on the number of
+        versions."""
+        self.edit(self.org, 'Example 1')
+        with CaptureQueriesContext(connection) as ctx:
+            self.render(self.org)
+        queries = len(ctx.captured_queries)
+
+        for i in range(2, 10):
+            self.edit(self.org, 'Example {}'.format(i))
+        with CaptureQueriesContext(connection) as ctx:
+            self.render(self.org)
+        self.assertEqual(len(ctx.captured_queries), queries)
+        self.assertLessEqual(queries, 1)
+
+    def test_rebuild(self):
+        other = Organization.objects.create(domain='other.org',
+                                            fullname='Other')
+        self.edit(other, 'Other Organization')
+        self.edit(other, 'Other Org')
+        self.edit(self.org, 'Example Organization')
+        expected = {
+            (history.content_type_id, history.object_id): (
+                history.created_version_id, history.created_at,
+                history.last_modified_version_id, history.last_modified_at,
+            )
+            for history in ObjectHistory.objects.all()
+        }
+
+        # wrong, missing and orphaned histories
+        ObjectHistory.objects.filter(object_id=str(self.org.pk)) \
+                             .update(last_modified_version=None)
+        ObjectHistory.objects.filter(object_id=str(other.pk)).delete()
+        ObjectHistory.objects.create(
+            content_type=ContentType.objects.get_for_model(Organization),
+            object_id='12345', created_at=self.history(self.org).created_at,
+        )
+        stale, orphaned = stale_object_history()
+        self.assertEqual(len(stale), 2)
+        self.assertEqual(len(orphaned), 1)
+
+        self.assertEqual(rebuild_object_history(), 3)
+        self.assertEqual(stale_object_history(), ([], []))
+        self.assertEqual(expected, {
+            (history.content_type_id, history.object_id): (
+                history.created_version_id, history.created_at,
+                history.last_modified_version_id, history.last_modified_at,
+            )
+            for history in ObjectHistory.objects.all()
+        })
+
+    def test_command(self):
+        """Ensure the command reports wrong histories with `--check` and
+        fixes them otherwise."""
+        ObjectHistory.objects.all().delete()
+
+        with redirect_stdout(StringIO()) as output:
+            with self.assertRaises(CommandError):
+                call_command('rebuild_object_history', check=True)
+        self.assertIn('#{}:'.format(self.org.pk), output.getvalue())
+
+        with redirect_stdout(StringIO()):
+            call_command('rebuild_object_history')
+            call_command('rebuild_object_history', check=True)
+        self.assertEqual(self.history(self.org).created_by, self.admin)
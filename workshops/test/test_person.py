@@ -19,7 +19,7 @@ from ..models import (
     Organization, Language,
     Tag, TrainingRequirement, TrainingProgress
 )
-from .base import TestBase
+from .base import TestBase, run_on_commit_callbacks
 
 
 @patch('workshops.github_auth.github_username_to_uid', lambda username: None)
@@ -38,6 +38,30 @@ class TestPerson(TestBase):
         user = authenticate(username=email, password='admin')
         self.assertEqual(user, self.admin)
 
+    def test_persons_list_keyset_pagination(self):
+        """Ensure persons list is paginated by cursors, and following them
+        shows every person once, in order."""
+        url = reverse('all_persons')
+        response = self.client.get(url, {'items_per_page': 2})
+        page = response.context['all_persons']
+        self.assertTrue(page.is_keyset)
+        seen = list(page)
+        while page.has_next():
+            response = self.client.get(url, {'items_per_page': 2,
+                                             'after': page.next_cursor})
+            page = response.context['all_persons']
+            seen.extend(page)
+        self.assertEqual(
+            seen, list(Person.objects.order_by('family', 'personal', 'pk')),
+        )
+
+    def test_persons_list_numbered_pages(self):
+        """Ensure requesting page by number still works."""
+        url = reverse('all_persons')
+        response = self.client.get(url, {'items_per_page': 2, 'page': 2})
+        page = response.context['all_persons']
+        self.assertEqual(page.number, 2)
+
     def test_display_person_correctly_with_all_fields(self):
         response = self.client.get(
             reverse('person_details', args=[str(self.hermione.id)]))
@@ -865,6 +889,22 @@ class TestPersonMerging(TestBase):
         rv = self.client.post(self.url, data=self.strategy)
         self.assertEqual(rv.status_code, 302)
 
+    def test_merging_updates_role_counts(self):
+        """Merging: ensure role counts of the base person include tasks moved
+        from the other person."""
+        self.person_b.task_set.create(
+            event=Event.objects.get(slug='starts-today-ongoing'),
+            role=Role.objects.get(name='helper'),
+        )
+        self.strategy['task_set'] = 'combine'
+
+        rv = self.client.post(self.url, data=self.strategy)
+        self.assertEqual(rv.status_code, 302)
+
+        self.person_b.refresh_from_db()
+        self.assertEqual(self.person_b.num_taught, 1)
+        self.assertEqual(self.person_b.num_helper, 1)
+
 
 def github_username_to_uid_mock(username):
     username2uid = {
@@ -956,37 +996,39 @@ class TestGetMissingSWCInstructorRequirements(TestBase):
         self.dc_demo = TrainingRequirement.objects.get(name='DC Demo')
 
     def test_all_requirements_satisfied(self):
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.training)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.swc_homework)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.discussion)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.swc_demo)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.training)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.swc_homework)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.discussion)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.swc_demo)
 
         person = Person.objects.annotate_with_instructor_eligibility() \
                                .get(username='person')
         self.assertEqual(person.get_missing_swc_instructor_requirements(), [])
 
     def test_some_requirements_are_fulfilled(self):
-        # Homework was accepted, the second time.
-        TrainingProgress.objects.create(trainee=self.person, state='f',
-                                        requirement=self.swc_homework)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.swc_homework)
-        # Dc-demo records should be ignored
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.dc_demo)
-        # Not passed progress should be ignored.
-        TrainingProgress.objects.create(trainee=self.person, state='f',
-                                        requirement=self.swc_demo)
-        TrainingProgress.objects.create(trainee=self.person, state='n',
-                                        requirement=self.discussion)
-        # Passed discarded progress should be ignored.
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.training,
-                                        discarded=True)
+        with run_on_commit_callbacks():
+            # Homework was accepted, the second time.
+            TrainingProgress.objects.create(trainee=self.person, state='f',
+                                            requirement=self.swc_homework)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.swc_homework)
+            # Dc-demo records should be ignored
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.dc_demo)
+            # Not passed progress should be ignored.
+            TrainingProgress.objects.create(trainee=self.person, state='f',
+                                            requirement=self.swc_demo)
+            TrainingProgress.objects.create(trainee=self.person, state='n',
+                                            requirement=self.discussion)
+            # Passed discarded progress should be ignored.
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.training,
+                                            discarded=True)
 
         person = Person.objects.annotate_with_instructor_eligibility() \
             .get(username='person')
@@ -1012,38 +1054,40 @@ class TestGetMissingDCInstructorRequirements(TestBase):
         self.dc_demo = TrainingRequirement.objects.get(name='DC Demo')
 
     def test_all_requirements_satisfied(self):
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.training)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.training)
 
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.dc_homework)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.discussion)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.dc_demo)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.dc_homework)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.discussion)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.dc_demo)
 
         person = Person.objects.annotate_with_instructor_eligibility() \
                                .get(username='person')
         self.assertEqual(person.get_missing_dc_instructor_requirements(), [])
 
     def test_some_requirements_are_fulfilled(self):
-        # Homework was accepted, the second time.
-        TrainingProgress.objects.create(trainee=self.person, state='f',
-                                        requirement=self.dc_homework)
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.dc_homework)
-        # Swc-demo should be ignored
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.swc_demo)
-        # Not passed progress should be ignored.
-        TrainingProgress.objects.create(trainee=self.person, state='f',
-                                        requirement=self.dc_demo)
-        TrainingProgress.objects.create(trainee=self.person, state='n',
-                                        requirement=self.discussion)
-        # Passed discarded progress should be ignored.
-        TrainingProgress.objects.create(trainee=self.person, state='p',
-                                        requirement=self.training,
-                                        discarded=True)
+        with run_on_commit_callbacks():
+            # Homework was accepted, the second time.
+            TrainingProgress.objects.create(trainee=self.person, state='f',
+                                            requirement=self.dc_homework)
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.dc_homework)
+            # Swc-demo should be ignored
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.swc_demo)
+            # Not passed progress should be ignored.
+            TrainingProgress.objects.create(trainee=self.person, state='f',
+                                            requirement=self.dc_demo)
+            TrainingProgress.objects.create(trainee=self.person, state='n',
+                                            requirement=self.discussion)
+            # Passed discarded progress should be ignored.
+            TrainingProgress.objects.create(trainee=self.person, state='p',
+                                            requirement=self.training,
+                                            discarded=True)
 
         person = Person.objects.annotate_with_instructor_eligibility() \
                                .get(username='person')
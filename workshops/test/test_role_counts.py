@@ -0,0 +1,164 @@
+from contextlib import redirect_stdout
+from io import StringIO
+
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Event, Person, Role, Task
+from ..role_counts import rebuild_role_counts, stale_role_counts
+from ..util import create_uploaded_persons_tasks
+from .base import TestBase, run_on_commit_callbacks
+
+
+class TestRoleCounts(TestBase):
+    def setUp(self):
+        super().setUp()
+        self._setUpRoles()
+        self._setUpEvents()
+
+        self.instructor = Role.objects.get(name='instructor')
+        self.helper = Role.objects.get(name='helper')
+        self.learner = Role.objects.get(name='learner')
+        self.event_a = Event.objects.get(slug='ends-tomorrow-ongoing')
+        self.event_b = Event.objects.get(slug='starts-today-ongoing')
+
+    def counts(self, person):
+        person.refresh_from_db()
+        return (person.num_taught, person.num_helper, person.num_organizer,
+                person.num_learner)
+
+    def test_counts_follow_created_and_deleted_tasks(self):
+        """Ensure role counts change when tasks are added or removed."""
+        self.assertEqual(self.counts(self.hermione), (0, 0, 0, 0))
+
+        with run_on_commit_callbacks():
+            task = Task.objects.create(event=self.event_a,
+                                       person=self.hermione,
+                                       role=self.instructor)
+            Task.objects.create(event=self.event_b, person=self.hermione,
+                                role=self.instructor)
+            Task.objects.create(event=self.event_b, person=self.hermione,
+                                role=self.learner)
+        self.assertEqual(self.counts(self.hermione), (2, 0, 0, 1))
+
+        with run_on_commit_callbacks():
+            task.delete()
+        self.assertEqual(self.counts(self.hermione), (1, 0, 0, 1))
+
+    def test_counts_follow_changed_tasks(self):
+        """Ensure changing task's role or person updates counts of both old
+        and new person."""
+        with run_on_commit_callbacks():
+            task = Task.objects.create(event=self.event_a,
+                                       person=self.hermione,
+                                       role=self.instructor)
+
+        with run_on_commit_callbacks():
+            task.role = self.helper
+            task.save()
+        self.assertEqual(self.counts(self.hermione), (0, 1, 0, 0))
+
+        with run_on_commit_callbacks():
+            task.person = self.harry
+            task.save()
+        self.assertEqual(self.counts(self.hermione), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.harry), (0, 1, 0, 0))
+
+    def test_saving_person_keeps_counts(self):
+        """Ensure saving a person loaded before their tasks changed doesn't
+        overwrite the counts."""
+        person = Person.objects.get(pk=self.ron.pk)
+        with run_on_commit_callbacks():
+            Task.objects.create(event=self.event_a, person=self.ron,
+                                role=self.instructor)
+
+        person.notes = 'Taught once'
+        person.save()
+        self.assertEqual(self.counts(self.ron), (1, 0, 0, 0))
+
+    def test_counts_updated_once_per_transaction(self):
+        """Ensure saving a loaded task doesn't query for its previous person,
+        and that counts are recalculated once, when the transaction is
+        committed."""
+        with run_on_commit_callbacks():
+            task = Task.objects.create(event=self.event_a,
+                                       person=self.hermione,
+                                       role=self.instructor)
+        task = Task.objects.get(pk=task.pk)
+
+        with patch('workshops.role_counts.update_role_counts') as update:
+            with run_on_commit_callbacks():
+                task.person = self.harry
+                with CaptureQueriesContext(connection) as queries:
+                    task.save()
+                Task.objects.create(event=self.event_b, person=self.ron,
+                                    role=self.learner)
+                update.assert_not_called()
+
+        selects = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT "workshops_task"')]
+        self.assertEqual(selects, [])
+        update.assert_called_once_with(
+            {self.hermione.pk, self.harry.pk, self.ron.pk},
+        )
+
+    def test_copied_person_has_no_counts(self):
+        """Ensure a person saved as a copy of another one doesn't inherit
+        their counts."""
+        Task.objects.create(event=self.event_a, person=self.ron,
+                            role=self.instructor)
+        person = Person.objects.get(pk=self.ron.pk)
+        person.pk = None
+        person.username = 'copy_of_ron'
+        person.email = 'copy@ron.com'
+        person.github = None
+        person.save()
+        self.assertEqual(self.counts(person), (0, 0, 0, 0))
+
+    def test_bulk_upload_updates_counts(self):
+        """Ensure tasks created from uploaded data (without signals) are
+        counted."""
+        data = [{
+            'personal': 'Ron', 'family': 'Weasley', 'email': self.ron.email,
+            'username': self.ron.username, 'event': self.event_a.slug,
+            'role': 'helper', 'person_exists': True,
+            'existing_person_id': self.ron.pk, 'errors': None,
+        }]
+        create_uploaded_persons_tasks(data)
+        self.assertEqual(self.counts(self.ron), (0, 1, 0, 0))
+
+    def test_rebuilding_fixes_stale_counts(self):
+        """Ensure only wrong counts are found and fixed."""
+        Task.objects.create(event=self.event_a, person=self.hermione,
+                            role=self.instructor)
+        Person.objects.filter(pk=self.hermione.pk).update(num_taught=0)
+        Person.objects.filter(pk=self.harry.pk).update(num_learner=3)
+
+        stale = stale_role_counts()
+        self.assertEqual(
+            {pk for pk, _, _ in stale}, {self.hermione.pk, self.harry.pk},
+        )
+
+        self.assertEqual(rebuild_role_counts(), 2)
+        self.assertEqual(self.counts(self.hermione), (1, 0, 0, 0))
+        self.assertEqual(self.counts(self.harry), (0, 0, 0, 0))
+        self.assertEqual(stale_role_counts(), [])
+
+    def test_command(self):
+        """Ensure the command reports wrong counts with `--check` and fixes
+        them otherwise."""
+        Person.objects.filter(pk=self.harry.pk).update(num_helper=2)
+
+        with redirect_stdout(StringIO()) as output:
+            with self.assertRaises(CommandError):
+                call_command('rebuild_role_counts', check=True)
+        self.assertIn('Person {}:'.format(self.harry.pk), output.getvalue())
+
+        with redirect_stdout(StringIO()):
+            call_command('rebuild_role_counts')
+            call_command('rebuild_role_counts', check=True)
+        self.assertEqual(self.counts(self.harry), (0, 0, 0, 0))
@@ -1,6 +1,20 @@
+from django.db.models import Q
 from django.urls import reverse
 
-from ..models import Organization, Person, TrainingRequest
+from ..models import (
+    Event,
+    Organization,
+    Person,
+    SearchTrigram,
+    TrainingRequest,
+)
+from ..search import (
+    prefixes,
+    rebuild_index,
+    search,
+    term_entries,
+    trigrams,
+)
 from .base import TestBase
 
 
@@ -114,3 +128,114 @@ class TestSearchOrganization(TestBase):
         # do not search in_persons, otherwise it'd redirect to Harry Potter's profile
         response = self.search_for('Potter', in_training_requests=True)
         self.assertEqual(len(response.context['training_requests']), 0)
+
+
+class TestSearchIndex(TestBase):
+    """Test cases for keeping search index up-to-date and using it."""
+
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+
+    def search(self, model, term, q):
+        return list(search(model.objects.all(), term, q))
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('Ab  abcd'), {'abc', 'bcd'})
+        self.assertEqual(trigrams(None), set())
+
+    def test_prefixes(self):
+        self.assertEqual(prefixes('Ab  c abcd'), {'a', 'ab', 'c'})
+        self.assertEqual(prefixes(None), set())
+
+    def test_term_entries(self):
+        """Short words of a term are looked up as prefixes."""
+        self.assertEqual(term_entries('Jo abcd'), {'jo', 'abc', 'bcd'})
+        self.assertEqual(term_entries('Jo abcd', False), {'abc', 'bcd'})
+        self.assertEqual(term_entries(''), set())
+
+    def test_short_words_as_prefixes(self):
+        def search_org(term):
+            return list(search(Organization.objects.all(), term,
+                               Q(fullname__icontains=term),
+                               short_words_as_prefixes=True))
+
+        self.assertEqual(search_org('al'), [self.org_alpha])
+        self.assertEqual(search_org('ph'), [])
+        # without index entries the organization can't be found
+        SearchTrigram.objects.filter(
+            model='organization', object_id=self.org_alpha.pk).delete()
+        self.assertEqual(search_org('al'), [])
+        # by default short words are matched without the index
+        self.assertEqual(self.search(Organization, 'ph',
+                                     Q(fullname__icontains='ph')),
+                         [self.org_alpha])
+
+    def test_index_updated(self):
+        """Index follows changes of the object."""
+        q = Q(fullname__icontains='Gamma')
+        self.assertEqual(self.search(Organization, 'Gamma', q), [])
+
+        self.org_alpha.fullname = 'Gamma Organization'
+        self.org_alpha.save()
+        self.assertEqual(self.search(Organization, 'Gamma', q),
+                         [self.org_alpha])
+
+        self.org_alpha.fullname = 'Alpha Organization'
+        self.org_alpha.save()
+        self.assertEqual(self.search(Organization, 'Gamma', q), [])
+
+        self.assertTrue(SearchTrigram.objects.filter(
+            model='organization', object_id=self.org_alpha.pk).exists())
+        self.org_alpha.delete()
+        self.assertFalse(SearchTrigram.objects.filter(
+            model='organization', object_id=self.org_alpha.pk).exists())
+
+    def test_events_reindexed_after_host_changes(self):
+        event = Event.objects.create(slug='2018-01-01-event',
+                                     host=self.org_beta)
+        q = Q(host__fullname__icontains='Gamma')
+        self.org_beta.fullname = 'Gamma Organization'
+        self.org_beta.save()
+        self.assertEqual(self.search(Event, 'Gamma', q), [event])
+
+    def test_rebuild_index(self):
+        entries = set(SearchTrigram.objects.values_list(
+            'model', 'object_id', 'trigram'))
+        SearchTrigram.objects.all().delete()
+        rebuild_index()
+        self.assertEqual(
+            set(SearchTrigram.objects.values_list(
+                'model', 'object_id', 'trigram')),
+            entries,
+        )
+
+    def test_results_ranked(self):
+        """Organizations with exact or prefix match come first."""
+        notes = Organization.objects.create(
+            domain='notes.org', fullname='Notes', notes='Mentions beta.com')
+        prefix = Organization.objects.create(
+            domain='beta.com.au', fullname='Beta Australia')
+        response = self.client.get(reverse('search'),
+                                   {'term': 'beta.com',
+                                    'in_organizations': 'on'})
+        self.assertEqual(response.context['organizations'],
+                         [self.org_beta, prefix, notes])
+
+
+class TestLookupsUseSearchIndex(TestBase):
+    def setUp(self):
+        super().setUp()
+        self._setUpUsersAndLogin()
+
+    def test_person_lookup(self):
+        # drop index entries, so that the lookup can't find anyone
+        SearchTrigram.objects.filter(model='person',
+                                     object_id=self.hermione.pk).delete()
+        rv = self.client.get(reverse('person-lookup'), {'q': 'Hermione'})
+        self.assertEqual(rv.json()['results'], [])
+
+        rebuild_index()
+        rv = self.client.get(reverse('person-lookup'), {'q': 'Hermione'})
+        self.assertEqual([r['id'] for r in rv.json()['results']],
+                         [str(self.hermione.pk)])
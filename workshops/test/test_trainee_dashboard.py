@@ -5,6 +5,7 @@ from django.urls import reverse
 from workshops.models import Person, Award, Badge, TrainingProgress, \
     TrainingRequirement
 from workshops.test import TestBase
+from workshops.test.base import run_on_commit_callbacks
 
 
 class TestTraineeDashboard(TestBase):
@@ -39,25 +40,28 @@ class TestInstructorStatus(TestBase):
         """When the trainee is awarded both Carpentry Instructor badge,
         we want to display that info in the dashboard."""
 
-        Award.objects.create(person=self.admin, badge=self.swc_instructor,
-                             awarded=datetime(2016, 6, 1, 15, 00))
-        Award.objects.create(person=self.admin, badge=self.dc_instructor,
-                             awarded=datetime(2016, 6, 1, 15, 00))
+        with run_on_commit_callbacks():
+            Award.objects.create(person=self.admin, badge=self.swc_instructor,
+                                 awarded=datetime(2016, 6, 1, 15, 00))
+            Award.objects.create(person=self.admin, badge=self.dc_instructor,
+                                 awarded=datetime(2016, 6, 1, 15, 00))
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Congratulations, you\'re certified both '
                                 'Software Carpentry and Data Carpentry '
                                 'Instructor!')
 
     def test_swc_instructor(self):
-        Award.objects.create(person=self.admin, badge=self.swc_instructor,
-                             awarded=datetime(2016, 6, 1, 15, 00))
+        with run_on_commit_callbacks():
+            Award.objects.create(person=self.admin, badge=self.swc_instructor,
+                                 awarded=datetime(2016, 6, 1, 15, 00))
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Congratulations, you\'re certified '
                                 'Software Carpentry Instructor!')
 
     def test_dc_instructor(self):
-        Award.objects.create(person=self.admin, badge=self.dc_instructor,
-                             awarded=datetime(2016, 6, 1, 15, 00))
+        with run_on_commit_callbacks():
+            Award.objects.create(person=self.admin, badge=self.dc_instructor,
+                                 awarded=datetime(2016, 6, 1, 15, 00))
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Congratulations, you\'re certified '
                                 'Data Carpentry Instructor!')
@@ -80,10 +84,12 @@ class TestInstructorStatus(TestBase):
         yet."""
         requirements = ['Training', 'SWC Homework', 'DC Homework',
                         'Discussion', 'SWC Demo', 'DC Demo']
-        for requirement in requirements:
-            TrainingProgress.objects.create(
-                trainee=self.admin,
-                requirement=TrainingRequirement.objects.get(name=requirement))
+        with run_on_commit_callbacks():
+            for requirement in requirements:
+                requirement = TrainingRequirement.objects.get(
+                    name=requirement)
+                TrainingProgress.objects.create(trainee=self.admin,
+                                                requirement=requirement)
 
         admin = Person.objects.annotate_with_instructor_eligibility() \
                               .get(username='admin')
@@ -111,28 +117,32 @@ class TestInstructorTrainingStatus(TestBase):
         self.progress_url = reverse('training-progress')
 
     def test_training_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.training)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.training)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Training passed')
 
     def test_training_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.training, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.training, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Training not passed yet')
 
     def test_last_training_discarded_but_another_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.training)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.training, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.training)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.training, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Training passed')
 
     def test_training_failed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.training, state='f')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.training, state='f')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Training not passed yet')
 
@@ -155,28 +165,32 @@ class TestSWCHomeworkStatus(TestBase):
         self.assertContains(rv, 'SWC Homework not submitted yet')
 
     def test_homework_waiting_to_be_evaluated(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, state='n')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, state='n')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Homework not evaluated yet')
 
     def test_homework_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Homework accepted')
 
     def test_homework_not_accepted_when_homework_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Homework not submitted yet')
 
     def test_homework_is_accepted_when_last_homework_is_discarded_but_other_one_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Homework accepted')
 
@@ -215,28 +229,32 @@ class TestDCHomeworkStatus(TestBase):
         self.assertContains(rv, 'DC Homework not submitted yet')
 
     def test_homework_waiting_to_be_evaluated(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, state='n')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, state='n')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Homework not evaluated yet')
 
     def test_homework_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Homework accepted')
 
     def test_homework_not_accepted_when_homework_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Homework not submitted yet')
 
     def test_homework_is_accepted_when_last_homework_is_discarded_but_other_one_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.homework, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.homework, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Homework accepted')
 
@@ -272,28 +290,34 @@ class TestDiscussionSessionStatus(TestBase):
         self.progress_url = reverse('training-progress')
 
     def test_session_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.discussion)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.discussion)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Discussion Session passed')
 
     def test_session_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.discussion, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.discussion,
+                discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Discussion Session not passed yet')
 
     def test_last_session_discarded_but_another_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.discussion)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.discussion, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.discussion)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.discussion,
+                discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Discussion Session passed')
 
     def test_session_failed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.discussion, state='f')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.discussion, state='f')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'Discussion Session not passed yet')
 
@@ -314,31 +338,35 @@ class TestDemoSessionStatus(TestBase):
         self.progress_url = reverse('training-progress')
 
     def test_swc_session_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Demo Session passed')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_swc_session_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Demo Session not passed yet')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_swc_last_session_discarded_but_another_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Demo Session passed')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_swc_session_failed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo, state='f')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo, state='f')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Demo Session not passed yet')
         self.assertContains(rv, 'Register for Demo Session on')
@@ -349,31 +377,35 @@ class TestDemoSessionStatus(TestBase):
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_dc_session_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Demo Session passed')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_dc_session_passed_but_discarded(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Demo Session not passed yet')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_dc_last_session_discarded_but_another_is_passed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo, discarded=True)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo, discarded=True)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Demo Session passed')
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_dc_session_failed(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo, state='f')
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo, state='f')
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'DC Demo Session not passed yet')
         self.assertContains(rv, 'Register for Demo Session on')
@@ -384,10 +416,11 @@ class TestDemoSessionStatus(TestBase):
         self.assertContains(rv, 'Register for Demo Session on')
 
     def test_no_registration_instruction_when_trainee_passed_both_swc_and_dc_sessions(self):
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.swc_demo)
-        TrainingProgress.objects.create(
-            trainee=self.admin, requirement=self.dc_demo)
+        with run_on_commit_callbacks():
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.swc_demo)
+            TrainingProgress.objects.create(
+                trainee=self.admin, requirement=self.dc_demo)
         rv = self.client.get(self.progress_url)
         self.assertContains(rv, 'SWC Demo Session passed')
         self.assertContains(rv, 'DC Demo Session passed')
@@ -1,8 +1,17 @@
 from datetime import datetime
+from unittest.mock import patch
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from workshops.eligibility import rebuild_eligibility
+from workshops.forms import BulkDiscardProgressesForm
 from workshops.models import (
+    Award,
+    Badge,
+    InstructorEligibility,
+    Person,
     TrainingProgress,
     TrainingRequirement,
     Event,
@@ -10,7 +19,7 @@ from workshops.models import (
     Tag,
     Role,
 )
-from workshops.test.base import TestBase
+from workshops.test.base import TestBase, run_on_commit_callbacks
 
 
 class TestTraineesView(TestBase):
@@ -94,3 +103,149 @@ class TestTraineesView(TestBase):
         self.assertTrue(ironman_progress.discarded)
         blackwidow_progress.refresh_from_db()
         self.assertFalse(blackwidow_progress.discarded)
+
+    def test_bulk_add_progress_requires_training_tasks(self):
+        """Ensure trainees without a training task are found with a constant
+        number of queries."""
+        learner = Role.objects.get(name='learner')
+        self.spiderman.task_set.create(event=self.ttt_event, role=learner)
+        data = {
+            'trainees': [self.spiderman.pk, self.ironman.pk],
+            'requirement': self.discussion.pk,
+            'state': 'f',
+            'submit': '',
+        }
+        rv = self.client.post(reverse('all_trainees'), data)
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn("without any training task",
+                      str(rv.context['form'].non_field_errors()))
+        self.assertFalse(TrainingProgress.objects.exists())
+
+    def test_bulk_discard_progress_too_many_trainees(self):
+        form = BulkDiscardProgressesForm({
+            'trainees': [self.spiderman.pk, self.ironman.pk],
+            'discard': '',
+        })
+        form.fields['trainees'].max_ids = 1
+        self.assertFalse(form.is_valid())
+        self.assertIn('trainees', form.errors)
+
+    def pass_all_requirements(self, trainee):
+        with run_on_commit_callbacks():
+            for name in ['Training', 'SWC Homework', 'Discussion',
+                         'DC Demo']:
+                TrainingProgress.objects.create(
+                    trainee=trainee, state='p',
+                    requirement=TrainingRequirement.objects.get(name=name))
+
+    def test_eligibility_follows_progress_and_awards(self):
+        """Ensure eligibility records change with training progresses and
+        awards."""
+        self.assertFalse(
+            InstructorEligibility.objects.filter(person=self.spiderman)
+                                         .exists())
+
+        with run_on_commit_callbacks():
+            progress = TrainingProgress.objects.create(
+                trainee=self.spiderman, requirement=self.training, state='n')
+        self.assertFalse(
+            InstructorEligibility.objects.filter(person=self.spiderman)
+                                         .exists())
+
+        with run_on_commit_callbacks():
+            progress.state = 'p'
+            progress.save()
+        eligibility = InstructorEligibility.objects.get(person=self.spiderman)
+        self.assertTrue(eligibility.passed_training)
+        self.assertFalse(eligibility.instructor_eligible)
+        self.assertEqual(eligibility.get_missing_requirements(),
+                         ['SWC or DC Homework', 'Discussion',
+                          'SWC or DC Demo'])
+
+        self.pass_all_requirements(self.spiderman)
+        eligibility.refresh_from_db()
+        self.assertTrue(eligibility.instructor_eligible)
+        self.assertFalse(eligibility.is_swc_instructor)
+
+        with run_on_commit_callbacks():
+            award = Award.objects.create(
+                person=self.spiderman,
+                badge=Badge.objects.get(name='swc-instructor'))
+        eligibility.refresh_from_db()
+        self.assertTrue(eligibility.is_swc_instructor)
+
+        with run_on_commit_callbacks():
+            award.delete()
+            TrainingProgress.objects.filter(trainee=self.spiderman).delete()
+        self.assertFalse(
+            InstructorEligibility.objects.filter(person=self.spiderman)
+                                         .exists())
+
+    def test_eligibility_updated_once_per_transaction(self):
+        """Ensure saving a loaded progress doesn't query for its previous
+        trainee, and that eligibility is recalculated once, when the
+        transaction is committed."""
+        with run_on_commit_callbacks():
+            progress = TrainingProgress.objects.create(
+                trainee=self.spiderman, requirement=self.training, state='p')
+        progress = TrainingProgress.objects.get(pk=progress.pk)
+
+        with patch('workshops.eligibility.update_eligibility') as update:
+            with run_on_commit_callbacks():
+                progress.trainee = self.ironman
+                with CaptureQueriesContext(connection) as queries:
+                    progress.save()
+                Award.objects.create(
+                    person=self.blackwidow,
+                    badge=Badge.objects.get(name='swc-instructor'))
+                update.assert_not_called()
+
+        self.assertEqual(len(queries), 1)
+        update.assert_called_once_with(
+            {self.spiderman.pk, self.ironman.pk, self.blackwidow.pk},
+        )
+
+    def test_bulk_discard_progress_updates_eligibility(self):
+        self.pass_all_requirements(self.spiderman)
+        data = {
+            'trainees': [self.spiderman.pk],
+            'discard': '',
+        }
+        self.client.post(reverse('all_trainees'), data, follow=True)
+
+        self.assertFalse(
+            InstructorEligibility.objects.filter(person=self.spiderman)
+                                         .exists())
+
+    def test_filtering_by_eligibility(self):
+        """Ensure "eligible" instructor status returns only trainees who
+        passed all requirements and don't have an instructor badge yet."""
+        learner = Role.objects.get(name='learner')
+        for trainee in [self.spiderman, self.ironman, self.blackwidow]:
+            trainee.task_set.create(event=self.ttt_event, role=learner)
+        self.pass_all_requirements(self.spiderman)
+        self.pass_all_requirements(self.ironman)
+        with run_on_commit_callbacks():
+            Award.objects.create(
+                person=self.ironman,
+                badge=Badge.objects.get(name='dc-instructor'))
+
+        rv = self.client.get(reverse('all_trainees'),
+                             {'is_instructor': 'eligible'})
+        self.assertEqual(list(rv.context['all_trainees']), [self.spiderman])
+
+        rv = self.client.get(reverse('all_trainees'),
+                             {'is_instructor': 'no'})
+        self.assertEqual(set(rv.context['all_trainees']),
+                         {self.spiderman, self.blackwidow})
+
+    def test_rebuilding_eligibility(self):
+        self.pass_all_requirements(self.spiderman)
+        InstructorEligibility.objects.all().delete()
+
+        rebuild_eligibility()
+        spiderman = Person.objects.annotate_with_instructor_eligibility() \
+                                  .get(pk=self.spiderman.pk)
+        self.assertTrue(spiderman.instructor_eligible)
+        self.assertEqual(spiderman.get_missing_swc_instructor_requirements(),
+                         [])
@@ -1,13 +1,18 @@
+from contextlib import redirect_stdout
+from io import StringIO
 import unittest
 from urllib.parse import urlencode
 
 from django.core import mail
 from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.db.models.signals import post_save
 from django.template import Context
 from django.template import Template
 from django.urls import reverse
 
-from .base import TestBase
+from .base import TestBase, run_on_commit_callbacks
 from ..models import (
     Person,
     Role,
@@ -18,6 +23,7 @@ from ..models import (
     Task,
     KnowledgeDomain,
 )
+from ..scoring import stale_scores, update_scores
 
 
 class TestTrainingRequestForm(TestBase):
@@ -188,12 +194,15 @@ class TestTrainingRequestModelScoring(TestBase):
         `TrainingRequest.domains` field."""
         # test adding a domain
         domain = KnowledgeDomain.objects.get(name='Humanities')
-        self.tr.domains.add(domain)
+        with run_on_commit_callbacks():
+            self.tr.domains.add(domain)
+        self.tr.refresh_from_db()
         self.assertEqual(self.tr.score_auto, 1)
 
         # test removing a domain
-        # domain.trainingrequest_set.remove(self.tr)
-        self.tr.domains.remove(domain)
+        with run_on_commit_callbacks():
+            self.tr.domains.remove(domain)
+        self.tr.refresh_from_db()
         self.assertEqual(len(self.tr.domains.all()), 0)
         self.assertEqual(self.tr.score_auto, 0)
 
@@ -202,22 +211,49 @@ class TestTrainingRequestModelScoring(TestBase):
             'Humanities', 'Library and information science',
             'Economics/business', 'Social sciences',
         ])
-        self.tr.domains.set(domains)
+        with run_on_commit_callbacks():
+            self.tr.domains.set(domains)
+        self.tr.refresh_from_db()
         self.assertEqual(self.tr.score_auto, 1)
 
+        # test clearing domains
+        with run_on_commit_callbacks():
+            self.tr.domains.clear()
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 0)
+
     def test_previous_involvement(self):
         """Ensure m2m_changed signals work correctly on
         `TrainingRequest.previous_involvement` field."""
         roles = Role.objects.all()
-        self.tr.previous_involvement.add(roles[0])
-        self.assertEqual(self.tr.score_auto, 1)
-        self.tr.previous_involvement.add(roles[1])
+        for i, score in enumerate([1, 2, 3, 3]):
+            with run_on_commit_callbacks():
+                self.tr.previous_involvement.add(roles[i])
+            self.tr.refresh_from_db()
+            # previous involvement scoring max's out at 3
+            self.assertEqual(self.tr.score_auto, score)
+
+    def test_reverse_m2m_changes(self):
+        """Ensure changing the relations from the other side (e.g.
+        `KnowledgeDomain.trainingrequest_set`) updates the score too."""
+        domain = KnowledgeDomain.objects.get(name='Humanities')
+        role = Role.objects.first()
+
+        with run_on_commit_callbacks():
+            domain.trainingrequest_set.add(self.tr)
+            role.trainingrequest_set.add(self.tr)
+        self.tr.refresh_from_db()
         self.assertEqual(self.tr.score_auto, 2)
-        self.tr.previous_involvement.add(roles[2])
-        self.assertEqual(self.tr.score_auto, 3)
-        self.tr.previous_involvement.add(roles[3])
-        # previous involvement scoring max's out at 3
-        self.assertEqual(self.tr.score_auto, 3)
+
+        with run_on_commit_callbacks():
+            domain.trainingrequest_set.remove(self.tr)
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 1)
+
+        with run_on_commit_callbacks():
+            role.trainingrequest_set.clear()
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 0)
 
     def test_previous_training_in_teaching(self):
         """Go through all options in `previous_training` and ensure only some
@@ -255,6 +291,105 @@ class TestTrainingRequestModelScoring(TestBase):
             else:
                 self.assertEqual(self.tr.score_auto, 0)
 
+    def test_rescored_once_per_transaction(self):
+        """Ensure many M2M changes in a transaction save the request (only
+        its score) once, when the transaction is committed."""
+        roles = Role.objects.all()
+        saves = []
+
+        def receiver(sender, **kwargs):
+            saves.append((kwargs['instance'].pk, kwargs['update_fields']))
+
+        post_save.connect(receiver, sender=TrainingRequest)
+        self.addCleanup(post_save.disconnect, receiver,
+                        sender=TrainingRequest)
+
+        with run_on_commit_callbacks():
+            self.tr.domains.add(KnowledgeDomain.objects.get(name='Humanities'))
+            for role in roles[:3]:
+                self.tr.previous_involvement.add(role)
+            self.assertEqual(saves, [])
+        self.assertEqual(saves, [(self.tr.pk, {'score_auto'})])
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 4)
+
+        # nothing's saved if the score doesn't change
+        with run_on_commit_callbacks():
+            self.tr.previous_involvement.add(roles[3])
+        self.assertEqual(len(saves), 1)
+
+    def test_not_rescored_after_rollback(self):
+        with run_on_commit_callbacks():
+            try:
+                with transaction.atomic():
+                    self.tr.domains.add(
+                        KnowledgeDomain.objects.get(name='Humanities'))
+                    raise ValueError
+            except ValueError:
+                pass
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 0)
+
+    def test_bulk_scoring_matches_instance_scoring(self):
+        """Ensure scores calculated in the database are the same as
+        calculated for single requests."""
+        self.tr.country = 'W3'
+        self.tr.underresourced = True
+        self.tr.previous_experience = 'ta'
+        self.tr.save()
+        with run_on_commit_callbacks():
+            self.tr.domains.add(
+                KnowledgeDomain.objects.get(name='Humanities'))
+            self.tr.previous_involvement.set(Role.objects.all())
+        other = TrainingRequest.objects.create(
+            personal='Jane', family='Doe', email='jane@doe.com',
+            country='PL', previous_training='full',
+            programming_language_usage_frequency='daily',
+        )
+        other.domains.add(KnowledgeDomain.objects.get(name='Chemistry'))
+
+        TrainingRequest.objects.update(score_auto=0)
+        self.assertEqual(
+            stale_scores(),
+            [(self.tr.pk, 0, 7), (other.pk, 0, 2)],
+        )
+        self.assertEqual(update_scores(), 2)
+        self.assertEqual(stale_scores(), [])
+        for tr in TrainingRequest.objects.all():
+            self.assertEqual(tr.score_auto, tr.recalculate_score_auto())
+        # nothing changes the second time
+        self.assertEqual(update_scores(), 0)
+
+    def test_command(self):
+        """Ensure the command reports wrong scores with `--check` and fixes
+        them otherwise."""
+        TrainingRequest.objects.filter(pk=self.tr.pk).update(score_auto=5)
+
+        with redirect_stdout(StringIO()) as output:
+            with self.assertRaises(CommandError):
+                call_command('rescore_training_requests', check=True)
+        self.assertIn('Training request {}:'.format(self.tr.pk),
+                      output.getvalue())
+
+        with redirect_stdout(StringIO()):
+            call_command('rescore_training_requests')
+            call_command('rescore_training_requests', check=True)
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 0)
+
+    def test_admin_action(self):
+        TrainingRequest.objects.filter(pk=self.tr.pk).update(score_auto=5)
+        self._setUpUsersAndLogin()
+        rv = self.client.post(
+            reverse('admin:workshops_trainingrequest_changelist'),
+            {'action': 'recalculate_score_auto',
+             '_selected_action': [self.tr.pk]},
+            follow=True,
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.tr.refresh_from_db()
+        self.assertEqual(self.tr.score_auto, 0)
+
 
 class TestTrainingRequestsListView(TestBase):
     def setUp(self):
@@ -2,14 +2,19 @@
 import datetime
 
 from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.db.models import F
 from django.http import Http404
 from django.test import RequestFactory
+from django.utils import timezone
 
 import requests_mock
+from reversion.models import Revision
 
 from ..models import Organization, Event, Role, Person, Task, Badge, Award
 from ..util import (
     fetch_event_metadata,
+    fetch_website,
     generate_url_to_event_index,
     find_metadata_on_event_homepage,
     find_metadata_on_event_website,
@@ -21,6 +26,10 @@ from ..util import (
     create_username,
     InternalError,
     Paginator,
+    KeysetPaginator,
+    InvalidCursor,
+    cached_count,
+    encode_cursor,
     assign,
     str2bool,
     human_daterange,
@@ -96,6 +105,41 @@ Other content.
         metadata = fetch_event_metadata(website_url)
         self.assertEqual(metadata['slug'], 'workshop')
 
+    @requests_mock.Mocker()
+    def test_fetching_website_revalidates_cached_page(self, mock):
+        """Ensure pages with ETag are requested conditionally and unchanged
+        pages are read from the cache."""
+        caches['websites'].clear()
+        website_url = 'https://pbanaszkiewicz.github.io/workshop-etag'
+        mock.get(website_url, text=self.html_content, status_code=200,
+                 headers={'ETag': '"v1"'})
+        self.assertEqual(fetch_website(website_url), self.html_content)
+        self.assertNotIn('If-None-Match', mock.last_request.headers)
+
+        mock.get(website_url, text='', status_code=304)
+        metadata = fetch_event_metadata(website_url)
+        self.assertEqual(mock.last_request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(metadata['slug'], '2015-07-13-test')
+
+        # page changed
+        mock.get(website_url, text='changed', status_code=200,
+                 headers={'ETag': '"v2"'})
+        self.assertEqual(fetch_website(website_url), 'changed')
+        mock.get(website_url, text='', status_code=304)
+        self.assertEqual(fetch_website(website_url), 'changed')
+        self.assertEqual(mock.last_request.headers['If-None-Match'], '"v2"')
+
+    @requests_mock.Mocker()
+    def test_fetching_website_without_validators(self, mock):
+        """Ensure pages without ETag or Last-Modified aren't cached."""
+        caches['websites'].clear()
+        website_url = 'https://pbanaszkiewicz.github.io/workshop-no-etag'
+        mock.get(website_url, text=self.html_content, status_code=200)
+        fetch_website(website_url)
+        fetch_website(website_url)
+        self.assertNotIn('If-None-Match', mock.last_request.headers)
+        self.assertNotIn('If-Modified-Since', mock.last_request.headers)
+
     def test_generating_url_to_index(self):
         tests = [
             'http://swcarpentry.github.io/workshop-template',
@@ -717,6 +761,97 @@ class TestPaginatorSections(TestBase):
         )
 
 
+class TestKeysetPaginator(TestBase):
+    def setUp(self):
+        super().setUp()
+        self._setUpEvents()
+        # two events without start date, which are ordered first
+        host = Organization.objects.first()
+        Event.objects.create(slug='no-start-1', host=host)
+        Event.objects.create(slug='no-start-2', host=host)
+        self.events = Event.objects.all()
+        self.ordering = ('-start', '-pk')
+        self.expected = list(
+            self.events.order_by(F('start').desc(nulls_last=True), '-pk')
+        )
+        caches['default'].clear()
+
+    def test_forward_traversal(self):
+        """Ensure following `after` cursors lists all objects in order, also
+        across NULL values."""
+        paginator = KeysetPaginator(self.events, 3, self.ordering)
+        page = paginator.page()
+        self.assertFalse(page.has_previous())
+        result = list(page)
+        while page.has_next():
+            page = paginator.page(after=page.next_cursor)
+            self.assertTrue(page.has_previous())
+            result.extend(page)
+        self.assertEqual(result, self.expected)
+
+    def test_backward_traversal(self):
+        """Ensure following `before` cursors from the end lists all objects in
+        order."""
+        paginator = KeysetPaginator(self.events, 3, self.ordering)
+        last = paginator.cursor(self.expected[-1])
+        page = paginator.page(before=last)
+        result = list(page)
+        while page.has_previous():
+            page = paginator.page(before=page.previous_cursor)
+            self.assertTrue(page.has_next())
+            result = list(page) + result
+        self.assertEqual(result + self.expected[-1:], self.expected)
+
+    def test_sub_millisecond_keys(self):
+        """Ensure datetimes differing by less than a millisecond are paged
+        correctly in both directions."""
+        base = datetime.datetime(2018, 1, 1, 12, tzinfo=timezone.utc)
+        for i in range(4):
+            Revision.objects.create(
+                date_created=base - datetime.timedelta(microseconds=i * 100),
+                comment=str(i),
+            )
+        paginator = KeysetPaginator(Revision.objects.all(), 2,
+                                    ('-date_created', '-pk'))
+
+        first = paginator.page()
+        self.assertEqual([r.comment for r in first], ['0', '1'])
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual([r.comment for r in second], ['2', '3'])
+        self.assertFalse(second.has_next())
+        previous = paginator.page(before=second.previous_cursor)
+        self.assertEqual([r.comment for r in previous], ['0', '1'])
+        self.assertFalse(previous.has_previous())
+        self.assertTrue(previous.has_next())
+
+    def test_backward_page_has_next(self):
+        """Ensure a page found with `before` cursor has no next page if
+        objects following it are gone."""
+        paginator = KeysetPaginator(self.events, 3, self.ordering)
+        cursor = paginator.cursor(self.expected[3])
+        self.assertTrue(paginator.page(before=cursor).has_next())
+        Event.objects.filter(pk__in=[e.pk for e in self.expected[3:]]) \
+                     .delete()
+        self.assertFalse(paginator.page(before=cursor).has_next())
+
+    def test_invalid_cursor(self):
+        """Ensure malformed cursors are rejected."""
+        paginator = KeysetPaginator(self.events, 3, self.ordering)
+        for cursor in ['!!!', 'e30=', encode_cursor([1, 2, 3])]:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginator.page(after=cursor)
+
+    def test_cached_count(self):
+        """Ensure the number of objects is counted once and then taken from
+        cache."""
+        self.assertEqual(cached_count(self.events), len(self.expected))
+        Event.objects.filter(slug='no-start-1').delete()
+        self.assertEqual(cached_count(self.events), len(self.expected))
+        caches['default'].clear()
+        self.assertEqual(cached_count(self.events), len(self.expected) - 1)
+
+
 class TestAssignUtil(TestBase):
     def setUp(self):
         """Set up RequestFactory for making fast fake requests."""
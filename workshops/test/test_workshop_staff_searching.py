@@ -2,8 +2,8 @@ import unittest
 
 from django.urls import reverse
 
-from .base import TestBase
-from ..models import Task, Role, Event, Tag, Organization
+from .base import TestBase, run_on_commit_callbacks
+from ..models import Airport, Task, Role, Event, Tag, Organization, Person
 
 
 class TestLocateWorkshopStaff(TestBase):
@@ -32,6 +32,65 @@ class TestLocateWorkshopStaff(TestBase):
         self.assertIn(self.ironman, response.context['persons'])
         self.assertIn(self.blackwidow, response.context['persons'])
 
+    def test_ordered_by_distance(self):
+        """Ensure people from airports closer to searched location come
+        first."""
+        response = self.client.get(
+            reverse('workshop_staff'),
+            {'latitude': 56, 'longitude': 106, 'submit': 'Submit'}
+        )
+        self.assertEqual(response.status_code, 200)
+        persons = list(response.context['persons'])
+        # Spiderman lives at airport 55x105, Ron and Ironman at 50x100
+        self.assertEqual(persons[0], self.spiderman)
+        self.assertEqual(set(persons[1:3]), {self.ron, self.ironman})
+
+    def test_ordered_by_distance_paginated(self):
+        """Ensure later pages continue the ordering by distance."""
+        persons = []
+        for page in (1, 2, 3):
+            response = self.client.get(
+                reverse('workshop_staff'),
+                {'latitude': 56, 'longitude': 106, 'items_per_page': 1,
+                 'page': page, 'submit': 'Submit'}
+            )
+            self.assertEqual(response.status_code, 200)
+            persons += list(response.context['persons'])
+        self.assertEqual(persons[0], self.spiderman)
+        self.assertEqual(set(persons[1:3]), {self.ron, self.ironman})
+
+    def test_match_within_radius(self):
+        """Ensure only people from airports within specified distance are
+        returned."""
+        response = self.client.get(
+            reverse('workshop_staff'),
+            {'airport': self.airport_0_0.pk, 'radius': 1200,
+             'submit': 'Submit'}
+        )
+        self.assertEqual(response.status_code, 200)
+        persons = set(response.context['persons'])
+        # airport 0x10 is ~1100 km away, but nobody lives there
+        expected = set(Person.objects.filter(airport=self.airport_0_0))
+        self.assertEqual(persons, expected)
+
+    def test_filters_applied_before_distance(self):
+        """Ensure people matching other criteria are found even if many
+        airports are closer to searched location."""
+        Airport.objects.bulk_create([
+            Airport(iata='X{:02d}'.format(i), fullname='Airport {}'.format(i),
+                    country='PL', latitude=0, longitude=i / 100)
+            for i in range(150)
+        ])
+        response = self.client.get(
+            reverse('workshop_staff'),
+            {'latitude': 0.001, 'longitude': 0.001, 'lessons': [self.git.pk],
+             'submit': 'Submit'}
+        )
+        self.assertEqual(response.status_code, 200)
+        persons = list(response.context['persons'])
+        # Hermione lives at airport 0x0, Ron at 50x100
+        self.assertEqual(persons, [self.hermione, self.ron])
+
     def test_match_on_one_skill(self):
         """Ensure people with correct skill are returned."""
         response = self.client.get(
@@ -197,10 +256,11 @@ class TestLocateWorkshopStaff(TestBase):
         helper_role = Role.objects.get(name='helper')
         organizer_role = Role.objects.get(name='organizer')
 
-        Task.objects.create(role=helper_role, person=self.spiderman,
-                            event=Event.objects.first())
-        Task.objects.create(role=organizer_role, person=self.blackwidow,
-                            event=Event.objects.first())
+        with run_on_commit_callbacks():
+            Task.objects.create(role=helper_role, person=self.spiderman,
+                                event=Event.objects.first())
+            Task.objects.create(role=organizer_role, person=self.blackwidow,
+                                event=Event.objects.first())
 
         response = self.client.get(
             reverse('workshop_staff'),
@@ -220,6 +280,26 @@ class TestLocateWorkshopStaff(TestBase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(list(response.context['persons']), [self.blackwidow])
 
+    def test_trainee_matched_once(self):
+        """Ensure trainees enrolled in many TTT events aren't returned many
+        times."""
+        TTT = Tag.objects.get(name='TTT')
+        learner = Role.objects.get(name='learner')
+        for slug in ['first-TTT-event', 'second-TTT-event']:
+            event = Event.objects.create(slug=slug,
+                                         host=Organization.objects.first())
+            event.tags.set([TTT])
+            Task.objects.create(person=self.blackwidow, event=event,
+                                role=learner)
+
+        response = self.client.get(
+            reverse('workshop_staff'),
+            {'is_in_progress_trainee': 'on',
+             'submit': 'Submit'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['persons']), [self.blackwidow])
+
     def test_form_logic(self):
         """Check if logic preventing searching from multiple fields,
         except lat+lng pair, and allowing searching from no location field,
@@ -232,6 +312,10 @@ class TestLocateWorkshopStaff(TestBase):
             (False, {'latitude': 1, 'longitude': 2, 'country': ['BG']}),
             (False, {'latitude': 1, 'longitude': 2, 'country': ['BG'],
                      'airport': self.airport_0_0.pk}),
+            (True, {'airport': self.airport_0_0.pk, 'radius': 100}),
+            (True, {'latitude': 1, 'longitude': 2, 'radius': 100}),
+            (False, {'radius': 100}),
+            (False, {'country': ['BG'], 'radius': 100}),
         ]
 
         for form_pass, data in test_vectors:
@@ -134,6 +134,7 @@ urlpatterns = [
         url(r'^instructor_issues/$', views.instructor_issues, name='instructor_issues'),
         url(r'^duplicate_persons/$', views.duplicate_persons, name='duplicate_persons'),
         url(r'^duplicate_training_requests/$', views.duplicate_training_requests, name='duplicate_training_requests'),
+        url(r'^query_stats/$', views.query_stats, name='query_stats'),
     ])),
 
     url(r'^version/(?P<version_id>[\d]+)/$', views.object_changes, name='object_changes'),
@@ -1,12 +1,20 @@
 # coding: utf-8
+import base64
+import binascii
+import collections.abc
 import csv
 import datetime
+import hashlib
+import json
+import operator
 import re
+import threading
 from collections import namedtuple, defaultdict
-from functools import wraps
+from functools import reduce, wraps
 from itertools import chain
 
 import requests
+import reversion
 import yaml
 from django.contrib.auth.decorators import (
     user_passes_test,
@@ -14,19 +22,22 @@ from django.contrib.auth.decorators import (
 )
 from django.conf import settings
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import caches
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import (
     EmptyPage,
     PageNotAnInteger,
     Paginator as DjangoPaginator,
 )
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import ValidationError
 from django.db import IntegrityError, transaction, models
-from django.db.models import Q
+from django.db.models import F, Q
 from django.http import Http404
 from django.http.response import HttpResponse
 from django.http.response import HttpResponseForbidden
 from django.shortcuts import render, redirect
+from django.utils.functional import cached_property
 from django.utils.http import is_safe_url
 
 from workshops.models import (
@@ -39,6 +50,9 @@ from workshops.models import (
     STR_MED,
     STR_LONG,
 )
+from workshops.duplicates import update_keys
+from workshops.role_counts import update_role_counts
+from workshops.search import index_objects, lookup_cache
 
 ITEMS_PER_PAGE = 25
 
@@ -47,6 +61,9 @@ SIMPLE_EMAIL = re.compile(r'^\S+@\S+\.\S+$')
 
 NUM_TRIES = 100
 
+# number of rows of bulk-uploaded persons verified or created together
+UPLOAD_BATCH_SIZE = 200
+
 ALLOWED_METADATA_NAMES = [
     'slug', 'startdate', 'enddate', 'country', 'venue', 'address',
     'latlng', 'language', 'eventbrite', 'instructor', 'helper', 'contact',
@@ -102,15 +119,86 @@ def upload_person_task_csv(stream):
     return result, list(empty_fields)
 
 
+def _group_by(objects, attr):
+    """Dictionary of lists of `objects` with the same value of `attr`."""
+    result = defaultdict(list)
+    for obj in objects:
+        result[getattr(obj, attr)].append(obj)
+    return result
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
 def verify_upload_person_task(data, match=False):
     """
     Verify that uploaded data is correct.  Show errors by populating `errors`
     dictionary item.  This function changes `data` in place.
 
     If `match` provided, it will try to match with first similar person.
+
+    Rows are verified in batches of `UPLOAD_BATCH_SIZE`; everything a batch
+    refers to (events, roles, persons, usernames, tasks) is fetched up front
+    with a few queries.
     """
 
     errors_occur = False
+    # usernames given to new persons in previous batches
+    reserved_usernames = set()
+    for i in range(0, len(data), UPLOAD_BATCH_SIZE):
+        batch = data[i:i + UPLOAD_BATCH_SIZE]
+        if _verify_upload_batch(batch, match, reserved_usernames):
+            errors_occur = True
+    return errors_occur
+
+
+def _verify_upload_batch(data, match, reserved_usernames):
+    """Verify a batch of uploaded rows, see `verify_upload_person_task`."""
+    events = _group_by(
+        Event.objects.filter(slug__in={item.get('event') for item in data
+                                       if item.get('event')}),
+        'slug',
+    )
+    roles = _group_by(
+        Role.objects.filter(name__in={item.get('role') for item in data
+                                      if item.get('role')}),
+        'name',
+    )
+
+    # persons referenced by email, ID or username
+    emails = {item.get('email') for item in data if item.get('email')}
+    person_ids = {_int_or_none(item.get('existing_person_id'))
+                  for item in data}
+    person_ids.discard(None)
+    usernames = {item.get('username') for item in data if item.get('username')}
+    persons = list(Person.objects.filter(
+        Q(email__in=emails) | Q(pk__in=person_ids) |
+        Q(username__in=usernames)
+    ))
+    persons_by_email = {p.email: p for p in persons}
+    persons_by_id = {p.pk: p for p in persons}
+    existing_usernames = {p.username for p in persons}
+    taken_usernames = set(existing_usernames)
+
+    # usernames that may collide with usernames generated for new persons
+    stems = {
+        username_stem(item.get('personal') or '', item.get('family') or '')
+        for item in data if not item.get('username')
+    }
+    if stems:
+        taken_usernames.update(
+            Person.objects.filter(
+                reduce(operator.or_, (Q(username__startswith=stem)
+                                      for stem in stems))
+            ).values_list('username', flat=True)
+        )
+    taken_usernames |= reserved_usernames
+
+    rows = []
     for item in data:
         errors = []
         info = []
@@ -118,26 +206,28 @@ def verify_upload_person_task(data, match=False):
         event = item.get('event', None)
         existing_event = None
         if event:
-            try:
-                existing_event = Event.objects.get(slug=event)
-            except Event.DoesNotExist:
+            found = events.get(event, [])
+            if not found:
                 errors.append('Event with slug "{0}" does not exist.'
                               .format(event))
-            except Event.MultipleObjectsReturned:
+            elif len(found) > 1:
                 errors.append('More than one event named "{0}" exists.'
                               .format(event))
+            else:
+                existing_event = found[0]
 
         role = item.get('role', None)
         existing_role = None
         if role:
-            try:
-                existing_role = Role.objects.get(name=role)
-            except Role.DoesNotExist:
+            found = roles.get(role, [])
+            if not found:
                 errors.append('Role with name "{0}" does not exist.'
                               .format(role))
-            except Role.MultipleObjectsReturned:
+            elif len(found) > 1:
                 errors.append('More than one role named "{0}" exists.'
                               .format(role))
+            else:
+                existing_role = found[0]
 
         # check if the user exists, and if so: check if existing user's
         # personal and family names are the same as uploaded
@@ -149,38 +239,27 @@ def verify_upload_person_task(data, match=False):
 
         # try to match with first similar person
         if match is True:
-            try:
-                person = Person.objects.get(email=email)
-            except Person.DoesNotExist:
-                person = None
-            else:
+            person = persons_by_email.get(email) if email else None
+            if person:
                 info.append('Existing record for person will be used.')
                 person_id = person.pk
 
         elif person_id:
-            try:
-                person = Person.objects.get(id=int(person_id))
-            except (ValueError, TypeError, Person.DoesNotExist):
-                person = None
+            person = persons_by_id.get(_int_or_none(person_id))
+            if person is None:
                 info.append('Could not match selected person. New record will '
                             'be created.')
             else:
                 info.append('Existing record for person will be used.')
 
         elif not person_id:
-            try:
-                Person.objects.get(email=email)
-            except Person.DoesNotExist:
-                pass
-            else:
+            if email and email in persons_by_email:
                 errors.append('Person with this email address already exists.')
 
-            try:
-                if item.get('username'):
-                    Person.objects.get(username=item.get('username'))
-            except Person.DoesNotExist:
-                pass
-            else:
+            # rows without username are reported too, because username will be
+            # generated only after that
+            username = item.get('username')
+            if not username or username in existing_usernames:
                 errors.append('Person with this username already exists.')
 
         if not email and not person:
@@ -197,34 +276,72 @@ def verify_upload_person_task(data, match=False):
         else:
             # force a newly created username
             if not item.get('username'):
-                item['username'] = create_username(personal, family)
+                item['username'] = create_username(personal, family,
+                                                   taken=taken_usernames)
+                taken_usernames.add(item['username'])
+                reserved_usernames.add(item['username'])
             item['person_exists'] = False
 
             info.append('Person and task will be created.')
 
-        # let's check if there's someone else named this way
-        similar_persons = Person.objects.filter(
-            Q(personal=personal, family=family) |
-            Q(email=email) & ~Q(email='') & Q(email__isnull=False)
-        )
-        # need to cast to list, otherwise it won't JSON-ify
-        item['similar_persons'] = list(
-            zip(
-                similar_persons.values_list('id', flat=True),
-                map(lambda x: str(x), similar_persons)
-            )
+        rows.append(dict(
+            item=item, errors=errors, info=info, event=existing_event,
+            role=existing_role, person=person, personal=personal,
+            family=family, email=email,
+        ))
+
+    # let's check if there's someone else named this way
+    similar_q = Q(email__in={row['email'] for row in rows if row['email']})
+    similar_q |= Q(
+        Q(family__in={row['family'] for row in rows}) |
+        Q(family__isnull=True),
+        personal__in={row['personal'] for row in rows},
+    )
+    similar_by_name = defaultdict(list)
+    similar_by_email = defaultdict(list)
+    for p in Person.objects.filter(similar_q):
+        similar_by_name[(p.personal, p.family)].append(p)
+        if p.email:
+            similar_by_email[p.email].append(p)
+
+    # person, their role and a corresponding event exist, so let's check if
+    # the task exists
+    complete = [row for row in rows
+                if row['event'] and row['person'] and row['role']]
+    existing_tasks = set()
+    if complete:
+        existing_tasks.update(
+            Task.objects.filter(
+                event__in={row['event'] for row in complete},
+                person__in={row['person'] for row in complete},
+                role__in={row['role'] for row in complete},
+            ).values_list('event_id', 'person_id', 'role_id')
         )
 
-        if existing_event and person and existing_role:
-            # person, their role and a corresponding event exist, so
-            # let's check if the task exists
-            try:
-                Task.objects.get(event=existing_event, person=person,
-                                 role=existing_role)
-            except Task.DoesNotExist:
-                info.append('Task will be created.')
-            else:
+    errors_occur = False
+    for row in rows:
+        item, errors, info = row['item'], row['errors'], row['info']
+        personal, family, email = row['personal'], row['family'], \
+            row['email']
+
+        similar_persons = {
+            p.pk: p
+            for p in similar_by_name.get((personal, family), []) +
+            (similar_by_email.get(email, []) if email else [])
+        }
+        # need to cast to list, otherwise it won't JSON-ify
+        item['similar_persons'] = [
+            (p.pk, str(p))
+            for p in sorted(similar_persons.values(),
+                            key=lambda p: (p.family or '', p.personal, p.pk))
+        ]
+
+        if row['event'] and row['person'] and row['role']:
+            key = (row['event'].pk, row['person'].pk, row['role'].pk)
+            if key in existing_tasks:
                 info.append('Task already exists.')
+            else:
+                info.append('Task will be created.')
 
         # let's check what Person model validators want to say
         try:
@@ -235,10 +352,10 @@ def verify_upload_person_task(data, match=False):
             for k, v in e.message_dict.items():
                 errors.append('{}: {}'.format(k, v))
 
-        if not role:
+        if not item.get('role'):
             errors.append('Must have a role.')
 
-        if not event:
+        if not item.get('event'):
             errors.append('Must have an event.')
 
         item['errors'] = errors
@@ -250,9 +367,35 @@ def verify_upload_person_task(data, match=False):
     return errors_occur
 
 
+def _upload_row_repr(row):
+    return ('{personal} {family} {username} <{email}>, '
+            '{role} at {event}').format(**row)
+
+
+def _bulk_create_rows(model, objects, rows):
+    """`bulk_create()` `objects` created from corresponding `rows`.  If that
+    fails, objects are saved one by one to find out which row caused the
+    error."""
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(objects)
+    except IntegrityError:
+        for obj, row in zip(objects, rows):
+            try:
+                with transaction.atomic():
+                    obj.save()
+            except IntegrityError as e:
+                raise IntegrityError('{0} (for "{1}")'.format(
+                    str(e), _upload_row_repr(row)))
+
+
 def create_uploaded_persons_tasks(data):
     """
     Create persons and tasks from upload data.
+
+    Events and roles are fetched once; persons and tasks are created with
+    `bulk_create()` in batches of `UPLOAD_BATCH_SIZE` rows, each batch in
+    a single revision.
     """
 
     # Quick sanity check.
@@ -261,62 +404,164 @@ def create_uploaded_persons_tasks(data):
 
     persons_created = []
     tasks_created = []
-    events = set()
 
     with transaction.atomic():
-        for row in data:
-            try:
-                row_repr = ('{personal} {family} {username} <{email}>, '
-                            '{role} at {event}').format(**row)
-
-                fields = {key: row[key] for key in Person.PERSON_UPLOAD_FIELDS}
-                fields['username'] = row['username']
+        events = Event.objects.in_bulk(
+            {row['event'] for row in data if row['event'] and row['role']},
+            field_name='slug',
+        )
+        roles = {role.name: role for role in Role.objects.filter(
+            name__in={row['role'] for row in data
+                      if row['event'] and row['role']}
+        )}
+        # events with new tasks
+        events_to_update = dict()
+
+        for i in range(0, len(data), UPLOAD_BATCH_SIZE):
+            batch = data[i:i + UPLOAD_BATCH_SIZE]
+            with reversion.create_revision():
+                persons, tasks = _create_uploaded_batch(batch, events, roles)
+                for obj in persons + tasks:
+                    reversion.add_to_revision(obj)
+            persons_created += persons
+            tasks_created += tasks
+            for task in tasks:
+                events_to_update[task.event_id] = task.event
+
+        # update search index and duplicate keys with new persons
+        if persons_created:
+            pks = [p.pk for p in persons_created]
+            index_objects(Person, pks)
+            lookup_cache.clear()
+            update_keys(Person, pks)
+
+        # tasks were created without sending signals
+        update_role_counts(t.person_id for t in tasks_created)
+
+        # trigger an update of the attendance field (see `Task.save()`)
+        for event in events_to_update.values():
+            event.save()
 
-                if row['person_exists'] and row['existing_person_id']:
-                    # we should use existing Person
-                    p = Person.objects.get(pk=row['existing_person_id'])
+    return persons_created, tasks_created
 
-                elif row['person_exists'] and not row['existing_person_id']:
-                    # we should use existing Person
-                    p = Person.objects.get(
-                        personal=fields['personal'], family=fields['family'],
-                        username=fields['username'], email=fields['email'],
-                    )
 
-                else:
-                    # we should create a new Person without any email provided
-                    p = Person(**fields)
-                    p.save()
-                    persons_created.append(p)
+def _create_uploaded_batch(data, events, roles):
+    """Create persons and tasks from a batch of upload data rows, see
+    `create_uploaded_persons_tasks`."""
+    existing_ids = {row['existing_person_id'] for row in data
+                    if row['person_exists'] and row['existing_person_id']}
+    existing_usernames = {
+        row['username'] for row in data
+        if row['person_exists'] and not row['existing_person_id']
+    }
+    existing = Person.objects.filter(Q(pk__in=existing_ids) |
+                                     Q(username__in=existing_usernames))
+    existing_by_id = {str(p.pk): p for p in existing}
+    existing_by_username = {p.username: p for p in existing_by_id.values()}
+
+    # person (or a new person's username) and event and role for every row
+    resolved = []
+    new_persons = []
+    new_persons_rows = []
+    for row in data:
+        try:
+            fields = {key: row[key] for key in Person.PERSON_UPLOAD_FIELDS}
+            fields['username'] = row['username']
 
-                if row['event'] and row['role']:
-                    e = Event.objects.get(slug=row['event'])
-                    r = Role.objects.get(name=row['role'])
+            if row['person_exists'] and row['existing_person_id']:
+                # we should use existing Person
+                p = existing_by_id.get(str(row['existing_person_id']))
 
-                    # if the number of learners attending the event changed,
-                    # we should update ``event.attendance``
-                    if row['role'] == 'learner':
-                        events.add(e)
+            elif row['person_exists'] and not row['existing_person_id']:
+                # we should use existing Person
+                p = existing_by_username.get(fields['username'])
+                if p and (p.personal, p.family, p.email) != (
+                        fields['personal'], fields['family'],
+                        fields['email']):
+                    p = None
 
-                    t, created = Task.objects.get_or_create(person=p, event=e,
-                                                            role=r)
-                    if created:
-                        tasks_created.append(t)
+            else:
+                # we should create a new Person without any email provided
+                p = Person(**fields)
+                p.normalize_fields()
+                new_persons.append(p)
+                new_persons_rows.append(row)
+
+            if p is None:
+                raise Person.DoesNotExist(
+                    'Person matching query does not exist.')
+
+            e = r = None
+            if row['event'] and row['role']:
+                e = events.get(row['event'])
+                if e is None:
+                    raise Event.DoesNotExist(
+                        'Event matching query does not exist.')
+                r = roles.get(row['role'])
+                if r is None:
+                    raise Role.DoesNotExist(
+                        'Role matching query does not exist.')
+
+        except ObjectDoesNotExist as e:
+            raise ObjectDoesNotExist('{0} (for "{1}")'.format(
+                str(e), _upload_row_repr(row)))
+
+        resolved.append((row, p, e, r))
+
+    _bulk_create_rows(Person, new_persons, new_persons_rows)
+    # primary keys aren't set by `bulk_create()` on every database
+    created = Person.objects.in_bulk([p.username for p in new_persons],
+                                     field_name='username')
+    persons_created = [created[p.username] for p in new_persons]
+
+    # tasks which exist already aren't created again
+    resolved = [
+        (row, created.get(p.username, p) if p.pk is None else p, e, r)
+        for row, p, e, r in resolved
+    ]
+    with_tasks = [(row, p, e, r) for row, p, e, r in resolved if e and r]
+    existing_tasks = set()
+    if with_tasks:
+        existing_tasks.update(Task.objects.filter(
+            person__in={p for _, p, _, _ in with_tasks},
+            event__in={e for _, _, e, _ in with_tasks},
+            role__in={r for _, _, _, r in with_tasks},
+        ).values_list('person_id', 'event_id', 'role_id'))
+
+    new_tasks = []
+    new_tasks_rows = []
+    for row, p, e, r in with_tasks:
+        key = (p.pk, e.pk, r.pk)
+        if key not in existing_tasks:
+            existing_tasks.add(key)
+            new_tasks.append(Task(person=p, event=e, role=r))
+            new_tasks_rows.append(row)
+
+    if not new_tasks:
+        return persons_created, []
+
+    _bulk_create_rows(Task, new_tasks, new_tasks_rows)
+    tasks = Task.objects.filter(
+        person__in={t.person for t in new_tasks},
+        event__in={t.event for t in new_tasks},
+        role__in={t.role for t in new_tasks},
+    ).select_related('event', 'person', 'role')
+    tasks_by_key = {(t.person_id, t.event_id, t.role_id): t for t in tasks}
+    tasks_created = [tasks_by_key[(t.person.pk, t.event.pk, t.role.pk)]
+                     for t in new_tasks]
 
-            except IntegrityError as e:
-                raise IntegrityError('{0} (for "{1}")'.format(str(e),
-                                                              row_repr))
+    return persons_created, tasks_created
 
-            except ObjectDoesNotExist as e:
-                raise ObjectDoesNotExist('{0} (for "{1}")'.format(str(e),
-                                                                  row_repr))
 
-    return persons_created, tasks_created
+def username_stem(personal, family):
+    '''Base of usernames generated for a person.'''
+    return normalize_name(family) + '_' + normalize_name(personal)
 
 
-def create_username(personal, family, tries=NUM_TRIES):
-    '''Generate unique username.'''
-    stem = normalize_name(family) + '_' + normalize_name(personal)
+def create_username(personal, family, tries=NUM_TRIES, taken=None):
+    '''Generate unique username.  If `taken` (set of usernames already in
+    use) is provided, it's checked instead of the database.'''
+    stem = username_stem(personal, family)
 
     counter = None
     for i in range(tries):  # let's limit ourselves to only 100 tries
@@ -327,6 +572,10 @@ def create_username(personal, family, tries=NUM_TRIES):
             else:
                 counter += 1
                 username = '{0}_{1}'.format(stem, counter)
+            if taken is not None:
+                if username not in taken:
+                    return username
+                continue
             Person.objects.get(username=username)
         except ObjectDoesNotExist:
             return username
@@ -429,6 +678,7 @@ def get_pagination_items(request, all_objects):
 
     # Get parameters.
     items = request.GET.get('items_per_page', ITEMS_PER_PAGE)
+    count = None
     if items != 'all':
         try:
             items = int(items)
@@ -436,13 +686,17 @@ def get_pagination_items(request, all_objects):
             items = ITEMS_PER_PAGE
     else:
         # Show everything.
-        items = all_objects.count()
+        count = all_objects.count()
+        items = max(count, 1)
 
     # Figure out where we are.
     page = request.GET.get('page')
 
     # Show selected items.
     paginator = Paginator(all_objects, items)
+    if count is not None:
+        # don't count the same objects twice
+        paginator.count = count
 
     # Select the pages.
     try:
@@ -459,13 +713,310 @@ def get_pagination_items(request, all_objects):
     return result
 
 
+COUNT_CACHE_TIMEOUT = 60  # seconds
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """Number of objects in `queryset`, remembered for `timeout` seconds, so
+    that browsing many pages of the same listing counts them only once.  The
+    number may be out of date, so it should be presented as approximate."""
+    key = 'count:' + hashlib.sha1(
+        str(queryset.query).encode('utf-8')
+    ).hexdigest()
+    cache = caches['default']
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode ordering keys' values of an object as an URL-safe string.
+
+    Dates and times are encoded in ISO 8601 format with full precision
+    (`DjangoJSONEncoder` would cut microseconds, so objects within the same
+    millisecond would be skipped or repeated); the database parses them back
+    when they're compared with fields' values."""
+    values = [
+        value.isoformat()
+        if isinstance(value, (datetime.date, datetime.time)) else value
+        for value in values
+    ]
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, length):
+    """Decode list of `length` values encoded with `encode_cursor`."""
+    try:
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        )
+    except (ValueError, UnicodeError, binascii.Error) as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+class KeysetPaginator:
+    """Paginate `object_list` by values of its ordering keys instead of
+    offsets (so called keyset or cursor pagination).
+
+    `ordering` is a sequence of field names (optionally prefixed with "-" for
+    descending order, and spanning relationships with "__"); the last one
+    has to be unique, e.g. "pk".  A page starts right after (or ends right
+    before) the object encoded in the cursor, so the database can find it
+    using an index regardless of how deep it is.  NULLs are ordered before
+    other values.
+
+    Pages aren't numbered and total number of objects is only approximate
+    (see `cached_count`)."""
+
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = max(int(per_page), 1)
+        self.ordering = [
+            (name[1:], True) if name.startswith('-') else (name, False)
+            for name in ordering
+        ]
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+    def _order_by(self, reverse):
+        return [
+            F(name).desc(nulls_last=True) if descending != reverse
+            else F(name).asc(nulls_first=True)
+            for name, descending in self.ordering
+        ]
+
+    def _beyond(self, values, reverse):
+        """Condition for objects placed after the object with ordering keys'
+        `values` (or before it, if `reverse`)."""
+        conditions = []
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            if descending != reverse:
+                # objects with lower values
+                if value is not None:
+                    conditions.append(equal & (
+                        Q(**{name + '__lt': value}) |
+                        Q(**{name + '__isnull': True})
+                    ))
+            else:
+                # objects with higher values
+                if value is None:
+                    conditions.append(equal &
+                                      Q(**{name + '__isnull': False}))
+                else:
+                    conditions.append(equal & Q(**{name + '__gt': value}))
+
+            if value is None:
+                equal &= Q(**{name + '__isnull': True})
+            else:
+                equal &= Q(**{name: value})
+
+        if not conditions:
+            return None
+        return reduce(operator.or_, conditions)
+
+    def _values(self, obj):
+        return [reduce(getattr, name.split('__'), obj)
+                for name, _ in self.ordering]
+
+    def cursor(self, obj):
+        """Cursor pointing at `obj`."""
+        return encode_cursor(self._values(obj))
+
+    def page(self, after=None, before=None):
+        """Page of objects following the cursor `after`, or preceding the
+        cursor `before`; first page if neither is provided.  Raises
+        `InvalidCursor`."""
+        reverse = before is not None
+        cursor = before if reverse else after
+
+        objects = self.object_list.order_by(*self._order_by(reverse))
+        if cursor is not None:
+            values = decode_cursor(cursor, len(self.ordering))
+            condition = self._beyond(values, reverse)
+            if condition is None:
+                objects = objects.none()
+            else:
+                objects = objects.filter(condition)
+
+        # one more object tells if there's another page
+        object_list = list(objects[:self.per_page + 1])
+        more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if reverse:
+            object_list.reverse()
+            # objects following the page may have been removed since the
+            # cursor was made
+            has_next = bool(object_list) and self.object_list.filter(
+                self._beyond(self._values(object_list[-1]), False)
+            ).exists()
+            return KeysetPage(object_list, self, has_previous=more,
+                              has_next=has_next)
+        return KeysetPage(object_list, self, has_previous=cursor is not None,
+                          has_next=more)
+
+
+class KeysetPage(collections.abc.Sequence):
+    """Page returned by `KeysetPaginator`."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous and bool(object_list)
+        self._has_next = has_next and bool(object_list)
+
+    def __repr__(self):
+        return '<Page after {}>'.format(self.previous_cursor)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.cursor(self.object_list[0])
+
+
+def get_keyset_pagination_items(request, all_objects, ordering):
+    """Select paginated items using keyset pagination (see
+    `KeysetPaginator`) by `ordering`.
+
+    Requests for a numbered page, for all items or for a custom order (with
+    `order_by` parameter) are paginated by `get_pagination_items`."""
+    if (request.GET.get('page') or request.GET.get('order_by') or
+            request.GET.get('items_per_page') == 'all'):
+        return get_pagination_items(request, all_objects)
+
+    try:
+        items = int(request.GET.get('items_per_page', ITEMS_PER_PAGE))
+    except ValueError:
+        items = ITEMS_PER_PAGE
+
+    paginator = KeysetPaginator(all_objects, items, ordering)
+    try:
+        return paginator.page(after=request.GET.get('after'),
+                              before=request.GET.get('before'))
+    except InvalidCursor:
+        # deliver first page
+        return paginator.page()
+
+
+WEBSITE_REQUEST_TIMEOUT = 30  # seconds
+
+_sessions = threading.local()
+
+
+def version_related_pks(version, field):
+    """List of PKs of objects referenced by relation `field` in a
+    `reversion` version."""
+    value = version.field_dict.get(field.get_attname())
+    if field.many_to_one or field.one_to_one:
+        # an integer or nothing
+        return [value] if value else []
+    return list(value or [])
+
+
+def versions_related_objects(versions, fields):
+    """Objects referenced by relation `fields` in any of `versions`, as
+    a dictionary of {model: {pk: object}}.  Objects of each related model are
+    fetched in one query."""
+    pks = defaultdict(set)
+    for field in fields:
+        if not field.is_relation:
+            continue
+        for version in versions:
+            pks[field.related_model].update(version_related_pks(version,
+                                                                field))
+    return {model: model.objects.in_bulk(list(model_pks))
+            for model, model_pks in pks.items()}
+
+
+def http_session():
+    """`requests.Session` of current thread.  Reusing it keeps connections to
+    websites open between requests."""
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+
+def fetch_website(url):
+    """Return content of the page at `url`.
+
+    Pages are kept in "websites" cache together with their ETag and
+    Last-Modified headers, so that next time the page is requested
+    conditionally and an unchanged page isn't downloaded again (server responds
+    with 304 Not Modified).  Raises `requests.exceptions.HTTPError` for error
+    responses."""
+    cache = caches['websites']
+    key = 'website:' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+    cached = cache.get(key)
+
+    headers = {}
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    response = http_session().get(url, headers=headers,
+                                  timeout=WEBSITE_REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached:
+        # refresh the entry's expiry time
+        cache.set(key, cached)
+        return cached['content']
+
+    response.raise_for_status()  # assert it's 200 OK
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        cache.set(key, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content': response.text,
+        })
+    elif cached:
+        cache.delete(key)
+    return response.text
+
+
 def fetch_event_metadata(event_url):
     """Handle metadata from any event site (works with rendered <meta> metadata and
     YAML metadata in `index.html`)."""
     # fetch page
-    response = requests.get(event_url)
-    response.raise_for_status()  # assert it's 200 OK
-    content = response.text
+    content = fetch_website(event_url)
 
     # find metadata
     metadata = find_metadata_on_event_website(content)
@@ -475,11 +1026,12 @@ def fetch_event_metadata(event_url):
         index_url, repository = generate_url_to_event_index(event_url)
 
         # fetch page
-        response = requests.get(index_url)
-
-        if response.status_code == 200:
+        try:
+            content = fetch_website(index_url)
+        except requests.exceptions.HTTPError:
             # don't throw errors for pages we fall back to
-            content = response.text
+            pass
+        else:
             metadata = find_metadata_on_event_homepage(content)
 
             # add 'slug' metadata if missing
@@ -619,6 +1171,15 @@ def parse_metadata_from_event_website(metadata):
     }
 
 
+def metadata_hash(metadata):
+    """Stable SHA-256 hash of metadata parsed by
+    `parse_metadata_from_event_website`.  Dates may be either `date` objects
+    or ISO-formatted strings, both result in the same hash."""
+    data = json.dumps(metadata, cls=DjangoJSONEncoder, sort_keys=True,
+                      separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
 def validate_metadata_from_event_website(metadata):
     errors = []
     warnings = []
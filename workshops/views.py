@@ -76,6 +76,7 @@ from workshops.filters import (
     DCSelfOrganizedEventRequestFilter,
     TraineeFilter,
     TrainingRequestFilter,
+    ChangesLogFilter,
 )
 from workshops.forms import (
     SearchForm,
@@ -122,6 +123,10 @@ from workshops.forms import (
     SWCEventRequestNoCaptchaForm,
     DCEventRequestNoCaptchaForm,
 )
+from workshops.duplicates import find_duplicates, find_switched
+from workshops.eligibility import update_eligibility
+from workshops.geo import ByAirportDistance
+from workshops.instrumentation import query_budget, view_stats
 from workshops.management.commands.check_for_workshop_websites_updates import (
     Command as WebsiteUpdatesCommand,
 )
@@ -150,7 +155,10 @@ from workshops.models import (
     TrainingProgress,
     TrainingRequirement,
 )
+from workshops.role_counts import update_role_counts
+from workshops.search import rank, search as search_index
 from workshops.util import (
+    get_keyset_pagination_items,
     upload_person_task_csv,
     verify_upload_person_task,
     create_uploaded_persons_tasks,
@@ -158,6 +166,7 @@ from workshops.util import (
     WrongWorkshopURL,
     fetch_event_metadata,
     parse_metadata_from_event_website,
+    metadata_hash,
     validate_metadata_from_event_website,
     assignment_selection,
     get_pagination_items,
@@ -170,6 +179,7 @@ from workshops.util import (
     login_required,
     redirect_with_next_support,
     dict_without_Nones,
+    versions_related_objects,
 )
 
 
@@ -250,12 +260,20 @@ def admin_dashboard(request):
 
 @admin_required
 def changes_log(request):
-    log = Revision.objects.all().select_related('user') \
-                                .prefetch_related('version_set') \
-                                .order_by('-date_created')
-    log = get_pagination_items(request, log)
+    # versions' serialized data isn't needed to list changed objects; it's
+    # loaded only when a diff of a specific version is displayed
+    versions = Version.objects.only('revision', 'object_repr').order_by('pk')
+    log = Revision.objects.select_related('user') \
+                          .prefetch_related(Prefetch('version_set',
+                                                     queryset=versions)) \
+                          .order_by('-date_created', '-pk')
+    filter = ChangesLogFilter(request.GET, queryset=log)
+    log = get_keyset_pagination_items(request, filter.qs,
+                                      ('-date_created', '-pk'))
     context = {
-        'log': log
+        'title': 'Recently changed',
+        'log': log,
+        'filter': filter,
     }
     return render(request, 'workshops/changes_log.html', context)
 
@@ -279,7 +297,10 @@ class AllOrganizations(OnlyForAdminsMixin, AMYListView):
 
 
 class OrganizationDetails(OnlyForAdminsMixin, AMYDetailView):
-    queryset = Organization.objects.all()
+    queryset = Organization.objects.prefetch_related(
+        Prefetch('membership_set',
+                 queryset=Membership.objects.annotate_with_usage()),
+    )
     context_object_name = 'organization'
     template_name = 'workshops/organization.html'
     slug_field = 'domain'
@@ -323,21 +344,21 @@ class AllMemberships(OnlyForAdminsMixin, AMYListView):
     context_object_name = 'all_memberships'
     template_name = 'workshops/all_memberships.html'
     filter_class = MembershipFilter
-    queryset = Membership.objects.annotate(
-        instructor_training_seats_total=(
-            F('seats_instructor_training') +
-            F('additional_instructor_training_seats')
-        ),
-        # for future reference, in case someone would want to implement
-        # this annotation
-        # instructor_training_seats_utilized=(
-        #     Count('task', filter=Q(task__role__name='learner'))
-        # ),
-        instructor_training_seats_remaining=(
-            F('seats_instructor_training') +
-            F('additional_instructor_training_seats') -
-            Count('task', filter=Q(task__role__name='learner'))
-        ),
+    queryset = (
+        Membership.objects
+                  .annotate_with_usage()
+                  .select_related('organization')
+                  .annotate(
+                      instructor_training_seats_total=(
+                          F('seats_instructor_training') +
+                          F('additional_instructor_training_seats')
+                      ),
+                      instructor_training_seats_remaining=(
+                          F('seats_instructor_training') +
+                          F('additional_instructor_training_seats') -
+                          F('seats_instructor_training_utilized')
+                      ),
+                  )
     )
     title = 'All Memberships'
 
@@ -345,8 +366,13 @@ class AllMemberships(OnlyForAdminsMixin, AMYListView):
 class MembershipDetails(OnlyForAdminsMixin, AMYDetailView):
     queryset = (
         Membership.objects
+                  .annotate_with_usage()
                   .select_related('organization')
-                  .prefetch_related('task_set')
+                  .prefetch_related(Prefetch(
+                      'task_set',
+                      queryset=Task.objects.select_related('event', 'person',
+                                                           'role'),
+                  ))
     )
     context_object_name = 'membership'
     template_name = 'workshops/membership.html'
@@ -455,32 +481,15 @@ class AllPersons(OnlyForAdminsMixin, AMYListView):
                                   output_field=IntegerField())),
     )
     title = 'All Persons'
+    keyset_ordering = ('family', 'personal', 'pk')
 
 
 class PersonDetails(OnlyForAdminsMixin, AMYDetailView):
     context_object_name = 'person'
     template_name = 'workshops/person.html'
     pk_url_kwarg = 'person_id'
-    queryset = Person.objects.annotate(
-        num_taught=Count(
-            Case(
-                When(task__role__name='instructor', then=Value(1)),
-                output_field=IntegerField()
-            )
-        ),
-        num_helper=Count(
-            Case(
-                When(task__role__name='helper', then=Value(1)),
-                output_field=IntegerField()
-            )
-        ),
-        num_learner=Count(
-            Case(
-                When(task__role__name='learner', then=Value(1)),
-                output_field=IntegerField()
-            )
-        )
-    ).prefetch_related(
+    query_budget = 20
+    queryset = Person.objects.prefetch_related(
         'award_set__badge', 'award_set__awarded_by', 'award_set__event',
         'task_set__role', 'task_set__event',
     ).select_related('airport')
@@ -937,6 +946,11 @@ def persons_merge(request):
                                                     difficult, choices=data,
                                                     base_a=base_a)
 
+                # tasks, awards and progresses were moved to the base person
+                # without sending signals
+                update_role_counts([base_obj.pk])
+                update_eligibility([base_obj.pk])
+
                 if integrity_errors:
                     msg = ('There were integrity errors when merging related '
                            'objects:\n' '\n'.join(integrity_errors))
@@ -1015,6 +1029,7 @@ class AllEvents(OnlyForAdminsMixin, AMYListView):
 
 
 @admin_required
+@query_budget(15)
 def event_details(request, slug):
     '''List details of a particular event.'''
     try:
@@ -1472,6 +1487,7 @@ def event_accept_metadata_changes(request, slug):
 
     # save serialized metadata
     event.repository_metadata = metadata_serialized
+    event.repository_metadata_hash = metadata_hash(metadata)
 
     # dismiss notification
     event.metadata_all_changes = ''
@@ -1573,6 +1589,7 @@ class AllTasks(OnlyForAdminsMixin, AMYListView):
     queryset = Task.objects.select_related('event', 'person', 'role') \
                            .defer('person__notes', 'event__notes')
     title = 'All Tasks'
+    keyset_ordering = ('role__name', '-event__start', 'event_id', 'pk')
 
 
 @admin_required
@@ -1765,32 +1782,11 @@ def workshop_staff(request):
                            .exclude(person__badges__in=instructor_badges) \
                            .values_list('person__pk', flat=True)
 
-    # we need to count number of specific roles users had
-    # and if they are SWC/DC instructors
-    people = people.annotate(
-        num_taught=Count(
-            Case(
-                When(task__role__name='instructor', then=Value(1)),
-                output_field=IntegerField()
-            )
-        ),
-        num_helper=Count(
-            Case(
-                When(task__role__name='helper', then=Value(1)),
-                output_field=IntegerField()
-            )
-        ),
-        num_organizer=Count(
-            Case(
-                When(task__role__name='organizer', then=Value(1)),
-                output_field=IntegerField()
-            )
-        )
-    )
-
     filter_form = WorkshopStaffForm()
 
     lessons = list()
+    location = None
+    radius = None
 
     if 'submit' in request.GET:
         filter_form = WorkshopStaffForm(request.GET)
@@ -1807,24 +1803,6 @@ def workshop_staff(request):
                         qualification__lesson=lesson
                     )
 
-            if data['airport']:
-                x = data['airport'].latitude
-                y = data['airport'].longitude
-                # using Euclidean distance just because it's faster and easier
-                complex_F = ((F('airport__latitude') - x) ** 2 +
-                             (F('airport__longitude') - y) ** 2)
-                people = people.annotate(distance=complex_F) \
-                               .order_by('distance', 'family')
-
-            if data['latitude'] and data['longitude']:
-                x = data['latitude']
-                y = data['longitude']
-                # using Euclidean distance just because it's faster and easier
-                complex_F = ((F('airport__latitude') - x) ** 2 +
-                             (F('airport__longitude') - y) ** 2)
-                people = people.annotate(distance=complex_F) \
-                               .order_by('distance', 'family')
-
             if data['country']:
                 people = people.filter(
                     Q(airport__country__in=data['country']) |
@@ -1838,8 +1816,8 @@ def workshop_staff(request):
                 for badge in data['instructor_badges']:
                     people = people.filter(badges__name=badge)
 
-            # it's faster to count role=helper occurences than to check if user
-            # had a role=helper
+            # role counts are stored in indexed fields, so it's faster to
+            # check them than to look for tasks with role=helper
             if data['was_helper']:
                 people = people.filter(num_helper__gte=1)
 
@@ -1859,7 +1837,25 @@ def workshop_staff(request):
                 for language in data['languages']:
                     people = people.filter(languages=language)
 
-    emails = people.filter(may_contact=True).values_list('email', flat=True)
+            if data['airport']:
+                location = (data['airport'].latitude,
+                            data['airport'].longitude)
+            if data['latitude'] and data['longitude']:
+                location = (data['latitude'], data['longitude'])
+            radius = data['radius']
+
+    # filtering by related objects can return the same person many times
+    people = people.distinct()
+
+    if location:
+        # nearest people first; distance is calculated only for people from
+        # airports close enough to fill the requested page
+        people = ByAirportDistance(people, *location, radius=radius,
+                                   ordering=('distance', 'family'))
+        emails = people.matching()
+    else:
+        emails = people
+    emails = emails.filter(may_contact=True).values_list('email', flat=True)
     people = get_pagination_items(request, people)
     context = {
         'title': 'Find Workshop Staff',
@@ -1891,15 +1887,18 @@ def search(request):
             results = list()
 
             if form.cleaned_data['in_organizations']:
-                organizations = Organization.objects.filter(
+                organizations = search_index(
+                    Organization.objects.order_by('fullname'), term,
                     Q(domain__icontains=term) |
                     Q(fullname__icontains=term) |
-                    Q(notes__icontains=term)) \
-                    .order_by('fullname')
-                results += list(organizations)
+                    Q(notes__icontains=term))
+                organizations = rank(organizations, term)
+                results += organizations
 
             if form.cleaned_data['in_events']:
-                events = Event.objects.filter(
+                events = search_index(
+                    Event.objects.select_related('host').order_by('-slug'),
+                    term,
                     Q(slug__icontains=term) |
                     Q(notes__icontains=term) |
                     Q(host__domain__icontains=term) |
@@ -1907,9 +1906,9 @@ def search(request):
                     Q(url__icontains=term) |
                     Q(contact__icontains=term) |
                     Q(venue__icontains=term) |
-                    Q(address__icontains=term)
-                ).order_by('-slug')
-                results += list(events)
+                    Q(address__icontains=term))
+                events = rank(events, term)
+                results += events
 
             if form.cleaned_data['in_persons']:
                 # if user searches for two words, assume they mean a person
@@ -1921,34 +1920,38 @@ def search(request):
                     ) | (
                         Q(personal__icontains=name2) & Q(family__icontains=name1)
                     ) | Q(email__icontains=term) | Q(github__icontains=term)
-                    persons = Person.objects.filter(complex_q)
+                    persons = search_index(Person.objects.all(), term,
+                                           complex_q)
                 else:
-                    persons = Person.objects.filter(
+                    persons = search_index(
+                        Person.objects.order_by('family'), term,
                         Q(personal__icontains=term) |
                         Q(family__icontains=term) |
                         Q(email__icontains=term) |
-                        Q(github__icontains=term)) \
-                        .order_by('family')
-                results += list(persons)
+                        Q(github__icontains=term))
+                persons = rank(persons, term)
+                results += persons
 
             if form.cleaned_data['in_airports']:
-                airports = Airport.objects.filter(
+                airports = search_index(
+                    Airport.objects.order_by('iata'), term,
                     Q(iata__icontains=term) |
-                    Q(fullname__icontains=term)) \
-                    .order_by('iata')
-                results += list(airports)
+                    Q(fullname__icontains=term))
+                airports = rank(airports, term)
+                results += airports
 
             if form.cleaned_data['in_training_requests']:
-                training_requests = TrainingRequest.objects.filter(
+                training_requests = search_index(
+                    TrainingRequest.objects.all(), term,
                     Q(group_name__icontains=term) |
                     Q(family__icontains=term) |
                     Q(email__icontains=term) |
                     Q(github__icontains=term) |
                     Q(affiliation__icontains=term) |
                     Q(location__icontains=term) |
-                    Q(comment__icontains=term)
-                )
-                results += list(training_requests)
+                    Q(comment__icontains=term))
+                training_requests = rank(training_requests, term)
+                results += training_requests
 
             # only 1 record found? Let's move to it immediately
             if len(results) == 1:
@@ -2152,20 +2155,20 @@ def membership_trainings_stats(request):
     data = (
         Membership.objects
             # .filter(agreement_end__gte=today, agreement_start__lte=today)
+            .annotate_with_usage()
             .select_related('organization')
-            .prefetch_related('task_set')
             .annotate(
                 instructor_training_seats_total=(
                     F('seats_instructor_training') +
                     F('additional_instructor_training_seats')
                 ),
                 instructor_training_seats_utilized=(
-                    Count('task', filter=Q(task__role__name='learner'))
+                    F('seats_instructor_training_utilized')
                 ),
                 instructor_training_seats_remaining=(
                     F('seats_instructor_training') +
                     F('additional_instructor_training_seats') -
-                    Count('task', filter=Q(task__role__name='learner'))
+                    F('seats_instructor_training_utilized')
                 ),
             )
     )
@@ -2318,6 +2321,13 @@ def object_changes(request, version_id):
         previous_version = current_version
         obj_prev = obj
 
+    # fields excluded from versions (e.g. `Person.num_taught`) are skipped
+    fields = [
+        f for f in obj._meta.get_fields()
+        if f.concrete and (f.many_to_many or
+                           f.attname in current_version.field_dict)
+    ]
+
     context = {
         'object_prev': obj_prev,
         'object': obj,
@@ -2326,10 +2336,12 @@ def object_changes(request, version_id):
         'revision': current_version.revision,
         'title': str(obj),
         'verbose_name': obj._meta.verbose_name,
-        'fields': [
-            f for f in obj._meta.get_fields()
-            if f.concrete
-        ],
+        'fields': fields,
+        # objects referenced by both versions, fetched with one query per
+        # related model
+        'related_objects': versions_related_objects(
+            [previous_version, current_version], fields,
+        ),
     }
     return render(request, 'workshops/object_diff.html', context)
 
@@ -3038,38 +3050,19 @@ def duplicate_persons(request):
 
     Criteria for persons:
     * switched personal/family names
-    * same name on different people."""
-    names_normal = set(Person.objects.all().values_list('personal', 'family'))
-    names_switched = set(Person.objects.all().values_list('family',
-                                                          'personal'))
-    names = names_normal & names_switched  # intersection
-
-    switched_criteria = Q(id=0)
-    # empty query results if names is empty
-    for personal, family in names:
-        # get people who appear in `names`
-        switched_criteria |= (Q(personal=personal) & Q(family=family))
-
-    switched_persons = Person.objects.filter(switched_criteria) \
-                                     .order_by('email')
-
-    duplicate_names = Person.objects.values('personal', 'family') \
-                                    .order_by() \
-                                    .annotate(count_id=Count('id')) \
-                                    .filter(count_id__gt=1)
-
-    duplicate_criteria = Q(id=0)
-    for name in duplicate_names:
-        # get people who appear in `names`
-        duplicate_criteria |= (Q(personal=name['personal']) &
-                               Q(family=name['family']))
-    duplicate_persons = Person.objects.filter(duplicate_criteria) \
-                                      .order_by('family', 'personal', 'email')
+    * same name on different people
+    * similarly sounding names."""
+    switched_persons = find_switched(Person.objects.all()).order_by('email')
+    duplicate_persons = find_duplicates(Person.objects.all(), 'name') \
+        .order_by('duplicate_key', 'family', 'personal', 'email')
+    similar_persons = find_duplicates(Person.objects.all(), 'phonetic') \
+        .order_by('duplicate_key', 'family', 'personal', 'email')
 
     context = {
         'title': 'Possible duplicate persons',
         'switched_persons': switched_persons,
         'duplicate_persons': duplicate_persons,
+        'similar_persons': similar_persons,
     }
 
     return render(request, 'workshops/duplicate_persons.html', context)
@@ -3083,31 +3076,12 @@ def duplicate_training_requests(request):
     * the same name
     * the same email.
     """
-    names = (
-        TrainingRequest.objects
-            .values('personal', 'family')
-            .order_by('family', 'personal')
-            .annotate(count_id=Count('id'))
-            .filter(count_id__gt=1)
-    )
-    duplicate_names_criteria = Q(id=0)
-    for name in names:
-        duplicate_names_criteria |= (Q(personal=name['personal']) &
-                                     Q(family=name['family']))
-
-    emails = (
-        TrainingRequest.objects
-            .values_list('email', flat=True)
-            .order_by('family', 'personal')
-            .annotate(count_id=Count('id'))
-            .filter(count_id__gt=1)
-    )
-    duplicate_emails_criteria = Q(id=0)
-    for email in emails:
-        duplicate_emails_criteria |= Q(email=email)
-
-    duplicate_names = TrainingRequest.objects.filter(duplicate_names_criteria).order_by('family', 'personal')
-    duplicate_emails = TrainingRequest.objects.filter(duplicate_emails_criteria).order_by('email')
+    duplicate_names = \
+        find_duplicates(TrainingRequest.objects.all(), 'name') \
+        .order_by('duplicate_key', 'family', 'personal')
+    duplicate_emails = \
+        find_duplicates(TrainingRequest.objects.all(), 'email') \
+        .order_by('duplicate_key', 'email')
 
     context = {
         'title': 'Possible duplicate training requests',
@@ -3119,6 +3093,13 @@ def duplicate_training_requests(request):
                   context)
 
 
+@admin_required
+def query_stats(request):
+    """Database queries statistics of views, in Prometheus text format."""
+    return HttpResponse(view_stats.prometheus(),
+                        content_type='text/plain; version=0.0.4')
+
+
 @admin_required
 def all_trainingrequests(request):
     filter = TrainingRequestFilter(
@@ -3505,7 +3486,8 @@ def training_progress(request):
     swc_form = SendHomeworkForm(submit_name='swc-submit')
     dc_form = SendHomeworkForm(submit_name='dc-submit')
 
-    # Add information about instructor training progress to request.user.
+    # Add information about instructor training progress and awarded
+    # instructor badges to request.user.
     request.user = Person.objects.annotate_with_instructor_eligibility() \
                                  .get(pk=request.user.pk)
 
@@ -3519,12 +3501,6 @@ def training_progress(request):
     request.user.dc_homework_in_evaluation = (
         last_dc_homework is not None and last_dc_homework.state == 'n')
 
-    # Add information about awarded instructor badges to request.user.
-    request.user.is_swc_instructor = request.user.award_set.filter(
-        badge__name='swc-instructor').exists()
-    request.user.is_dc_instructor = request.user.award_set.filter(
-        badge__name='dc-instructor').exists()
-
     if request.method == 'POST' and 'swc-submit' in request.POST:
         requirement = TrainingRequirement.objects.get(name='SWC Homework')
         progress = TrainingProgress(trainee=request.user,
@@ -3610,6 +3586,7 @@ class TrainingProgressDelete(RedirectSupportMixin, OnlyForAdminsMixin,
 
 
 @admin_required
+@query_budget(10)
 def all_trainees(request):
     filter = TraineeFilter(
         request.GET,
@@ -3627,16 +3604,6 @@ def all_trainees(request):
                 'trainingprogress_set__requirement',
                 'trainingprogress_set__evaluated_by',
             )
-            .annotate(
-                is_swc_instructor=Sum(Case(When(badges__name='swc-instructor',
-                                                then=1),
-                                           default=0,
-                                           output_field=IntegerField())),
-                is_dc_instructor=Sum(Case(When(badges__name='dc-instructor',
-                                               then=1),
-                                          default=0,
-                                          output_field=IntegerField())),
-        )
     )
     trainees = get_pagination_items(request, filter.qs)
 
@@ -3645,9 +3612,11 @@ def all_trainees(request):
         form = BulkAddTrainingProgressForm()
         discard_form = BulkDiscardProgressesForm(request.POST)
         if discard_form.is_valid():
-            for trainee in discard_form.cleaned_data['trainees']:
-                TrainingProgress.objects.filter(trainee=trainee)\
-                                        .update(discarded=True)
+            trainees = discard_form.cleaned_data['trainees']
+            TrainingProgress.objects.filter(trainee__in=trainees) \
+                                    .update(discarded=True)
+            # progresses were discarded without sending signals
+            update_eligibility(trainee.pk for trainee in trainees)
             messages.success(request, 'Successfully discarded progress of '
                                       'all selected trainees.')
 